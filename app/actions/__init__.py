@@ -1,17 +1,62 @@
+from collections.abc import Mapping
+from types import MappingProxyType
+
 from .core import *
 
 
+class ActionHandlers(Mapping):
+    """
+    Read-only mapping of the action handlers: {action_id: (func, config model, data model)}.
+    Handlers are discovered on first access, so importing the app doesn't import the handlers module
+    and the API clients and schemas it depends on.
+    """
+
+    def __init__(self, module_name: str, prefix: str):
+        self.module_name = module_name
+        self.prefix = prefix
+        self._handlers = None
+
+    def _get_handlers(self):
+        if self._handlers is None:
+            self._handlers = MappingProxyType(discover_actions(module_name=self.module_name, prefix=self.prefix))
+        return self._handlers
+
+    def __getitem__(self, action_id):
+        return self._get_handlers()[action_id]
+
+    def __iter__(self):
+        return iter(self._get_handlers())
+
+    def __len__(self):
+        return len(self._get_handlers())
+
+
 def setup_action_handlers():
-    return discover_actions(module_name="app.actions.handlers", prefix="action_")
+    return ActionHandlers(module_name="app.actions.handlers", prefix="action_")
+
+
+def get_handlers_by_data_type():
+    """
+    Returns the push action handlers by the name of their data model: {type name: (action_id, func, config, data model)}
+    """
+    global _handlers_by_data_type
+    handlers, index = _handlers_by_data_type
+    if handlers is not action_handlers:  # Rebuilt if the handlers are replaced (e.g. in tests)
+        index = MappingProxyType({
+            data_model.__name__: (action_id, func, config_model, data_model)
+            for action_id, (func, config_model, data_model) in action_handlers.items()
+            if data_model
+        })
+        _handlers_by_data_type = (action_handlers, index)
+    return index
 
 
 def get_action_handler_by_data_type(type_name: str):
-    for action_id, value in action_handlers.items():
-        func, config_model, data_model = value
-        if data_model and data_model.__name__ == type_name.strip():
-            return action_id, func, config_model, data_model
-    else:
+    try:
+        return get_handlers_by_data_type()[type_name.strip()]
+    except KeyError:
         raise ValueError(f"No action handler found for data type '{type_name}'.")
 
 
 action_handlers = setup_action_handlers()
+_handlers_by_data_type = (None, MappingProxyType({}))
@@ -4,7 +4,9 @@ import pydantic
 
 from datetime import datetime, timezone
 from typing import Optional
+from app.services.metrics import observe_duration
 from app.services.state import IntegrationStateManager
+from app.services.tracing import traced, tracer
 
 
 logger = logging.getLogger(__name__)
@@ -60,6 +62,8 @@ class VectronicBadRequestException(Exception):
         super().__init__(f"'{self.status_code}: {self.message}, Error: {self.error}'")
 
 
+@traced("vectronic.get_observations")
+@observe_duration("vectronic")
 async def get_observations(integration, base_url, config):
     async with httpx.AsyncClient(timeout=httpx.Timeout(connect=10.0, read=30.0, write=15.0, pool=5.0)) as session:
         logger.info(f"-- Getting observations for integration ID: {integration.id} Collar ID: {config.collar_id} --")
@@ -76,9 +80,11 @@ async def get_observations(integration, base_url, config):
             if response.is_error:
                 logger.error(f"Error 'get_observations'. Response body: {response.text}")
             response.raise_for_status()
-            parsed_response = response.json()
-            if parsed_response:
-                return [VectronicObservation.parse_obj(item) for item in parsed_response]
+            with tracer.start_as_current_span("vectronic.parse_observations"):
+                parsed_response = response.json()
+                observations = [VectronicObservation.parse_obj(item) for item in parsed_response or []]
+            if observations:
+                return observations
             else:
                 logger.warning(f"-- No observations returned for integration ID: {integration.id} Collar ID: {config.collar_id}: {response.text}  --")
                 return []
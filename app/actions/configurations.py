@@ -1,6 +1,7 @@
 import pydantic
 
 from datetime import datetime, timezone
+from typing import Optional
 
 from app.actions.core import PullActionConfiguration, InternalActionConfiguration
 from app.services.errors import ConfigurationNotFound
@@ -8,6 +9,8 @@ from app.services.utils import find_config_for_action, FieldWithUIOptions
 
 
 MAX_LOOKBACK_HOURS = 168  # 7 days
+DEFAULT_MAX_STALENESS_HOURS = 6
+MAX_DISPATCH_WINDOW_SECONDS = 300  # Must fit within MAX_ACTION_EXECUTION_TIME
 
 
 class PullObservationsConfig(PullActionConfiguration):
@@ -22,16 +25,41 @@ class PullObservationsConfig(PullActionConfiguration):
         ge=1,
         le=MAX_LOOKBACK_HOURS
     )
+    adaptive_polling: bool = FieldWithUIOptions(
+        True,
+        title="Adaptive Polling",
+        description="Skip collars that are not expected to have new fixes yet, based on their observed fix interval",
+    )
+    max_staleness_hours: int = FieldWithUIOptions(
+        DEFAULT_MAX_STALENESS_HOURS,
+        title="Maximum Staleness (Hours)",
+        description="A collar is always polled if its last fix is older than this, regardless of its fix interval",
+        ge=1,
+        le=MAX_LOOKBACK_HOURS
+    )
+    dispatch_window_seconds: int = FieldWithUIOptions(
+        0,
+        title="Dispatch Window (Seconds)",
+        description="Spread collar fetches across this many seconds, each collar at a fixed offset (0 = trigger all at once)",
+        ge=0,
+        le=MAX_DISPATCH_WINDOW_SECONDS
+    )
 
 
 class PullCollarObservationsConfig(InternalActionConfiguration):
     start: datetime
     collar_id: int
     collar_key: str
+    # Used to learn the collar fix interval for adaptive polling
+    last_fix_time: Optional[datetime] = None
+    fix_interval_seconds: Optional[float] = None
+    # Used to back off collars failing with 403/404
+    fingerprint: Optional[str] = None
+    quarantined: bool = False
 
-    @pydantic.validator('start', always=True)
+    @pydantic.validator('start', 'last_fix_time', always=True)
     def parse_time_string(cls, v):
-        if not v.tzinfo:
+        if v and not v.tzinfo:
             return v.replace(tzinfo=timezone.utc)
         return v
 
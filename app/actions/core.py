@@ -68,4 +68,5 @@ def discover_actions(module_name, prefix):
 
 
 def get_actions():
-    return list(discover_actions(module_name="app.actions.handlers", prefix="action_").keys())
+    from app.actions import action_handlers  # Discovered once, on first use
+    return list(action_handlers.keys())
@@ -1,17 +1,25 @@
+import asyncio
+import hashlib
 import json
 import logging
+import statistics
+import time
 import httpx
 import pydantic
 
 import app.actions.client as client
 
 from gundi_core.schemas.v2 import LogLevel
+from app import settings
 from datetime import datetime, timedelta, timezone
 from app.actions.configurations import PullObservationsConfig, PullCollarObservationsConfig
 from app.services.action_scheduler import trigger_action
 from app.services.activity_logger import activity_logger, log_action_activity
+from app.services.concurrency import set_action_priority
+from app.services.core import ActionPriorityEnum
 from app.services.gundi import send_observations_to_gundi
 from app.services.state import IntegrationStateManager
+from app.services.tracing import tracer
 from app.services.utils import generate_batches
 
 
@@ -20,6 +28,8 @@ state_manager = IntegrationStateManager()
 
 
 VECTRONIC_BASE_URL = "https://api.vectronic-wildlife.com"
+BACKFILL_THRESHOLD_HOURS = 24  # Fetches looking back further than this run with low priority
+FIX_INTERVAL_SMOOTHING = 0.3  # Weight given to the latest estimate when updating a collar's fix interval
 
 
 class CollarData(pydantic.BaseModel):
@@ -32,6 +42,10 @@ class CollarData(pydantic.BaseModel):
     class Config:
         allow_population_by_field_name = True
 
+    def fingerprint(self):
+        # Used to detect changes in the collar settings (e.g. a new key) without storing them
+        return hashlib.sha256(self.json(sort_keys=True).encode("utf-8")).hexdigest()
+
 
 def transform(observation):
     additional_info = {
@@ -54,11 +68,78 @@ def transform(observation):
     }
 
 
+def estimate_fix_interval(acquisition_times, previous_interval=None, last_fix_time=None):
+    """
+    Learns the fix interval of a collar (in seconds) from the acquisition times of its observations.
+    The median gap between consecutive fixes is blended with the previous estimate, if there is one.
+    """
+    times = sorted(acquisition_times)
+    if last_fix_time:
+        times = [last_fix_time] + [t for t in times if t > last_fix_time]
+    gaps = [(later - earlier).total_seconds() for earlier, later in zip(times, times[1:]) if later > earlier]
+    if not gaps:
+        return previous_interval
+    latest_interval = statistics.median(gaps)
+    if not previous_interval:
+        return latest_interval
+    return FIX_INTERVAL_SMOOTHING * latest_interval + (1 - FIX_INTERVAL_SMOOTHING) * previous_interval
+
+
+def get_next_poll_time(device_state, max_staleness):
+    """
+    Predicts when a collar will have a new fix available, based on its last fix and learned fix interval.
+    Collars that didn't report since the last poll wait one more interval, so those that stopped reporting aren't
+    polled every time. The wait is never longer than max_staleness. Returns None if there isn't enough data.
+    """
+    updated_at = device_state.get("updated_at")
+    fix_interval = device_state.get("fix_interval_seconds")
+    if not updated_at or not fix_interval:
+        return None
+    interval = min(timedelta(seconds=fix_interval), max_staleness)
+    next_poll_time = datetime.fromisoformat(updated_at).replace(tzinfo=timezone.utc) + interval
+    if last_polled_at := device_state.get("last_polled_at"):
+        next_poll_time = max(next_poll_time, datetime.fromisoformat(last_polled_at).replace(tzinfo=timezone.utc) + interval)
+    return next_poll_time
+
+
+def get_collar_source_id(collar_id) -> str:
+    """
+    The source ID of a collar in the integration state (quarantine, device state, leases).
+    Collar IDs are read as strings from the collars file and as integers from the fetch config, so both are normalized.
+    """
+    collar_id = str(collar_id).strip()
+    return str(int(collar_id)) if collar_id.isdigit() else collar_id
+
+
+def get_dispatch_offset(collar_id, window_seconds):
+    """
+    Returns a stable offset (in seconds) within the dispatch window for a collar, derived from a hash of its ID.
+    Collars keep the same slot across runs, so the load is spread evenly and fetches stay periodic.
+    """
+    if not window_seconds:
+        return 0.0
+    collar_hash = int.from_bytes(hashlib.sha256(str(collar_id).encode("utf-8")).digest()[:8], "big")
+    return (collar_hash % (window_seconds * 1000)) / 1000
+
+
+def get_fetch_priority(config_overrides):
+    """
+    Incremental collar fetches are cheap and run with high priority, while large backfills run with low priority.
+    """
+    action_config = PullCollarObservationsConfig.parse_obj(config_overrides)
+    if datetime.now(timezone.utc) - action_config.start > timedelta(hours=BACKFILL_THRESHOLD_HOURS):
+        return ActionPriorityEnum.LOW
+    return ActionPriorityEnum.HIGH
+
+
 @activity_logger()
+@set_action_priority(ActionPriorityEnum.LOW)  # The fan-out can wait for the collar fetches
 async def action_pull_observations(integration, action_config: PullObservationsConfig):
     logger.info(f"Executing 'pull_observations' action with integration ID {integration.id} and action_config {action_config}...")
 
     collars_triggered = 0
+    collars_skipped = 0
+    collars_quarantined = 0
 
     try:
         # Turn string JSON into list of dicts
@@ -69,30 +150,72 @@ async def action_pull_observations(integration, action_config: PullObservationsC
 
     if not collars:
         logger.warning(f"No valid collars found for integration ID {integration.id} and action_config {action_config}")
-        return {"status": "success", "collars_triggered": 0}
+        return {"status": "success", "collars_triggered": 0, "collars_skipped": 0, "collars_quarantined": 0}
 
+    dispatch_queue = []
     try:
+        # Collars that failed with 403/404 recently are backing off
+        quarantine = await state_manager.get_failures(integration_id=integration.id, action_id="pull_observations")
         for collar in collars:
             parsed_collar = CollarData.parse_obj(collar["parsedData"])
-            logger.info(f"Triggering 'action_fetch_collar_observations' action for collar {parsed_collar.collar_id} to extract observations...")
             now = datetime.now(timezone.utc)
+            fingerprint = parsed_collar.fingerprint()
+            source_id = get_collar_source_id(parsed_collar.collar_id)
+            if failure := quarantine.get(source_id):
+                if failure.get("fingerprint") != fingerprint:
+                    logger.info(f"Settings changed for collar {parsed_collar.collar_id}. Releasing it from quarantine.")
+                    await state_manager.clear_failure(
+                        integration_id=integration.id,
+                        action_id="pull_observations",
+                        source_id=source_id
+                    )
+                    failure = None
+                elif now < datetime.fromisoformat(failure["retry_at"]):
+                    logger.info(f"Skipping quarantined collar {parsed_collar.collar_id} until {failure['retry_at']}")
+                    collars_quarantined += 1
+                    continue
             device_state = await state_manager.get_state(
                 integration_id=integration.id,
                 action_id="pull_observations",
-                source_id=parsed_collar.collar_id
+                source_id=source_id
             )
-            if not device_state:
+            if device_state and action_config.adaptive_polling:
+                next_poll_time = get_next_poll_time(
+                    device_state=device_state,
+                    max_staleness=timedelta(hours=action_config.max_staleness_hours)
+                )
+                if next_poll_time and now < next_poll_time:
+                    logger.info(f"Skipping collar {parsed_collar.collar_id}. No new fixes expected until {next_poll_time.isoformat()}")
+                    collars_skipped += 1
+                    continue
+
+            if not device_state or not device_state.get("updated_at"):  # No fixes yet, maybe polled already
                 logger.info(f"Setting initial lookback hours for device {parsed_collar.collar_id} to {action_config.default_lookback_hours}")
                 start = now - timedelta(hours=action_config.default_lookback_hours)
+                last_fix_time = None
             else:
                 logger.info(f"Setting begin time for device {parsed_collar.collar_id} to {device_state.get('updated_at')}")
                 start = datetime.fromisoformat(device_state.get("updated_at")).replace(tzinfo=timezone.utc)
+                last_fix_time = start
 
             parsed_config = PullCollarObservationsConfig(
                 start=start,
                 collar_id=int(parsed_collar.collar_id),
-                collar_key=parsed_collar.key
+                collar_key=parsed_collar.key,
+                last_fix_time=last_fix_time,
+                fix_interval_seconds=device_state.get("fix_interval_seconds") if device_state else None,
+                fingerprint=fingerprint,
+                quarantined=bool(failure)
             )
+            offset = get_dispatch_offset(parsed_collar.collar_id, window_seconds=action_config.dispatch_window_seconds)
+            dispatch_queue.append((offset, parsed_config))
+
+        # Trigger the fetch actions spread across the dispatch window, to avoid load spikes in the upstream APIs
+        dispatch_start = time.monotonic()
+        for offset, parsed_config in sorted(dispatch_queue, key=lambda item: item[0]):
+            if (delay := offset - (time.monotonic() - dispatch_start)) > 0:
+                await asyncio.sleep(delay)
+            logger.info(f"Triggering 'action_fetch_collar_observations' action for collar {parsed_config.collar_id} to extract observations...")
             await trigger_action(integration.id, "fetch_collar_observations", config=parsed_config)
             collars_triggered += 1
 
@@ -100,76 +223,145 @@ async def action_pull_observations(integration, action_config: PullObservationsC
         logger.error(f"Failed to process collars from integration ID {integration.id} and action_config {action_config}")
         raise e
 
-    return {"status": "success", "collars_triggered": collars_triggered}
+    return {
+        "status": "success",
+        "collars_triggered": collars_triggered,
+        "collars_skipped": collars_skipped,
+        "collars_quarantined": collars_quarantined
+    }
+
+
+async def quarantine_collar(integration, action_config, reason):
+    failure = await state_manager.record_failure(
+        integration_id=integration.id,
+        action_id="pull_observations",
+        source_id=get_collar_source_id(action_config.collar_id),
+        reason=reason,
+        fingerprint=action_config.fingerprint,
+        backoff_initial=settings.COLLAR_FAILURE_BACKOFF_INITIAL_MINUTES * 60,
+        backoff_max=settings.COLLAR_FAILURE_BACKOFF_MAX_HOURS * 3600
+    )
+    logger.info(
+        f"Collar {action_config.collar_id} quarantined after {failure['failure_count']} failures. Retry at {failure['retry_at']}"
+    )
+    return failure
 
 
 @activity_logger()
+@set_action_priority(get_fetch_priority)
 async def action_fetch_collar_observations(integration, action_config: PullCollarObservationsConfig):
     logger.info(f"Executing 'fetch_collar_observations' action with integration ID {integration.id} and action_config {action_config}...")
 
+    # Only one fetch at a time per collar, so concurrent runs don't race on the collar state
+    lease_token = await state_manager.acquire_lease(
+        integration_id=integration.id,
+        action_id="pull_observations",
+        source_id=get_collar_source_id(action_config.collar_id),
+        ttl=settings.MAX_ACTION_EXECUTION_TIME
+    )
+    if not lease_token:
+        logger.info(f"Observations for collar {action_config.collar_id} are being fetched by another execution. Skipping...")
+        return {"observations_extracted": 0}
+    try:
+        return await fetch_collar_observations(integration, action_config, lease_token=lease_token)
+    finally:
+        await state_manager.release_lease(
+            integration_id=integration.id,
+            action_id="pull_observations",
+            source_id=get_collar_source_id(action_config.collar_id),
+            lease_token=lease_token
+        )
+
+
+async def fetch_collar_observations(integration, action_config: PullCollarObservationsConfig, lease_token: int):
     base_url = integration.base_url or VECTRONIC_BASE_URL
     transformed_data = []
     observations_extracted = 0
 
     try:
+        polled_at = datetime.now(timezone.utc)
         observations = await client.get_observations(integration, base_url, action_config)
+        if action_config.quarantined:  # The collar is healthy again
+            await state_manager.clear_failure(
+                integration_id=integration.id,
+                action_id="pull_observations",
+                source_id=get_collar_source_id(action_config.collar_id)
+            )
+        # The poll time is saved even without new fixes, so collars that stopped reporting aren't polled every time.
+        # The last fix and the fix interval are kept until there are new fixes
+        state = {"last_polled_at": polled_at.strftime("%Y-%m-%dT%H:%M:%S")}
+        if action_config.last_fix_time:
+            state["updated_at"] = action_config.last_fix_time.strftime("%Y-%m-%dT%H:%M:%S")
+        if action_config.fix_interval_seconds:
+            state["fix_interval_seconds"] = action_config.fix_interval_seconds
         if observations:
             logger.info(f"Extracted {len(observations)} observations for collar {action_config.collar_id}")
 
-            for ob in observations:
-                if ob.latitude is None or ob.longitude is None:
-                    message = f"Collar ID {ob.id_collar} got an invalid observation (location is invalid). Skipping..."
-                    logger.warning(message)
-                    await log_action_activity(
-                        integration_id=integration.id,
-                        action_id="fetch_collar_observations",
-                        level=LogLevel.WARNING,
-                        title=message,
-                        data={"observation": ob.dict()}
-                    )
-                    continue
-                transformed_data.append(transform(ob))
+            with tracer.start_as_current_span("transform_observations", attributes={"observations": len(observations)}):
+                for ob in observations:
+                    if ob.latitude is None or ob.longitude is None:
+                        message = f"Collar ID {ob.id_collar} got an invalid observation (location is invalid). Skipping..."
+                        logger.warning(message)
+                        await log_action_activity(
+                            integration_id=integration.id,
+                            action_id="fetch_collar_observations",
+                            level=LogLevel.WARNING,
+                            title=message,
+                            data={"observation": ob.dict()}
+                        )
+                        continue
+                    transformed_data.append(transform(ob))
 
             if transformed_data:
                 for i, batch in enumerate(generate_batches(transformed_data, 200)):
                     logger.info(f'Sending observations batch #{i}: {len(batch)} observations. Collar: {action_config.collar_id}')
-                    response = await send_observations_to_gundi(observations=batch, integration_id=integration.id)
+                    with tracer.start_as_current_span("gundi.send_observations", attributes={"batch": i, "observations": len(batch)}):
+                        response = await send_observations_to_gundi(observations=batch, integration_id=integration.id)
                     observations_extracted += len(response)
 
-                # Save latest device updated_at
+                # Save latest device updated_at, and the fix interval learned so far for adaptive polling
                 latest_time = max(observations, key=lambda obs: obs.acquisition_time).acquisition_time
-                state = {"updated_at": latest_time.strftime("%Y-%m-%dT%H:%M:%S")}
-
-                await state_manager.set_state(
-                    integration_id=integration.id,
-                    action_id="pull_observations",
-                    state=state,
-                    source_id=str(action_config.collar_id)
+                state["updated_at"] = latest_time.strftime("%Y-%m-%dT%H:%M:%S")
+                fix_interval = estimate_fix_interval(
+                    acquisition_times=[ob.acquisition_time for ob in observations],
+                    previous_interval=action_config.fix_interval_seconds,
+                    last_fix_time=action_config.last_fix_time
                 )
+                if fix_interval:
+                    state["fix_interval_seconds"] = fix_interval
 
-            return {"observations_extracted": observations_extracted}
-        else:
-            return {"observations_extracted": 0}
+        state_saved = await state_manager.set_state(
+            integration_id=integration.id,
+            action_id="pull_observations",
+            state=state,
+            source_id=get_collar_source_id(action_config.collar_id),
+            lease_token=lease_token
+        )
+        if not state_saved:
+            logger.warning(f"Lease expired for collar {action_config.collar_id}. State not saved: {state}")
+        return {"observations_extracted": observations_extracted}
     except client.VectronicForbiddenException as e:
         message = f"Unauthorized response from Vectronic with integration {integration.id} using {action_config}. Exception: {e}"
         logger.warning(message)
+        failure = await quarantine_collar(integration, action_config, reason="forbidden")
         await log_action_activity(
             integration_id=integration.id,
             action_id="fetch_collar_observations",
             level=LogLevel.WARNING,
             title="Unauthorized access (bad collar key and/or collar ID)",
-            data={"message": message, "data": action_config}
+            data={"message": message, "data": action_config, "quarantine": failure}
         )
         return {"observations_extracted": 0}
     except client.VectronicNotFoundException as e:
         message = f"Collar ID {action_config.collar_id} not found. Integration {integration.id} using {action_config}. Exception: {e}"
         logger.warning(message)
+        failure = await quarantine_collar(integration, action_config, reason="not_found")
         await log_action_activity(
             integration_id=integration.id,
             action_id="fetch_collar_observations",
             level=LogLevel.WARNING,
             title=f"Collar ID {action_config.collar_id} not found.",
-            data={"message": message, "data": action_config}
+            data={"message": message, "data": action_config, "quarantine": failure}
         )
         return {"observations_extracted": 0}
     except httpx.HTTPStatusError as e:
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import pytest
+from gundi_core.events.transformers import ObservationTransformedER
+
+import app.actions
+from app.actions import get_action_handler_by_data_type, get_handlers_by_data_type
+from app.webhooks.core import get_webhook_handler
+
+
+def test_get_action_handler_by_data_type(mocker, mock_action_handlers, mock_push_observations_handler):
+    mocker.patch("app.actions.action_handlers", mock_action_handlers)
+
+    action_id, handler, _, data_model = get_action_handler_by_data_type(" ObservationTransformedER")
+
+    assert action_id == "push_observations"
+    assert handler is mock_push_observations_handler
+    assert data_model is ObservationTransformedER
+
+
+def test_get_action_handler_by_data_type_not_supported(mocker, mock_action_handlers):
+    mocker.patch("app.actions.action_handlers", mock_action_handlers)
+
+    with pytest.raises(ValueError):
+        get_action_handler_by_data_type("EventTransformedER")
+
+
+def test_handlers_by_data_type_are_indexed_once(mocker, mock_action_handlers):
+    mocker.patch("app.actions.action_handlers", mock_action_handlers)
+
+    index = get_handlers_by_data_type()
+
+    assert get_handlers_by_data_type() is index
+    assert list(index.keys()) == ["ObservationTransformedER"]
+    with pytest.raises(TypeError):  # Read-only
+        index["EventTransformedER"] = None
+
+
+def test_action_handlers_are_read_only():
+    with pytest.raises(TypeError):
+        app.actions.action_handlers["new_action"] = None
+
+
+def test_webhook_handler_is_discovered_once(mocker):
+    async def webhook_handler(payload: dict, integration=None, webhook_config: dict = None):
+        pass
+
+    get_webhook_handler.cache_clear()
+    mock_import_module = mocker.patch(
+        "app.webhooks.core.importlib.import_module", return_value=SimpleNamespace(webhook_handler=webhook_handler)
+    )
+
+    try:
+        assert get_webhook_handler() == (webhook_handler, dict, dict)
+        assert get_webhook_handler() == (webhook_handler, dict, dict)
+    finally:
+        get_webhook_handler.cache_clear()
+    assert mock_import_module.call_count == 1
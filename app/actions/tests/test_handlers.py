@@ -10,13 +10,21 @@ from app.actions.client import (
     VectronicForbiddenException,
     VectronicNotFoundException,
 )
+from datetime import datetime, timedelta, timezone
 from app.actions.handlers import (
     action_pull_observations,
     action_fetch_collar_observations,
     CollarData,
+    estimate_fix_interval,
+    get_collar_source_id,
+    get_dispatch_offset,
+    get_fetch_priority,
+    get_next_poll_time,
     transform,
 )
 from app.actions.configurations import PullObservationsConfig, PullCollarObservationsConfig
+from app.services.core import ActionPriorityEnum
+from app.services.tracing import tracer
 
 @pytest.mark.asyncio
 async def test_action_pull_observations_triggers_fetch_collar_observations(mocker, mock_publish_event, mock_state_manager):
@@ -30,6 +38,7 @@ async def test_action_pull_observations_triggers_fetch_collar_observations(mocke
     settings.INTEGRATION_COMMANDS_TOPIC = "vectronic-actions-topic"
 
     mocker.patch("app.services.state.IntegrationStateManager.get_state", return_value=None)
+    mocker.patch("app.actions.handlers.state_manager.get_failures", new=AsyncMock(return_value={}))
     mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
     mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
 
@@ -42,6 +51,136 @@ async def test_action_pull_observations_triggers_fetch_collar_observations(mocke
     assert result["collars_triggered"] == 1
     mock_trigger_action.assert_called_once()
 
+@pytest.mark.asyncio
+async def test_action_pull_observations_skips_collars_without_expected_fixes(mocker, mock_publish_event):
+    integration = MagicMock(id=1)
+    files = json.dumps([
+        {"parsedData": {"collarID": "1", "collarType": "A", "comID": "X", "comType": "Y", "key": "K"}},
+        {"parsedData": {"collarID": "2", "collarType": "A", "comID": "X", "comType": "Y", "key": "K"}},
+    ])
+    config = PullObservationsConfig(files=files, default_lookback_hours=12)
+    now = datetime.now(timezone.utc)
+    states = {
+        # Fixes every 4 hours, last one 1 hour ago: not due yet
+        "1": {"updated_at": (now - timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S"), "fix_interval_seconds": 4 * 3600},
+        # Fixes every hour, last one 2 hours ago: due
+        "2": {"updated_at": (now - timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%S"), "fix_interval_seconds": 3600},
+    }
+    mocker.patch(
+        "app.actions.handlers.state_manager.get_state",
+        new=AsyncMock(side_effect=lambda integration_id, action_id, source_id: states[source_id])
+    )
+    mocker.patch("app.actions.handlers.state_manager.get_failures", new=AsyncMock(return_value={}))
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mock_trigger_action = mocker.patch("app.actions.handlers.trigger_action", new_callable=AsyncMock)
+
+    result = await action_pull_observations(integration=integration, action_config=config)
+
+    assert result["collars_triggered"] == 1
+    assert result["collars_skipped"] == 1
+    mock_trigger_action.assert_awaited_once()
+    triggered_config = mock_trigger_action.call_args.kwargs["config"]
+    assert triggered_config.collar_id == 2
+    assert triggered_config.fix_interval_seconds == 3600
+
+
+@pytest.mark.asyncio
+async def test_action_pull_observations_skips_quarantined_collars(mocker, mock_publish_event):
+    integration = MagicMock(id=1)
+    collar_data = {"collarID": "1", "collarType": "A", "comID": "X", "comType": "Y", "key": "K"}
+    config = PullObservationsConfig(files=json.dumps([{"parsedData": collar_data}]), default_lookback_hours=12)
+    retry_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    quarantine = {
+        "1": {"failure_count": 2, "fingerprint": CollarData.parse_obj(collar_data).fingerprint(), "retry_at": retry_at.isoformat()}
+    }
+    mocker.patch("app.actions.handlers.state_manager.get_failures", new=AsyncMock(return_value=quarantine))
+    mocker.patch("app.actions.handlers.state_manager.get_state", new=AsyncMock(return_value={}))
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mock_trigger_action = mocker.patch("app.actions.handlers.trigger_action", new_callable=AsyncMock)
+
+    result = await action_pull_observations(integration=integration, action_config=config)
+
+    assert result["collars_triggered"] == 0
+    assert result["collars_quarantined"] == 1
+    mock_trigger_action.assert_not_awaited()
+
+
+@pytest.mark.parametrize("collar_id", [12345, "12345", " 12345 ", "012345"])
+def test_get_collar_source_id_is_the_same_for_the_file_and_the_fetch_config(collar_id):
+    assert get_collar_source_id(collar_id) == "12345"
+
+
+@pytest.mark.asyncio
+async def test_action_pull_observations_skips_collars_quarantined_by_fetch(mocker, mock_publish_event):
+    integration = MagicMock(id=1)
+    collar_data = {"collarID": " 012345", "collarType": "A", "comID": "X", "comType": "Y", "key": "K"}
+    config = PullObservationsConfig(files=json.dumps([{"parsedData": collar_data}]), default_lookback_hours=12)
+    fetch_config = PullCollarObservationsConfig(
+        start=datetime.now(timezone.utc), collar_id=12345, collar_key="K",
+        fingerprint=CollarData.parse_obj(collar_data).fingerprint()
+    )
+    retry_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    # Recorded when the fetch failed, with the collar ID of the fetch config
+    quarantine = {
+        get_collar_source_id(fetch_config.collar_id): {
+            "failure_count": 2, "fingerprint": fetch_config.fingerprint, "retry_at": retry_at.isoformat()
+        }
+    }
+    mocker.patch("app.actions.handlers.state_manager.get_failures", new=AsyncMock(return_value=quarantine))
+    mocker.patch("app.actions.handlers.state_manager.get_state", new=AsyncMock(return_value={}))
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mock_trigger_action = mocker.patch("app.actions.handlers.trigger_action", new_callable=AsyncMock)
+
+    result = await action_pull_observations(integration=integration, action_config=config)
+
+    assert result["collars_quarantined"] == 1
+    mock_trigger_action.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_action_pull_observations_releases_quarantined_collar_on_config_change(mocker, mock_publish_event):
+    integration = MagicMock(id=1)
+    collar_data = {"collarID": "1", "collarType": "A", "comID": "X", "comType": "Y", "key": "NEW-KEY"}
+    config = PullObservationsConfig(files=json.dumps([{"parsedData": collar_data}]), default_lookback_hours=12)
+    retry_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    quarantine = {"1": {"failure_count": 2, "fingerprint": "old-fingerprint", "retry_at": retry_at.isoformat()}}
+    mocker.patch("app.actions.handlers.state_manager.get_failures", new=AsyncMock(return_value=quarantine))
+    mock_clear_failure = mocker.patch("app.actions.handlers.state_manager.clear_failure", new_callable=AsyncMock)
+    mocker.patch("app.actions.handlers.state_manager.get_state", new=AsyncMock(return_value={}))
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mock_trigger_action = mocker.patch("app.actions.handlers.trigger_action", new_callable=AsyncMock)
+
+    result = await action_pull_observations(integration=integration, action_config=config)
+
+    assert result["collars_triggered"] == 1
+    assert result["collars_quarantined"] == 0
+    mock_clear_failure.assert_awaited_once_with(integration_id=1, action_id="pull_observations", source_id="1")
+    mock_trigger_action.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_action_pull_observations_staggers_dispatch(mocker, mock_publish_event):
+    integration = MagicMock(id=1)
+    collar_ids = ["1", "2", "3", "4"]
+    files = json.dumps([
+        {"parsedData": {"collarID": collar_id, "collarType": "A", "comID": "X", "comType": "Y", "key": "K"}}
+        for collar_id in collar_ids
+    ])
+    config = PullObservationsConfig(files=files, default_lookback_hours=12, dispatch_window_seconds=60)
+    mocker.patch("app.actions.handlers.state_manager.get_failures", new=AsyncMock(return_value={}))
+    mocker.patch("app.actions.handlers.state_manager.get_state", new=AsyncMock(return_value={}))
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mock_sleep = mocker.patch("app.actions.handlers.asyncio.sleep", new_callable=AsyncMock)
+    mock_trigger_action = mocker.patch("app.actions.handlers.trigger_action", new_callable=AsyncMock)
+
+    result = await action_pull_observations(integration=integration, action_config=config)
+
+    assert result["collars_triggered"] == 4
+    triggered_collars = [str(c.kwargs["config"].collar_id) for c in mock_trigger_action.call_args_list]
+    assert triggered_collars == sorted(collar_ids, key=lambda c: get_dispatch_offset(c, window_seconds=60))
+    assert mock_sleep.await_count > 0
+
+
 @pytest.mark.asyncio
 async def test_action_pull_observations_bad_json(mocker, mock_publish_event, mock_state_manager):
     mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
@@ -67,6 +206,9 @@ async def test_action_pull_observations_empty_list(mocker, mock_publish_event, m
 async def test_action_fetch_collar_observations_no_observations(mocker):
     mock_get_obs = mocker.patch("app.actions.handlers.client.get_observations", new_callable=AsyncMock)
     mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=1))
+    mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
+    mock_set_state = mocker.patch("app.actions.handlers.state_manager.set_state", new=AsyncMock(return_value=True))
     mocker.patch("app.services.action_runner.publish_event", new=AsyncMock())
     mocker.patch("app.services.action_scheduler.publish_event", new=AsyncMock())
     integration = MagicMock(id=1, base_url=None)
@@ -74,6 +216,7 @@ async def test_action_fetch_collar_observations_no_observations(mocker):
     mock_get_obs.return_value = []
     result = await action_fetch_collar_observations(integration, config)
     assert result["observations_extracted"] == 0
+    assert "last_polled_at" in mock_set_state.call_args.kwargs["state"]
 
 @pytest.mark.asyncio
 async def test_action_fetch_collar_observations_skips_invalid_location(mocker, caplog):
@@ -84,6 +227,7 @@ async def test_action_fetch_collar_observations_skips_invalid_location(mocker, c
 
     action_config = MagicMock()
     action_config.collar_id = 123
+    action_config.quarantined = False
 
     # Mock observation with invalid latitude/longitude
     invalid_ob = MagicMock()
@@ -94,6 +238,9 @@ async def test_action_fetch_collar_observations_skips_invalid_location(mocker, c
     invalid_ob.dict.return_value = {"latitude": None, "longitude": 10.0}
 
     mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=1))
+    mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
+    mocker.patch("app.actions.handlers.state_manager.set_state", new=AsyncMock(return_value=True))
     mocker.patch("app.services.action_runner.publish_event", new=AsyncMock())
     mocker.patch("app.services.action_scheduler.publish_event", new=AsyncMock())
 
@@ -116,6 +263,8 @@ async def test_action_fetch_collar_observations_exception_sends_error_activity_l
     mock_get_obs = mocker.patch("app.actions.handlers.client.get_observations", new_callable=AsyncMock)
     mock_log_action_activity = mocker.patch("app.actions.handlers.log_action_activity", new_callable=AsyncMock)
     mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=1))
+    mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
     integration = MagicMock(id=1, base_url=None)
     config = PullCollarObservationsConfig(start="2024-01-01T00:00:00", collar_id=1, collar_key="K")
     mock_get_obs.side_effect = Exception("fail")
@@ -132,11 +281,19 @@ async def test_action_fetch_collar_observations_forbidden_logs_warning(mocker):
     mock_get_obs = mocker.patch("app.actions.handlers.client.get_observations", new_callable=AsyncMock)
     mock_log_action_activity = mocker.patch("app.actions.handlers.log_action_activity", new_callable=AsyncMock)
     mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=1))
+    mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
     integration = MagicMock(id=1, base_url=None)
     config = PullCollarObservationsConfig(start="2024-01-01T00:00:00", collar_id=1, collar_key="K")
+    mock_record_failure = mocker.patch(
+        "app.actions.handlers.state_manager.record_failure",
+        new=AsyncMock(return_value={"failure_count": 1, "retry_at": "2024-01-01T00:30:00+00:00"})
+    )
     mock_get_obs.side_effect = VectronicForbiddenException(Exception("403"), "Unauthorized access")
     result = await action_fetch_collar_observations(integration, config)
     assert result == {"observations_extracted": 0}
+    mock_record_failure.assert_awaited_once()
+    assert mock_record_failure.call_args.kwargs["source_id"] == "1"
     mock_log_action_activity.assert_awaited_once()
     assert mock_log_action_activity.call_args[1]["action_id"] == "fetch_collar_observations"
     assert mock_log_action_activity.call_args[1]["level"] == LogLevel.WARNING
@@ -146,11 +303,19 @@ async def test_action_fetch_collar_observations_not_found_logs_warning(mocker):
     mock_get_obs = mocker.patch("app.actions.handlers.client.get_observations", new_callable=AsyncMock)
     mock_log_action_activity = mocker.patch("app.actions.handlers.log_action_activity", new_callable=AsyncMock)
     mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=1))
+    mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
     integration = MagicMock(id=1, base_url=None)
     config = PullCollarObservationsConfig(start="2024-01-01T00:00:00", collar_id=1, collar_key="K")
+    mock_record_failure = mocker.patch(
+        "app.actions.handlers.state_manager.record_failure",
+        new=AsyncMock(return_value={"failure_count": 1, "retry_at": "2024-01-01T00:30:00+00:00"})
+    )
     mock_get_obs.side_effect = VectronicNotFoundException(Exception("404"), "Not found")
     result = await action_fetch_collar_observations(integration, config)
     assert result == {"observations_extracted": 0}
+    mock_record_failure.assert_awaited_once()
+    assert mock_record_failure.call_args.kwargs["source_id"] == "1"
     mock_log_action_activity.assert_awaited_once()
     assert mock_log_action_activity.call_args[1]["action_id"] == "fetch_collar_observations"
     assert mock_log_action_activity.call_args[1]["level"] == LogLevel.WARNING
@@ -160,6 +325,8 @@ async def test_action_fetch_collar_observations_http_status_error_logs_warning(m
     mock_get_obs = mocker.patch("app.actions.handlers.client.get_observations", new_callable=AsyncMock)
     mock_log_action_activity = mocker.patch("app.actions.handlers.log_action_activity", new_callable=AsyncMock)
     mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=1))
+    mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
     integration = MagicMock(id=1, base_url=None)
     config = PullCollarObservationsConfig(start="2024-01-01T00:00:00", collar_id=1, collar_key="K")
     request = httpx.Request("GET", "https://api.vectronic-wildlife.com/v2/collar/1/gps")
@@ -171,6 +338,161 @@ async def test_action_fetch_collar_observations_http_status_error_logs_warning(m
     assert mock_log_action_activity.call_args[1]["action_id"] == "fetch_collar_observations"
     assert mock_log_action_activity.call_args[1]["level"] == LogLevel.WARNING
 
+@pytest.mark.asyncio
+async def test_action_fetch_collar_observations_saves_state_with_lease(mocker):
+    mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mock_acquire_lease = mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=7))
+    mock_release_lease = mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
+    mock_set_state = mocker.patch("app.actions.handlers.state_manager.set_state", new=AsyncMock(return_value=True))
+    mocker.patch("app.actions.handlers.send_observations_to_gundi", new=AsyncMock(return_value=[{}]))
+    observation = VectronicObservation(
+        idCollar=1, acquisitionTime="2024-01-01T01:00:00", latitude=1.0, longitude=2.0
+    )
+    mocker.patch("app.actions.handlers.client.get_observations", new=AsyncMock(return_value=[observation]))
+    integration = MagicMock(id=1, base_url=None)
+    config = PullCollarObservationsConfig(start="2024-01-01T00:00:00", collar_id=1, collar_key="K")
+
+    result = await action_fetch_collar_observations(integration=integration, action_config=config)
+
+    assert result == {"observations_extracted": 1}
+    mock_acquire_lease.assert_awaited_once()
+    assert mock_set_state.call_args.kwargs["lease_token"] == 7
+    assert mock_set_state.call_args.kwargs["state"]["updated_at"] == "2024-01-01T01:00:00"
+    mock_release_lease.assert_awaited_once_with(
+        integration_id=1, action_id="pull_observations", source_id="1", lease_token=7
+    )
+
+
+@pytest.mark.asyncio
+async def test_action_fetch_collar_observations_without_new_fixes_saves_the_poll_time(mocker):
+    mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=7))
+    mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
+    mock_set_state = mocker.patch("app.actions.handlers.state_manager.set_state", new=AsyncMock(return_value=True))
+    mocker.patch("app.actions.handlers.client.get_observations", new=AsyncMock(return_value=[]))
+    integration = MagicMock(id=1, base_url=None)
+    config = PullCollarObservationsConfig(
+        start="2024-01-01T00:00:00", collar_id=1, collar_key="K",
+        last_fix_time="2024-01-01T00:00:00", fix_interval_seconds=3600
+    )
+
+    result = await action_fetch_collar_observations(integration=integration, action_config=config)
+
+    assert result == {"observations_extracted": 0}
+    state = mock_set_state.call_args.kwargs["state"]
+    # The last fix and the interval are kept
+    assert state["updated_at"] == "2024-01-01T00:00:00"
+    assert state["fix_interval_seconds"] == 3600
+    assert datetime.fromisoformat(state["last_polled_at"]).date() == datetime.now(timezone.utc).date()
+
+
+@pytest.mark.asyncio
+async def test_action_fetch_collar_observations_creates_spans_for_each_stage(mocker, span_exporter):
+    mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=7))
+    mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
+    mocker.patch("app.actions.handlers.state_manager.set_state", new=AsyncMock(return_value=True))
+    mocker.patch("app.actions.handlers.send_observations_to_gundi", new=AsyncMock(return_value=[{}]))
+    observation = VectronicObservation(
+        idCollar=1, acquisitionTime="2024-01-01T01:00:00", latitude=1.0, longitude=2.0
+    )
+    mocker.patch("app.actions.handlers.client.get_observations", new=AsyncMock(return_value=[observation]))
+    integration = MagicMock(id=1, base_url=None)
+    config = PullCollarObservationsConfig(start="2024-01-01T00:00:00", collar_id=1, collar_key="K")
+
+    with tracer.start_as_current_span("execute_action fetch_collar_observations") as action_span:
+        await action_fetch_collar_observations(integration=integration, action_config=config)
+
+    spans = {span.name: span for span in span_exporter.get_finished_spans()}
+    assert spans["transform_observations"].parent.span_id == action_span.get_span_context().span_id
+    assert spans["gundi.send_observations"].parent.span_id == action_span.get_span_context().span_id
+    assert spans["gundi.send_observations"].attributes["observations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_action_fetch_collar_observations_skips_when_lease_is_taken(mocker):
+    mocker.patch("app.services.activity_logger.publish_event", new=AsyncMock())
+    mocker.patch("app.actions.handlers.state_manager.acquire_lease", new=AsyncMock(return_value=None))
+    mock_release_lease = mocker.patch("app.actions.handlers.state_manager.release_lease", new_callable=AsyncMock)
+    mock_get_obs = mocker.patch("app.actions.handlers.client.get_observations", new_callable=AsyncMock)
+    integration = MagicMock(id=1, base_url=None)
+    config = PullCollarObservationsConfig(start="2024-01-01T00:00:00", collar_id=1, collar_key="K")
+
+    result = await action_fetch_collar_observations(integration=integration, action_config=config)
+
+    assert result == {"observations_extracted": 0}
+    mock_get_obs.assert_not_awaited()
+    mock_release_lease.assert_not_awaited()
+
+
+def test_estimate_fix_interval_from_new_observations():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    times = [start + timedelta(hours=i) for i in range(4)]
+    assert estimate_fix_interval(acquisition_times=times) == 3600
+
+
+def test_estimate_fix_interval_uses_last_fix_and_previous_estimate():
+    last_fix_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    times = [last_fix_time + timedelta(hours=2)]
+    interval = estimate_fix_interval(acquisition_times=times, previous_interval=3600, last_fix_time=last_fix_time)
+    assert 3600 < interval < 7200
+
+
+def test_estimate_fix_interval_keeps_previous_estimate_without_gaps():
+    times = [datetime(2024, 1, 1, tzinfo=timezone.utc)]
+    assert estimate_fix_interval(acquisition_times=times, previous_interval=1800) == 1800
+
+
+def test_get_next_poll_time_is_bounded_by_max_staleness():
+    device_state = {"updated_at": "2024-01-01T00:00:00", "fix_interval_seconds": 24 * 3600}
+    next_poll_time = get_next_poll_time(device_state=device_state, max_staleness=timedelta(hours=6))
+    assert next_poll_time == datetime(2024, 1, 1, 6, tzinfo=timezone.utc)
+
+
+def test_get_next_poll_time_waits_an_interval_after_the_last_poll():
+    # The fix was due at 01:00, but there wasn't a new one when polled at 03:00
+    device_state = {
+        "updated_at": "2024-01-01T00:00:00", "fix_interval_seconds": 3600, "last_polled_at": "2024-01-01T03:00:00"
+    }
+    next_poll_time = get_next_poll_time(device_state=device_state, max_staleness=timedelta(hours=6))
+    assert next_poll_time == datetime(2024, 1, 1, 4, tzinfo=timezone.utc)
+
+
+def test_get_next_poll_time_after_the_last_poll_is_bounded_by_max_staleness():
+    device_state = {
+        "updated_at": "2024-01-01T00:00:00", "fix_interval_seconds": 24 * 3600, "last_polled_at": "2024-01-02T00:00:00"
+    }
+    next_poll_time = get_next_poll_time(device_state=device_state, max_staleness=timedelta(hours=6))
+    assert next_poll_time == datetime(2024, 1, 2, 6, tzinfo=timezone.utc)
+
+
+def test_get_next_poll_time_without_fix_interval():
+    assert get_next_poll_time(device_state={"updated_at": "2024-01-01T00:00:00"}, max_staleness=timedelta(hours=6)) is None
+
+
+def test_get_dispatch_offset_is_stable_and_within_window():
+    offsets = [get_dispatch_offset(collar_id, window_seconds=120) for collar_id in range(100)]
+    assert offsets == [get_dispatch_offset(collar_id, window_seconds=120) for collar_id in range(100)]
+    assert all(0 <= offset < 120 for offset in offsets)
+    assert len(set(offsets)) > 90
+
+
+def test_get_dispatch_offset_without_window():
+    assert get_dispatch_offset("123", window_seconds=0) == 0.0
+
+
+def test_fetch_priority_is_high_for_incremental_fetches():
+    start = datetime.now(timezone.utc) - timedelta(hours=1)
+    config = {"start": start.isoformat(), "collar_id": 1, "collar_key": "K"}
+    assert get_fetch_priority(config) == ActionPriorityEnum.HIGH
+
+
+def test_fetch_priority_is_low_for_backfills():
+    start = datetime.now(timezone.utc) - timedelta(days=5)
+    config = {"start": start.isoformat(), "collar_id": 1, "collar_key": "K"}
+    assert get_fetch_priority(config) == ActionPriorityEnum.LOW
+
+
 def test_transform_ok():
     obj = {
         "idCollar": "1",
@@ -6,4 +6,5 @@ class ActionRequest(BaseModel):
     action_id: str
     run_in_background: bool = False
     config_overrides: dict = None
+    profile: bool = False  # Save a profile of the execution, see PROFILES_DIR
 
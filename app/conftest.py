@@ -8,6 +8,7 @@ import pytest
 from unittest.mock import MagicMock
 from app import settings
 from gcloud.aio import pubsub
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
 from gundi_core.schemas.v2 import Integration, IntegrationSummary
 from gundi_core.events import (
     IntegrationActionCustomLog,
@@ -36,6 +37,9 @@ from app.actions import (
 )
 from app.services.utils import GlobalUISchemaOptions, FieldWithUIOptions, UIOptions, OptionalStringType
 from app.services.action_scheduler import CrontabSchedule
+from app.services.config_manager import integration_cache
+from app.services.gundi import api_key_cache
+from app.services.tracing import configure_tracing
 from app.webhooks import (
     GenericJsonTransformConfig,
     GenericJsonPayload,
@@ -55,6 +59,14 @@ def async_return(result):
     return f
 
 
+def as_redis_hash(json_data: str, version: int = 1) -> dict:
+    # A configuration as saved by IntegrationConfigurationManager, and returned by HGETALL
+    return {
+        b"_version": str(version).encode(),
+        **{key.encode(): json.dumps(value).encode() for key, value in json.loads(json_data).items()}
+    }
+
+
 @pytest.fixture
 def mock_integration_state():
     return {"last_execution": "2024-01-29T11:20:00+0200"}
@@ -69,6 +81,11 @@ def mock_redis(mocker, mock_integration_state):
         json.dumps(mock_integration_state, default=str)
     )
     redis_client.delete.return_value = async_return(MagicMock())
+    redis_client.exists.return_value = async_return(0)
+    redis_client.hgetall.return_value = async_return({})
+    redis_client.hget.return_value = async_return(None)
+    redis_client.eval.return_value = async_return(1)
+    redis_client.publish.return_value = async_return(1)
     redis_client.setex.return_value = async_return(None)
     redis_client.incr.return_value = redis_client
     redis_client.decr.return_value = async_return(None)
@@ -88,6 +105,11 @@ def mock_redis_empty(mocker, mock_integration_state):
     redis_client.set.return_value = async_return(MagicMock())
     redis_client.get.return_value = async_return(None)
     redis_client.delete.return_value = async_return(MagicMock())
+    redis_client.exists.return_value = async_return(0)
+    redis_client.hgetall.return_value = async_return({})
+    redis_client.hget.return_value = async_return(None)
+    redis_client.eval.return_value = async_return(1)
+    redis_client.publish.return_value = async_return(1)
     redis_client.setex.return_value = async_return(None)
     redis_client.incr.return_value = redis_client
     redis_client.decr.return_value = async_return(None)
@@ -107,6 +129,11 @@ def mock_redis_with_integration_config(mocker, integration_v2_as_json):
     redis_client.set.return_value = async_return(MagicMock())
     redis_client.get.return_value = async_return(integration_v2_as_json)
     redis_client.delete.return_value = async_return(MagicMock())
+    redis_client.exists.return_value = async_return(0)
+    redis_client.hgetall.return_value = async_return(as_redis_hash(integration_v2_as_json))
+    redis_client.hget.return_value = async_return(None)
+    redis_client.eval.return_value = async_return(1)
+    redis_client.publish.return_value = async_return(1)
     redis_client.setex.return_value = async_return(None)
     redis_client.incr.return_value = redis_client
     redis_client.decr.return_value = async_return(None)
@@ -126,6 +153,11 @@ def mock_redis_with_action_config(mocker, pull_observations_config_as_json):
     redis_client.set.return_value = async_return(MagicMock())
     redis_client.get.return_value = async_return(pull_observations_config_as_json)
     redis_client.delete.return_value = async_return(MagicMock())
+    redis_client.exists.return_value = async_return(0)
+    redis_client.hgetall.return_value = async_return(as_redis_hash(pull_observations_config_as_json))
+    redis_client.hget.return_value = async_return(None)
+    redis_client.eval.return_value = async_return(1)
+    redis_client.publish.return_value = async_return(1)
     redis_client.setex.return_value = async_return(None)
     redis_client.incr.return_value = redis_client
     redis_client.decr.return_value = async_return(None)
@@ -869,6 +901,20 @@ def mock_state_manager(mocker):
     return mock_state_manager
 
 
+@pytest.fixture
+def mock_config_manager_for_webhooks(mocker, integration_v2_with_webhook):
+    mock_config_manager = mocker.MagicMock()
+    mock_config_manager.get_integration_details.return_value = async_return(integration_v2_with_webhook)
+    return mock_config_manager
+
+
+@pytest.fixture
+def mock_config_manager_for_webhooks_generic(mocker, integration_v2_with_webhook_generic):
+    mock_config_manager = mocker.MagicMock()
+    mock_config_manager.get_integration_details.return_value = async_return(integration_v2_with_webhook_generic)
+    return mock_config_manager
+
+
 @pytest.fixture
 def mock_config_manager(mocker, integration_v2):
     mock_config_manager = mocker.MagicMock()
@@ -881,9 +927,30 @@ def mock_config_manager(mocker, integration_v2):
     mock_config_manager.set_action_configuration.return_value = async_return(None)
     mock_config_manager.delete_integration.return_value = async_return(None)
     mock_config_manager.delete_action_configuration.return_value = async_return(None)
+    mock_config_manager.delete_webhook_configuration.return_value = async_return(None)
+    mock_config_manager.write_configurations.return_value = async_return(None)
+    mock_config_manager.update_integration.return_value = async_return(2)
+    mock_config_manager.update_action_configuration.return_value = async_return(2)
     return mock_config_manager
 
 
+@pytest.fixture
+def mock_command_lease_manager(mocker):
+    mock_command_lease_manager = mocker.MagicMock()
+    mock_command_lease_manager.acquire.return_value = async_return(True)
+    mock_command_lease_manager.complete.return_value = async_return(None)
+    mock_command_lease_manager.release.return_value = async_return(None)
+    mock_command_lease_manager.renew.return_value = async_return(True)
+    return mock_command_lease_manager
+
+
+@pytest.fixture
+def mock_command_lease_manager_with_duplicate(mocker):
+    mock_command_lease_manager = mocker.MagicMock()
+    mock_command_lease_manager.acquire.return_value = async_return(False)
+    return mock_command_lease_manager
+
+
 @pytest.fixture
 def mock_pubsub_client(
     mocker, integration_event_pubsub_message, gcp_pubsub_publish_response
@@ -2079,3 +2146,25 @@ def mock_webhook_request_payload_for_fixed_schema():
         "lat": -2.3828796,
         "lon": 35.3380609,
     }
+
+
+# The global tracer provider can be set only once, so all the tests share the same exporter
+_span_exporter = InMemorySpanExporter()
+configure_tracing(exporter=_span_exporter, batch=False)
+
+
+@pytest.fixture
+def span_exporter():
+    _span_exporter.clear()
+    yield _span_exporter
+    _span_exporter.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_integration_cache():
+    # The in-process cache is shared in the process, so cached integrations would leak across tests
+    integration_cache.clear()
+    api_key_cache.clear()
+    yield
+    integration_cache.clear()
+    api_key_cache.clear()
@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import itertools
+import json
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import click
+import httpx
+
+
+PUBSUB_ENDPOINTS = ["/", "/push-data", "/config-events/"]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def new_message_id() -> str:
+    return str(uuid.uuid4().int)[:17]
+
+
+def with_new_message_id(body: dict) -> dict:
+    """
+    Copy of a PubSub push body with a new message id, so the service doesn't ignore it as a redelivery
+    """
+    if not isinstance(body.get("message"), dict):
+        return body
+    message_id = new_message_id()
+    message = {**body["message"], "messageId": message_id, "message_id": message_id}
+    return {**body, "message": message}
+
+
+def build_pubsub_envelope(data: dict, attributes: dict = None) -> dict:
+    """
+    Builds the body of a PubSub push request, as received in the endpoints of app/main.py
+    """
+    message_id = new_message_id()
+    publish_time = datetime.now(timezone.utc).isoformat()
+    return {
+        "message": {
+            "data": base64.b64encode(json.dumps(data).encode("utf-8")).decode("utf-8"),
+            "attributes": attributes or {},
+            "messageId": message_id,
+            "message_id": message_id,
+            "publishTime": publish_time,
+            "publish_time": publish_time,
+        },
+        "subscription": "projects/load-test/subscriptions/load-test-sub",
+    }
+
+
+def load_requests(input_file, endpoint: str) -> list:
+    """
+    Reads recorded requests from a JSON lines file. Each line is either a PubSub push body, sent to the given endpoint,
+    or an object with the endpoint and the body: {"endpoint": "/push-data", "body": {"message": {...}}}
+    """
+    requests = []
+    for line in input_file:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if "body" in record:
+            requests.append((record.get("endpoint", endpoint), record["body"]))
+        else:
+            requests.append((endpoint, record))
+    return requests
+
+
+def synthesize_requests(action_id: str, integration_ids: list) -> list:
+    # One command per integration, as the scheduler would publish them
+    return [
+        ("/", build_pubsub_envelope({"integration_id": integration_id, "action_id": action_id, "config_overrides": None}))
+        for integration_id in integration_ids
+    ]
+
+
+async def run_load_test(url, requests, total, rate, concurrency, timeout, headers):
+    results = defaultdict(lambda: {"latencies": [], "statuses": Counter(), "errors": 0})
+    semaphore = asyncio.Semaphore(concurrency)
+    late = 0
+
+    async def send(client, endpoint, body, scheduled_at):
+        nonlocal late
+        async with semaphore:
+            start = time.perf_counter()
+            if start - scheduled_at > 0.1:  # Waited for a free slot, the rate isn't being sustained
+                late += 1
+            try:
+                response = await client.post(endpoint, json=body)
+            except httpx.HTTPError as e:
+                results[endpoint]["statuses"][type(e).__name__] += 1
+                results[endpoint]["errors"] += 1
+                return
+            results[endpoint]["latencies"].append(time.perf_counter() - start)
+            results[endpoint]["statuses"][str(response.status_code)] += 1
+            if response.is_error:
+                results[endpoint]["errors"] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout, headers=headers) as client:
+        tasks = []
+        start = time.perf_counter()
+        for i, (endpoint, body) in enumerate(itertools.islice(itertools.cycle(requests), total)):
+            scheduled_at = time.perf_counter()
+            if rate:  # Open loop: requests are sent on schedule, regardless of the responses
+                scheduled_at = start + i / rate
+                if (delay := scheduled_at - time.perf_counter()) > 0:
+                    await asyncio.sleep(delay)
+            # Each request is a new message, even when the input is sent again
+            tasks.append(asyncio.create_task(send(client, endpoint, with_new_message_id(body), scheduled_at)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    report = {"duration_seconds": round(elapsed, 3), "requests": total, "late_requests": late, "endpoints": {}}
+    for endpoint, result in results.items():
+        count = sum(result["statuses"].values())
+        latencies = result["latencies"]
+        report["endpoints"][endpoint] = {
+            "requests": count,
+            "throughput_rps": round(count / elapsed, 2),
+            "error_rate": round(result["errors"] / count, 4),
+            "statuses": dict(result["statuses"]),
+            "latency_seconds": {
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies, default=None),
+            },
+        }
+    return report
+
+
+@click.command()
+@click.option('--url', required=True, help='Base URL of the running service, e.g. http://localhost:8080')
+@click.option(
+    '--input', 'input_file', type=click.File('r'), default=None,
+    help='JSON lines file with recorded PubSub push bodies (see load_requests)'
+)
+@click.option('--endpoint', type=click.Choice(PUBSUB_ENDPOINTS), default="/", help='Endpoint for bodies without one')
+@click.option('--action-id', default=None, help='Synthesize commands to run this action, instead of using --input')
+@click.option(
+    '--integration-id', 'integration_ids', multiple=True,
+    help='Integrations for the synthesized commands'
+)
+@click.option('--requests', 'total', type=int, default=None, help='Requests to send, cycling over the input (default: each once)')
+@click.option('--rate', type=float, default=10.0, help='Requests per second (0 = as fast as the concurrency allows)')
+@click.option('--concurrency', type=int, default=10, help='Maximum requests in flight')
+@click.option('--timeout', type=float, default=600.0, help='Request timeout in seconds')
+@click.option('--header', 'header_values', multiple=True, help='Extra headers, e.g. "Authorization: Bearer <token>"')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Save the report in a JSON file')
+def load_test(url, input_file, endpoint, action_id, integration_ids, total, rate, concurrency, timeout, header_values, output):
+    """
+    Replays PubSub push requests against a running instance at a controlled rate and concurrency,
+    and reports throughput, error rate and latency percentiles per endpoint.
+    """
+    if input_file:
+        requests = load_requests(input_file, endpoint)
+    elif action_id and integration_ids:
+        requests = synthesize_requests(action_id, list(integration_ids))
+    else:
+        raise click.UsageError("Use --input, or --action-id with at least one --integration-id")
+    if not requests:
+        raise click.UsageError("No requests to send")
+    headers = {}
+    for header in header_values:
+        name, _, value = header.partition(":")
+        headers[name.strip()] = value.strip()
+
+    report = asyncio.run(
+        run_load_test(
+            url=url,
+            requests=requests,
+            total=total or len(requests),
+            rate=rate,
+            concurrency=concurrency,
+            timeout=timeout,
+            headers=headers
+        )
+    )
+    click.echo(json.dumps(report, indent=2))
+    if report["late_requests"]:
+        click.echo(f"{report['late_requests']} requests were sent late. Increase --concurrency to sustain the rate.", err=True)
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+# Main
+if __name__ == "__main__":
+    load_test()
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import json
 import logging
@@ -6,27 +7,59 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, status, BackgroundTasks
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from app.routers import actions, webhooks, config_events
 import app.settings as settings
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.services.action_runner import execute_action, _portal
-from app.services.self_registration import register_integration_in_gundi
+from app.services.action_runner import execute_action, admit_action, _portal, config_manager, command_lease_manager
+from app.services.config_events_consumer import run_config_events_puller
+from app.services.config_manager import run_config_changes_listener
+from app.services.webhook_queue import webhook_queue
+from app.services.warmup import readiness, warm_up
+from app.services.tracing import configure_tracing
 
 
 # For running behind a proxy, we'll want to configure the root path for OpenAPI browser.
 root_path = os.environ.get("ROOT_PATH", "")
 
+configure_tracing()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup Hook
     if settings.REGISTER_ON_START:
+        from app.services.self_registration import register_integration_in_gundi  # Only needed here
         await register_integration_in_gundi(gundi_client=_portal)
         # ToDo: set env var to false in GCP after registration
+    if settings.WEBHOOK_QUEUE_ENABLED:
+        webhook_queue.start()
+    config_events_puller = None
+    if settings.CONFIG_EVENTS_SUBSCRIPTION:
+        config_events_puller = asyncio.create_task(
+            run_config_events_puller(settings.CONFIG_EVENTS_SUBSCRIPTION, max_messages=settings.CONFIG_EVENTS_BATCH_SIZE)
+        )
+    config_changes_listener = None
+    if settings.CONFIG_CHANGES_LISTENER_ENABLED:
+        config_changes_listener = asyncio.create_task(run_config_changes_listener())
+    warmup = None
+    if settings.WARMUP_ENABLED:  # In the background, so the instance starts and reports progress in /ready
+        warmup = asyncio.create_task(
+            warm_up(config_manager=config_manager, redis_clients=[config_manager.db_client, command_lease_manager.db_client])
+        )
+    else:
+        readiness.set_ready()
     yield
     # Shotdown Hook
+    if config_events_puller:
+        config_events_puller.cancel()
+    if config_changes_listener:
+        config_changes_listener.cancel()
+    if warmup:
+        warmup.cancel()
+    await webhook_queue.stop()
     await _portal.close()
 
 
@@ -64,6 +97,27 @@ def read_root(
     return {"status": "healthy"}
 
 
+@app.get(
+    "/ready",
+    tags=["health-check"],
+    summary="Check that the service is ready to take traffic",
+    description="Returns 503 until connections are open and the most active integrations are preloaded on startup.",
+)
+def ready():
+    if not readiness.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "warming up"})
+    return {"status": "ready", "preloaded_integrations": readiness.preloaded_integrations}
+
+
+@app.get(
+    "/metrics",
+    tags=["health-check"],
+    summary="Metrics in Prometheus format",
+)
+def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post(
     "/",
     summary="Execute an action from GCP PubSub",
@@ -77,18 +131,31 @@ async def execute(
     payload = base64.b64decode(json_data["message"]["data"]).decode("utf-8").strip()
     json_payload = json.loads(payload)
     logger.debug(f"JSON Payload: {json_payload}")
+    attributes = json_data["message"].get("attributes", {})  # May carry the trace context
+    # Reject the command early if this instance is saturated, so PubSub redelivers it
+    admission = admit_action(json_payload.get("action_id"), config_overrides=json_payload.get("config_overrides"))
+    if isinstance(admission, JSONResponse):
+        return admission
     if settings.PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND:
         background_tasks.add_task(
             execute_action,
             integration_id=json_payload.get("integration_id"),
             action_id=json_payload.get("action_id"),
             config_overrides=json_payload.get("config_overrides"),
+            deduplicate=settings.DEDUPLICATE_PUBSUB_COMMANDS,
+            admission=admission,
+            trace_context=attributes,
+            command_id=json_data["message"].get("messageId") or json_data["message"].get("message_id"),
         )
     else:
         await execute_action(
             integration_id=json_payload.get("integration_id"),
             action_id=json_payload.get("action_id"),
             config_overrides=json_payload.get("config_overrides"),
+            deduplicate=settings.DEDUPLICATE_PUBSUB_COMMANDS,
+            admission=admission,
+            trace_context=attributes,
+            command_id=json_data["message"].get("messageId") or json_data["message"].get("message_id"),
         )
     return {}
 
@@ -2,11 +2,15 @@ import logging
 from typing import List
 import app.settings
 from fastapi import APIRouter, BackgroundTasks
+from fastapi.responses import JSONResponse
 from app.actions import get_actions
-from app.services.action_runner import execute_action
+from app.services.action_runner import execute_action, admit_action, action_limiter
+from app.services.core import ActionPriorityEnum
+from app.services.state import IntegrationStateManager
 from app.api_schemas import ActionRequest
 
 logger = logging.getLogger(__name__)
+state_manager = IntegrationStateManager()
 
 router = APIRouter()
 
@@ -28,16 +32,44 @@ async def execute(
     background_tasks: BackgroundTasks
 ):
     if request.run_in_background:
+        # Rejected before it's accepted if the process is saturated
+        admission = admit_action(
+            request.action_id, config_overrides=request.config_overrides, priority=ActionPriorityEnum.INTERACTIVE
+        )
+        if isinstance(admission, JSONResponse):
+            return admission
         background_tasks.add_task(
             execute_action,
             integration_id=request.integration_id,
             action_id=request.action_id,
-            config_overrides=request.config_overrides
+            config_overrides=request.config_overrides,
+            admission=admission,
+            profile=request.profile
         )
         return {"message": "Action execution started in background"}
     else:
         return await execute_action(
             integration_id=request.integration_id,
             action_id=request.action_id,
-            config_overrides=request.config_overrides
+            config_overrides=request.config_overrides,
+            priority=ActionPriorityEnum.INTERACTIVE,  # Requested by a user, so it goes first
+            profile=request.profile
         )
+
+
+@router.get(
+    "/quarantine",
+    summary="List the sources (e.g. devices) skipped by an action after repeated failures",
+    response_model=List[dict]
+)
+async def list_quarantined_sources(integration_id: str, action_id: str = "pull_observations"):
+    failures = await state_manager.get_failures(integration_id=integration_id, action_id=action_id)
+    return list(failures.values())
+
+
+@router.get(
+    "/concurrency",
+    summary="Show the actions running and queued in this instance",
+)
+async def concurrency_stats():
+    return action_limiter.stats()
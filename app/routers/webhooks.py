@@ -1,6 +1,8 @@
 import logging
-from fastapi import APIRouter, BackgroundTasks, Request
+from fastapi import APIRouter, BackgroundTasks, Request, status
+from fastapi.responses import JSONResponse
 from app.services.webhooks import process_webhook
+from app.services.webhook_queue import QueuedWebhookRequest, webhook_queue
 from app import settings
 
 logger = logging.getLogger(__name__)
@@ -17,9 +19,18 @@ async def webhooks(
     background_tasks: BackgroundTasks
 ):
     body = await request.body()
-    print(f"Message Received through Webhooks. RAW body: {body}")
-    headers = dict(request.headers)
-    print(f"Headers: {headers}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Message Received through Webhooks. RAW body: {body}")
+        logger.debug(f"Headers: {dict(request.headers)}")
+    if settings.WEBHOOK_QUEUE_ENABLED:
+        # Parsed and processed by the queue workers
+        if not webhook_queue.put(QueuedWebhookRequest.from_body(body=body, request=request)):
+            logger.warning(f"Webhook queue is full ({webhook_queue.depth} requests). Request rejected.")
+            return JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={"detail": "Too many webhook requests are waiting to be processed. Please retry later."},
+            )
+        return {}
     if settings.PROCESS_WEBHOOKS_IN_BACKGROUND:
         background_tasks.add_task(
             process_webhook,
@@ -1,4 +1,5 @@
 import asyncio
+import inspect
 import logging
 import time
 import traceback
@@ -6,8 +7,10 @@ from typing import Optional
 
 import httpx
 import pydantic
+import redis.asyncio as redis
 import stamina
 from gundi_client_v2 import GundiClient
+from opentelemetry.trace import Status, StatusCode
 
 from app.actions import action_handlers, get_action_handler_by_data_type
 from app import settings
@@ -16,12 +19,27 @@ from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from gundi_core.events import IntegrationActionFailed, ActionExecutionFailed
 
+from .concurrency import ActionConcurrencyLimiter, ActionAdmission
 from .config_manager import IntegrationConfigurationManager
+from .core import ActionPriorityEnum
+from .errors import ActionConcurrencyLimitExceeded
+from .idempotency import CommandLeaseManager, get_command_fingerprint
+from .metrics import ACTIONS_QUEUED, ACTIONS_RUNNING, record_action
+from .profiling import profile_action
+from .tracing import start_span
 from .utils import find_config_for_action
 from .activity_logger import publish_event
 
 _portal = GundiClient()
 config_manager = IntegrationConfigurationManager()
+command_lease_manager = CommandLeaseManager()
+action_limiter = ActionConcurrencyLimiter(
+    max_concurrency=settings.MAX_CONCURRENT_ACTIONS,
+    max_queue_size=settings.MAX_QUEUED_ACTIONS,
+    action_limits=settings.ACTION_CONCURRENCY_LIMITS
+)
+ACTIONS_RUNNING.set_function(lambda: action_limiter.running)
+ACTIONS_QUEUED.set_function(lambda: action_limiter.queued)
 logger = logging.getLogger(__name__)
 
 
@@ -73,38 +91,168 @@ async def _handle_error(
     )
 
 
+def _concurrency_limit_response(exc: ActionConcurrencyLimitExceeded):
+    logger.warning(str(exc))
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content=jsonable_encoder({"detail": str(exc)}),
+    )
+
+
+def get_action_priority(action_id: Optional[str], config_overrides: dict = None) -> ActionPriorityEnum:
+    """
+    Returns the priority declared for an action with the @set_action_priority decorator, or NORMAL by default.
+    """
+    handler, _, _ = action_handlers.get(action_id, (None, None, None))
+    priority = getattr(handler, "action_priority", None)
+    if inspect.isfunction(priority):  # Derived from the configuration
+        try:
+            priority = priority(config_overrides or {})
+        except Exception as e:
+            logger.warning(f"Error getting the priority of action '{action_id}': {type(e).__name__}: {e}")
+    return priority if isinstance(priority, ActionPriorityEnum) else ActionPriorityEnum.NORMAL
+
+
+def admit_action(action_id: Optional[str], config_overrides: dict = None, priority: ActionPriorityEnum = None):
+    """
+    Reserves a place in the action limiter. Returns the admission, or an error response if the limiter is saturated.
+    Use it to reject work before accepting it, e.g. before scheduling the action as a background task.
+    """
+    try:
+        return action_limiter.admit(
+            action_id, priority=priority or get_action_priority(action_id, config_overrides)
+        )
+    except ActionConcurrencyLimitExceeded as e:
+        record_action(action_id=str(action_id), outcome="rejected")
+        return _concurrency_limit_response(e)
+
+
 async def execute_action(
         integration_id: str, action_id: Optional[str] = None, config_overrides: dict = None,
-        data: dict = None, metadata: dict = None
+        data: dict = None, metadata: dict = None, deduplicate: bool = False, admission: ActionAdmission = None,
+        priority: ActionPriorityEnum = None, trace_context: dict = None, profile: bool = False, command_id: str = None
+):
+    """
+    Executes an action handler. With deduplicate=True, the same command (the message with command_id, e.g. the PubSub
+    messageId) is executed only once while it's running and for a short window after it completes. Use it for commands
+    received through PubSub, which may be delivered more than once. Commands without an id aren't deduplicated.
+    Actions run within the concurrency limits of the process, using the given admission or a new one.
+    A new admission takes the given priority, or the one declared by the action.
+    The action span continues the trace in trace_context (e.g. PubSub attributes) if provided.
+    With profile=True the handler is profiled, as the actions and integrations set in PROFILE_ACTIONS/PROFILE_INTEGRATIONS.
+    """
+    if not admission:
+        admission = admit_action(action_id, config_overrides=config_overrides, priority=priority)
+        if isinstance(admission, JSONResponse):
+            return admission
+    span_attributes = {"integration_id": str(integration_id), "action_id": str(action_id)}
+    with start_span(f"execute_action {action_id}", trace_context=trace_context, attributes=span_attributes) as span:
+        async with admission:
+            result = await _execute_deduplicated_action(
+                integration_id=integration_id,
+                action_id=action_id,
+                config_overrides=config_overrides,
+                data=data,
+                metadata=metadata,
+                deduplicate=deduplicate,
+                profile=profile,
+                command_id=command_id
+            )
+        if isinstance(result, JSONResponse):  # Errors are returned as JSON responses
+            span.set_status(Status(StatusCode.ERROR))
+            span.set_attribute("http.response.status_code", result.status_code)
+        return result
+
+
+async def _keep_command_lease(fingerprint: str):
+    # Renewed while the action runs, so the lease of an instance that crashed expires soon and redeliveries run
+    while True:
+        await asyncio.sleep(settings.COMMAND_LEASE_TTL / 3)
+        try:
+            await command_lease_manager.renew(fingerprint)
+        except redis.RedisError as e:
+            logger.warning(f"Error renewing command lease: {e}")
+
+
+async def _execute_deduplicated_action(
+        integration_id: str, action_id: Optional[str] = None, config_overrides: dict = None,
+        data: dict = None, metadata: dict = None, deduplicate: bool = False, profile: bool = False,
+        command_id: str = None
 ):
+    action_kwargs = {
+        "integration_id": integration_id,
+        "action_id": action_id,
+        "config_overrides": config_overrides,
+        "data": data,
+        "metadata": metadata,
+        "profile": profile,
+    }
+    if not deduplicate or not action_id or not command_id:
+        return await _execute_action(**action_kwargs)
+
+    fingerprint = get_command_fingerprint(integration_id, action_id, config_overrides, command_id=command_id)
+    try:
+        acquired = await command_lease_manager.acquire(fingerprint)
+    except redis.RedisError as e:
+        logger.warning(f"Error checking for duplicated commands: {e}. Executing action '{action_id}' anyway.")
+        return await _execute_action(**action_kwargs)
+    if not acquired:
+        logger.info(
+            f"Action '{action_id}' for integration '{integration_id}' is running or completed recently. Duplicated command ignored."
+        )
+        record_action(action_id=action_id, outcome="duplicate")
+        return {"status": "ignored", "message": "Duplicated command"}
+
+    completed = False
+    lease_renewal = asyncio.create_task(_keep_command_lease(fingerprint))
+    try:
+        result = await _execute_action(**action_kwargs)
+        completed = not isinstance(result, JSONResponse)  # Errors are returned as JSON responses
+        return result
+    finally:
+        lease_renewal.cancel()
+        if completed:
+            await command_lease_manager.complete(fingerprint)
+        else:  # Let it run again when redelivered
+            await command_lease_manager.release(fingerprint)
+
+
+async def _execute_action(
+        integration_id: str, action_id: Optional[str] = None, config_overrides: dict = None,
+        data: dict = None, metadata: dict = None, profile: bool = False
+):
+    async def reject(exc: Exception, outcome: str = "invalid", **kwargs):
+        # Actions that don't reach the handler are counted too, so config errors show up in the metrics
+        record_action(action_id=action_id or "unknown", outcome=outcome)
+        return await _handle_error(exc, integration_id, action_id, **kwargs)
+
     try:  # Get the integration details to pass it to the action handler
         integration = await config_manager.get_integration_details(integration_id)
     except Exception as e:
-        return await _handle_error(e, integration_id, action_id)
+        return await reject(e, outcome="error")
+    if settings.WARMUP_ENABLED and settings.WARMUP_INTEGRATIONS:  # Preloaded by new instances
+        config_manager.track_integration_activity(integration_id)
 
     # Find the action handler based on the action ID or data type
     if action_id:
         try:  # There must be one action handler implemented for the action
             handler, config_model, DataModel = action_handlers[action_id]
         except KeyError:
-            return await _handle_error(
+            return await reject(
                 KeyError(f"Action '{action_id}' is not supported"),
-                integration_id, action_id,
                 status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
             )
     elif data and (data_type := data.get("event_type")):  # Push data actions
         try:  # Get the action handler by data type
             action_id, handler, config_model, DataModel = get_action_handler_by_data_type(type_name=data_type)
         except ValueError:
-            return await _handle_error(
+            return await reject(
                 ValueError(f"Data type '{data_type}' is not supported"),
-                integration_id, action_id,
                 status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
             )
     else:
-        return await _handle_error(
+        return await reject(
             ValueError("No action handler found by action ID or data type"),
-            integration_id, action_id,
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
         )
 
@@ -115,8 +263,8 @@ async def execute_action(
     if not action_config and not config_overrides:
         message = f"Configuration for action '{action_id}' for integration {str(integration.id)} is missing."
         logger.error(message)
-        return await _handle_error(
-            ValueError(message), integration_id, action_id,
+        return await reject(
+            ValueError(message),
             config_data={"configurations": [i.dict() for i in integration.configurations]},
             status_code=status.HTTP_404_NOT_FOUND
         )
@@ -127,14 +275,14 @@ async def execute_action(
             config_data.update(config_overrides)
         parsed_config = config_model.parse_obj(config_data)
     except pydantic.ValidationError as e:
-        return await _handle_error(e, integration_id, action_id, config_data, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return await reject(e, config_data=config_data, status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
     parsed_data = None
     if data and DataModel:
         try:  # Parse the input data if a data model is defined for the action
             parsed_data = DataModel(**data)
         except pydantic.ValidationError as e:
-            return await _handle_error(e, integration_id, action_id, data, status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return await reject(e, config_data=data, status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
     try:  # Execute the action handler with a timeout
         start_time = time.monotonic()
@@ -146,11 +294,13 @@ async def execute_action(
             handler_kwargs["data"] = parsed_data
         if metadata:
             handler_kwargs["metadata"] = metadata
-        result = await asyncio.wait_for(
-            handler(**handler_kwargs),
-            timeout=settings.MAX_ACTION_EXECUTION_TIME
-        )
+        with profile_action(integration_id, action_id, requested=profile):
+            result = await asyncio.wait_for(
+                handler(**handler_kwargs),
+                timeout=settings.MAX_ACTION_EXECUTION_TIME
+            )
     except asyncio.TimeoutError:
+        record_action(action_id=action_id, outcome="timeout", duration=time.monotonic() - start_time)
         return await _handle_error(
             asyncio.TimeoutError(f"Action '{action_id}' timed out"),
             integration_id, action_id,
@@ -158,12 +308,14 @@ async def execute_action(
             status_code=status.HTTP_504_GATEWAY_TIMEOUT
         )
     except Exception as e:
+        record_action(action_id=action_id, outcome="error", duration=time.monotonic() - start_time)
         return await _handle_error(e, integration_id, action_id,
                                    config_data={"configurations": [c.dict() for c in integration.configurations]})
 
     # Success. Log the execution time and return the result
     end_time = time.monotonic()
     execution_time = end_time - start_time
+    record_action(action_id=action_id, outcome="success", duration=execution_time)
     logger.debug(
         f"Action '{action_id}' executed successfully for integration {integration_id} in {execution_time:.2f} seconds."
     )
@@ -6,6 +6,7 @@ from typing import Any, Dict, Optional, Union, List, Annotated
 from gundi_core.commands import RunIntegrationAction
 from app import settings
 from .activity_logger import publish_event
+from .tracing import get_trace_context
 
 
 async def trigger_action(integration_id: str, action_id: str, config=None):
@@ -33,7 +34,10 @@ async def trigger_action(integration_id: str, action_id: str, config=None):
         if not settings.INTEGRATION_COMMANDS_TOPIC:
             error_msg = "Please set INTEGRATION_COMMANDS_TOPIC in the environment to trigger actions from the integration."
             raise ValueError(error_msg)
-        return await publish_event(run_action_command, settings.INTEGRATION_COMMANDS_TOPIC)
+        # The trace context goes in the message attributes, so the triggered action is linked to this one
+        return await publish_event(
+            run_action_command, settings.INTEGRATION_COMMANDS_TOPIC, attributes=get_trace_context()
+        )
 
 
 class CrontabSchedule(BaseModel):
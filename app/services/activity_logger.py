@@ -26,6 +26,8 @@ from gundi_core.events import (
     CustomWebhookLog,
 )
 from app import settings
+from .metrics import observe_duration
+from .profiling import get_current_profiler
 
 
 logger = logging.getLogger(__name__)
@@ -39,7 +41,8 @@ logger = logging.getLogger(__name__)
     wait_max=60,
     wait_jitter=5.0
 )
-async def publish_event(event: SystemEventBaseModel, topic_name: str):
+@observe_duration("pubsub")
+async def publish_event(event: SystemEventBaseModel, topic_name: str, attributes: dict = None):
     timeout_settings = aiohttp.ClientTimeout(total=20.0)
     async with aiohttp.ClientSession(
         raise_for_status=True, timeout=timeout_settings
@@ -49,7 +52,7 @@ async def publish_event(event: SystemEventBaseModel, topic_name: str):
         topic = client.topic_path(settings.GCP_PROJECT_ID, topic_name)
         # Prepare the payload
         binary_payload = json.dumps(event.dict(), default=str).encode("utf-8")
-        messages = [pubsub.PubsubMessage(binary_payload)]
+        messages = [pubsub.PubsubMessage(binary_payload, **(attributes or {}))]
         logger.debug(f"Sending event {event} to PubSub topic {topic_name}..")
         try:  # Send to pubsub
             response = await client.publish(topic, messages)
@@ -162,13 +165,16 @@ def activity_logger(on_start=True, on_completion=True, on_error=True):
                 raise e
             else:
                 if on_completion:
+                    event_result = result
+                    if (profiler := get_current_profiler()) and isinstance(result, dict):
+                        event_result = {**result, "profile": profiler.stop()}
                     await publish_event(
                         event=IntegrationActionComplete(
                             payload=ActionExecutionComplete(
                                 integration_id=integration_id,
                                 action_id=action_id,
                                 config_data=config_data,
-                                result=result
+                                result=event_result
                             )
                         ),
                         topic_name=settings.INTEGRATION_EVENTS_TOPIC,
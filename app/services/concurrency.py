@@ -0,0 +1,169 @@
+import asyncio
+from collections import Counter, deque
+from typing import Optional
+
+from .core import ActionPriorityEnum
+from .errors import ActionConcurrencyLimitExceeded
+
+
+# Share of the freed slots that each priority gets when actions of several priorities are waiting.
+# Interactive actions aren't weighted, they always go first.
+PRIORITY_WEIGHTS = {
+    ActionPriorityEnum.HIGH: 4,
+    ActionPriorityEnum.NORMAL: 2,
+    ActionPriorityEnum.LOW: 1,
+}
+
+
+def set_action_priority(priority):
+    """
+    Declares the priority of an action. It can be an ActionPriorityEnum,
+    or a function receiving the configuration overrides (dict) and returning an ActionPriorityEnum.
+    """
+    def decorator(func):
+        setattr(func, "action_priority", priority)
+        return func
+    return decorator
+
+
+class ActionAdmission:
+    """
+    A place in the action limiter, obtained with ActionConcurrencyLimiter.admit().
+    Use it as an async context manager around the action execution: it waits for a free slot on enter,
+    and frees the slot on exit.
+    """
+
+    def __init__(
+            self, limiter: "ActionConcurrencyLimiter", action_id: Optional[str],
+            priority: ActionPriorityEnum = ActionPriorityEnum.NORMAL
+    ):
+        self.limiter = limiter
+        self.action_id = action_id
+        self.priority = priority
+        self.running = False
+        self.closed = False
+
+    async def __aenter__(self):
+        await self.limiter._acquire(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.limiter._release(self)
+
+
+class ActionConcurrencyLimiter:
+    """
+    Limits how many actions run at the same time in this process, globally and per action.
+    Actions admitted over the limit wait in a bounded queue. When the queue is full, new actions are rejected,
+    so the caller can answer with an error and PubSub redelivers the command (possibly to another instance).
+    Waiting actions are started by priority: interactive ones first, then the others in weighted-fair order,
+    so heavy low-priority work can't starve cheap high-priority actions.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue_size: int, action_limits: dict = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.action_limits = action_limits or {}
+        self.running = 0
+        self.queued = 0
+        self.running_by_action = Counter()
+        self.queued_by_action = Counter()
+        self.queued_by_priority = Counter()
+        self._waiters = {priority: deque() for priority in ActionPriorityEnum}  # (admission, future)
+        # Stride scheduling: the lane with the lowest pass goes next, and its pass grows by 1 / weight
+        self._passes = {priority: 0.0 for priority in PRIORITY_WEIGHTS}
+
+    def admit(self, action_id: Optional[str], priority: ActionPriorityEnum = ActionPriorityEnum.NORMAL) -> ActionAdmission:
+        """
+        Reserves a place for an action, or raises ActionConcurrencyLimitExceeded if the queue is full.
+        """
+        if self.queued >= self.max_queue_size and not self._can_run(action_id):
+            raise ActionConcurrencyLimitExceeded(
+                f"Too many actions in progress ({self.running} running, {self.queued} queued). Action '{action_id}' rejected."
+            )
+        self.queued += 1
+        self.queued_by_action[action_id] += 1
+        self.queued_by_priority[priority] += 1
+        return ActionAdmission(limiter=self, action_id=action_id, priority=priority)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue_size": self.max_queue_size,
+            "running_by_action": {str(k): v for k, v in self.running_by_action.items() if v},
+            "queued_by_action": {str(k): v for k, v in self.queued_by_action.items() if v},
+            "queued_by_priority": {k.value: v for k, v in self.queued_by_priority.items() if v},
+        }
+
+    def _can_run(self, action_id: Optional[str]) -> bool:
+        if self.running >= self.max_concurrency:
+            return False
+        action_limit = self.action_limits.get(action_id)
+        return action_limit is None or self.running_by_action[action_id] < action_limit
+
+    def _dequeue(self, admission: ActionAdmission):
+        self.queued -= 1
+        self.queued_by_action[admission.action_id] -= 1
+        self.queued_by_priority[admission.priority] -= 1
+
+    def _start(self, admission: ActionAdmission):
+        self._dequeue(admission)
+        self.running += 1
+        self.running_by_action[admission.action_id] += 1
+        admission.running = True
+
+    async def _acquire(self, admission: ActionAdmission):
+        # Waiters are started as soon as they can run, so the ones left are blocked by the limits too
+        if self._can_run(admission.action_id):
+            self._start(admission)
+            return
+        if admission.priority in self._passes and not self._waiters[admission.priority]:
+            # A lane becoming active again can't claim the turns it missed while idle
+            self._passes[admission.priority] = max(self._passes[admission.priority], min(self._passes.values()))
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[admission.priority].append((admission, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if (admission, future) in self._waiters[admission.priority]:
+                self._waiters[admission.priority].remove((admission, future))
+            self._release(admission)  # __aexit__ won't be called
+            raise
+
+    def _release(self, admission: ActionAdmission):
+        if admission.closed:
+            return
+        admission.closed = True
+        if admission.running:
+            self.running -= 1
+            self.running_by_action[admission.action_id] -= 1
+        else:  # Left before it could run
+            self._dequeue(admission)
+        self._wake_up_waiters()
+
+    def _next_waiter(self, priority: ActionPriorityEnum):
+        # The first waiter in the lane that isn't over its own action limit
+        for admission, future in self._waiters[priority]:
+            if not future.done() and self._can_run(admission.action_id):
+                return admission, future
+        return None
+
+    def _wake_up_waiters(self):
+        while self.running < self.max_concurrency:
+            if waiter := self._next_waiter(ActionPriorityEnum.INTERACTIVE):
+                priority = ActionPriorityEnum.INTERACTIVE
+            else:
+                candidates = [
+                    (self._passes[priority], priority, waiter) for priority in PRIORITY_WEIGHTS
+                    if (waiter := self._next_waiter(priority))
+                ]
+                if not candidates:
+                    break
+                _, priority, waiter = min(candidates, key=lambda candidate: candidate[0])
+                self._passes[priority] += 1 / PRIORITY_WEIGHTS[priority]
+            admission, future = waiter
+            self._waiters[priority].remove(waiter)
+            self._start(admission)
+            future.set_result(None)
@@ -1,5 +1,9 @@
+import asyncio
+import json
 import logging
 
+import aiohttp
+from gcloud.aio import pubsub
 from gundi_core.events import (
     SystemEventBaseModel,
     IntegrationCreated,
@@ -12,6 +16,7 @@ from gundi_core.events import (
 
 
 from .config_manager import IntegrationConfigurationManager
+from .utils import dynamic_models
 
 
 logger = logging.getLogger(__name__)
@@ -24,15 +29,16 @@ async def handle_integration_created_event(event: IntegrationCreated):
 
 async def handle_integration_updated_event(event: IntegrationUpdated):
     event_data = event.payload
-    integration = await config_manager.get_integration(integration_id=event_data.id)
-    for key, value in event_data.changes.items():
-        if hasattr(integration, key):
-            setattr(integration, key, value)
-    await config_manager.set_integration(integration=integration)
+    # Applied atomically in redis, so concurrent updates don't overwrite each other
+    await config_manager.update_integration(integration_id=event_data.id, changes=event_data.changes)
+    if "webhook_configuration" in event_data.changes:  # The payload schema may have changed
+        await config_manager.delete_webhook_configuration(integration_id=event_data.id)
+        dynamic_models.invalidate(owner=str(event_data.id))
 
 
 async def handle_integration_deleted_event(event: IntegrationDeleted):
     await config_manager.delete_integration(integration_id=event.payload.id)
+    dynamic_models.invalidate(owner=str(event.payload.id))
 
 
 async def handle_action_config_created_event(event: ActionConfigCreated):
@@ -46,18 +52,10 @@ async def handle_action_config_created_event(event: ActionConfigCreated):
 
 async def handle_action_config_updated_event(event: ActionConfigUpdated):
     event_data = event.payload
-    integration_id = event_data.integration_id
-    action_id = event_data.alt_id
-    action_config = await config_manager.get_action_configuration(
-        integration_id=integration_id,
-        action_id=action_id
-    )
-    for key, value in event_data.changes.items():
-        setattr(action_config, key, value)
-    await config_manager.set_action_configuration(
-        integration_id=integration_id,
-        action_id=action_id,
-        config=action_config
+    await config_manager.update_action_configuration(
+        integration_id=event_data.integration_id,
+        action_id=event_data.alt_id,
+        changes=event_data.changes
     )
 
 
@@ -90,32 +88,188 @@ event_schemas = {
 }
 
 
+def parse_config_event(event_data: dict, attributes: dict = None):
+    """
+    Returns the event type and the parsed event, or an error response if the event can't be processed.
+    """
+    event = SystemEventBaseModel.parse_obj(event_data)
+    schema_version = event.schema_version
+    if schema_version != "v1":
+        logger.warning(
+            f"Schema version '{schema_version}' is not supported. Message discarded."
+        )
+        return None, {"status": "error", "message": "Unsupported schema version"}
+    event_type = (attributes or {}).get("event_type")
+    if event_type not in event_handlers:
+        logger.warning(f"Event of type '{event_type}' unknown. Message discarded.")
+        return None, {"status": "error", "message": "Unknown event type"}
+    try:
+        schema = event_schemas[event_type]
+    except KeyError:
+        logger.warning(f"Event Schema for '{event_type}' not found. Message discarded.")
+        return None, None
+    return event_type, schema.parse_obj(event_data)
+
+
 async def process_config_event(event_data: dict, attributes: dict = None):
     try:
         logger.info(f"Received Configuration Event. data: {event_data}, attributes: {attributes}.")
-        event = SystemEventBaseModel.parse_obj(event_data)
-        schema_version = event.schema_version
-        if schema_version != "v1":
-            logger.warning(
-                f"Schema version '{schema_version}' is not supported. Message discarded."
-            )
-            return {"status": "error", "message": "Unsupported schema version"}
-        try:
-            event_type = attributes.get("event_type")
-            handler = event_handlers[event_type]
-        except KeyError:
-            logger.warning(f"Event of type '{event_type}' unknown. Message discarded.")
-            return {"status": "error", "message": "Unknown event type"}
-        try:
-            schema = event_schemas[event_type]
-        except KeyError:
-            logger.warning(f"Event Schema for '{event_type}' not found. Message discarded.")
-            return
-        parsed_event = schema.parse_obj(event_data)
-        await handler(event=parsed_event)
+        event_type, parsed_event = parse_config_event(event_data, attributes)
+        if not event_type:  # Discarded
+            return parsed_event
+        await event_handlers[event_type](event=parsed_event)
     except Exception as e:  # ToDo: handle more specific exceptions
         logger.exception(f"Error processing event: {type(e)}:{e}",)
         return {"status": "error", "message": f"Internal error: {str(e)}"}
     else:
         logger.info(f"Configuration event {event_type} ({parsed_event.event_id}) processed successfully.")
         return {"status": "success", "message": "Event processed successfully"}
+
+
+DELETED = "deleted"
+
+
+class ConfigChangesBatch:
+    """
+    Changes from a batch of configuration events, coalesced by integration and by action configuration,
+    so many events about the same configuration (e.g. from a bulk edit in the portal) result in one write.
+    Events must be added in the order they were published.
+    """
+
+    def __init__(self):
+        # key -> {"base": object saved as is, DELETED, or None to update the saved one, "changes": {}, "messages": [indexes]}
+        self.integrations = {}
+        self.action_configs = {}
+
+    @staticmethod
+    def _get_entry(entries: dict, key):
+        return entries.setdefault(key, {"base": None, "changes": {}, "messages": []})
+
+    def add(self, event_type: str, event, message_index: int = None):
+        payload = event.payload
+        if event_type.startswith("Integration"):
+            integration_id = str(payload.id)
+            entry = self._get_entry(self.integrations, integration_id)
+        else:
+            if event_type == "ActionConfigCreated":
+                key = (str(payload.integration), payload.action.value)
+            else:
+                key = (str(payload.integration_id), payload.alt_id)
+            entry = self._get_entry(self.action_configs, key)
+        entry["messages"].append(message_index)
+        if event_type in ("IntegrationCreated", "ActionConfigCreated"):  # Replaces anything before
+            entry["base"], entry["changes"] = payload, {}
+        elif event_type in ("IntegrationDeleted", "ActionConfigDeleted"):
+            entry["base"], entry["changes"] = DELETED, {}
+        else:  # Updated
+            entry["changes"].update(payload.changes)
+
+    async def apply(self, config_manager: IntegrationConfigurationManager) -> set:
+        """
+        Applies the coalesced changes in one pipeline. Updates are merged in redis, without reading the configurations.
+        Returns the indexes of the messages that couldn't be applied.
+        """
+        integrations, integration_changes, deleted_integration_ids = [], {}, []
+        for integration_id, entry in self.integrations.items():
+            if entry["base"] == DELETED:
+                deleted_integration_ids.append(integration_id)
+            elif entry["base"]:
+                for key, value in entry["changes"].items():
+                    if hasattr(entry["base"], key):
+                        setattr(entry["base"], key, value)
+                integrations.append(entry["base"])
+            else:
+                integration_changes[integration_id] = entry["changes"]
+        action_configs, action_config_changes, deleted_action_configs = [], {}, []
+        for key, entry in self.action_configs.items():
+            if entry["base"] == DELETED:
+                deleted_action_configs.append(key)
+            elif entry["base"]:
+                for field, value in entry["changes"].items():
+                    setattr(entry["base"], field, value)
+                action_configs.append((*key, entry["base"]))
+            else:
+                action_config_changes[key] = entry["changes"]
+        try:
+            await config_manager.write_configurations(
+                integrations=integrations,
+                integration_changes=integration_changes,
+                deleted_integration_ids=deleted_integration_ids,
+                action_configs=action_configs,
+                action_config_changes=action_config_changes,
+                deleted_action_configs=deleted_action_configs,
+            )
+        except Exception as e:
+            logger.exception(f"Error saving configuration changes: {type(e).__name__}: {e}")
+            return {i for entry in [*self.integrations.values(), *self.action_configs.values()] for i in entry["messages"]}
+        for integration_id, entry in self.integrations.items():
+            if entry["base"] == DELETED:
+                dynamic_models.invalidate(owner=integration_id)
+            elif "webhook_configuration" in entry["changes"]:  # The payload schema may have changed
+                await config_manager.delete_webhook_configuration(integration_id=integration_id)
+                dynamic_models.invalidate(owner=integration_id)
+        return set()
+
+
+async def process_config_events(messages: list):
+    """
+    Processes a batch of configuration events, e.g. pulled from a subscription, coalescing the changes
+    to the same integration or action configuration into one write.
+    :param messages: list of (event_data, attributes) tuples, in the order they were published
+    :return: a result for each message, as returned by process_config_event()
+    """
+    results = [None] * len(messages)
+    batch = ConfigChangesBatch()
+    for index, (event_data, attributes) in enumerate(messages):
+        try:
+            event_type, parsed_event = parse_config_event(event_data, attributes)
+            if not event_type:  # Discarded
+                results[index] = parsed_event
+                continue
+            batch.add(event_type, parsed_event, message_index=index)
+        except Exception as e:
+            logger.exception(f"Error processing event: {type(e)}:{e}",)
+            results[index] = {"status": "error", "message": f"Internal error: {str(e)}"}
+    failed_messages = await batch.apply(config_manager)
+    for index in range(len(messages)):
+        if index in failed_messages:
+            results[index] = {"status": "error", "message": "Internal error: configuration changes not saved"}
+        elif results[index] is None:
+            results[index] = {"status": "success", "message": "Event processed successfully"}
+    logger.info(
+        f"{len(messages)} configuration events processed, {len(batch.integrations)} integrations "
+        f"and {len(batch.action_configs)} action configurations changed, {len(failed_messages)} events failed."
+    )
+    return results
+
+
+async def pull_config_events(subscription: str, max_messages: int = 100, subscriber=None):
+    """
+    Pulls a batch of configuration events from a PubSub subscription, processes them and acknowledges them.
+    Failed events are acknowledged too, as in the push endpoint. Returns the number of messages pulled.
+    """
+    subscriber = subscriber or pubsub.SubscriberClient()
+    messages = await subscriber.pull(subscription, max_messages=max_messages)
+    if not messages:
+        return 0
+    await process_config_events(
+        [(json.loads(message.data) if message.data else {}, message.attributes or {}) for message in messages]
+    )
+    await subscriber.acknowledge(subscription, ack_ids=[message.ack_id for message in messages])
+    return len(messages)
+
+
+async def run_config_events_puller(subscription: str, max_messages: int = 100, idle_wait: float = 1.0):
+    """
+    Pulls and processes configuration events in batches until cancelled.
+    """
+    async with aiohttp.ClientSession() as session:
+        subscriber = pubsub.SubscriberClient(session=session)
+        while True:
+            try:
+                pulled = await pull_config_events(subscription, max_messages=max_messages, subscriber=subscriber)
+            except Exception as e:
+                logger.exception(f"Error pulling configuration events: {type(e).__name__}: {e}")
+                pulled = 0
+            if not pulled:
+                await asyncio.sleep(idle_wait)
@@ -1,89 +1,468 @@
+import asyncio
 import json
+import logging
+import time
+from typing import Optional, Tuple
+from collections import OrderedDict
+
 import stamina
 import httpx
 import redis.asyncio as redis
 from gundi_core.schemas.v2 import Integration, IntegrationSummary, IntegrationActionConfiguration
+from gundi_core.schemas.v2.gundi import WebhookConfiguration
 from gundi_client_v2 import GundiClient
 from app import settings
+from .errors import IntegrationNotFound
+from .metrics import observe_call, observe_duration
+
+
+logger = logging.getLogger(__name__)
+
+class LocalIntegrationCache:
+    """
+    In-process LRU cache of integration details, in front of the Redis cache.
+    Entries expire after `ttl` seconds, as other instances may update Redis meanwhile
+    (longer while change notifications are received, see run_config_changes_listener()).
+    Unknown integrations are cached as None.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0  # Incremented on every invalidation
+        self._entries = OrderedDict()  # integration_id -> (expires_at, integration)
+
+    def get(self, integration_id: str):
+        """
+        Returns a (found, integration) tuple. The integration is None if it's cached as not found.
+        """
+        entry = self._entries.get(str(integration_id))
+        if entry is None:
+            return False, None
+        expires_at, integration = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(str(integration_id), None)
+            return False, None
+        self._entries.move_to_end(str(integration_id))
+        return True, integration
+
+    def set(self, integration_id: str, integration, ttl: float = None, generation: int = None):
+        """
+        Caches the integration. Pass the generation read before loading it, to discard it if
+        something was invalidated meanwhile (it may have been loaded before a change).
+        """
+        if self.max_size <= 0 or (generation is not None and generation != self.generation):
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[str(integration_id)] = (expires_at, integration)
+        self._entries.move_to_end(str(integration_id))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, integration_id: str):
+        self.generation += 1
+        self._entries.pop(str(integration_id), None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared by every config manager in the process, so config events invalidate what actions and webhooks read
+integration_cache = LocalIntegrationCache(
+    max_size=settings.INTEGRATION_CACHE_SIZE,
+    ttl=settings.INTEGRATION_CACHE_TTL
+)
+
+
+# Integrations and action configurations are saved as hashes with one JSON encoded field per attribute,
+# plus a version taken from a shared counter, so cached copies can be validated.
+# The hashes have their own keys (integration.v2.*, integrationconfig.v2.*), apart from the strings saved by previous
+# versions, which can't read hashes. So both versions can run at once during a deploy or after a rollback.
+# Replaces the whole configuration.
+SET_CONFIG_SCRIPT = """
+local version = redis.call('INCR', KEYS[2])
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '_version', version, unpack(ARGV))
+return version
+"""
+
+# Updates some attributes, only if the configuration is saved. Otherwise, it's loaded from the portal when read.
+UPDATE_CONFIG_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'hash' then
+    return false
+end
+local version = redis.call('INCR', KEYS[2])
+redis.call('HSET', KEYS[1], '_version', version, unpack(ARGV))
+return version
+"""
+
+VERSION_FIELD = "_version"
+
+
+def to_hash_fields(data: dict) -> list:
+    """
+    Flattens the attributes of a configuration into [field, JSON value, ...], as expected by the scripts above.
+    """
+    return [item for key, value in data.items() for item in (key, json.dumps(value, default=str))]
+
+
+def from_hash(values: dict) -> Tuple[dict, int]:
+    """
+    Returns the attributes and the version of a configuration read with HGETALL.
+    """
+    data = {key.decode(): json.loads(value) for key, value in values.items() if key != VERSION_FIELD.encode()}
+    return data, int(values.get(VERSION_FIELD.encode(), 0))
 
 
 class IntegrationConfigurationManager:
-    # ToDo: Add support for webhook configs
 
     def __init__(self, **kwargs):
         host = kwargs.get("host", settings.REDIS_HOST)
         port = kwargs.get("port", settings.REDIS_PORT)
         db = kwargs.get("db", settings.REDIS_CONFIGS_DB)
         self.db_client = redis.Redis(host=host, port=port, db=db)
+        self.local_cache = kwargs.get("local_cache", integration_cache)
+        self._activity_recorded_at = {}  # integration_id -> time.monotonic()
+        self._background_tasks = set()
 
     def _get_integration_key(self, integration_id: str) -> str:
-        return f"integration.{integration_id}"
+        return f"integration.v2.{integration_id}"
+
+    def _get_integration_not_found_key(self, integration_id: str) -> str:
+        return f"integrationnotfound.{integration_id}"
+
+    def _get_webhook_config_key(self, integration_id: str) -> str:
+        return f"integrationwebhookconfig.{integration_id}"
 
     def _get_integration_config_key(self, integration_id: str, action_id: str) -> str:
-        return f"integrationconfig.{integration_id}.{action_id}"
+        return f"integrationconfig.v2.{integration_id}.{action_id}"
 
-    async def _reload_integration_from_gundi(self, integration_id: str) -> Integration:
-        key = self._get_integration_key(integration_id)
+    def _get_version_key(self) -> str:
+        return "configversion"
+
+    def _get_active_integrations_key(self) -> str:
+        return "activeintegrations"
+
+    def _set_config(self, client, key: str, config):
+        return client.eval(
+            SET_CONFIG_SCRIPT, 2, key, self._get_version_key(), *to_hash_fields(json.loads(config.json()))
+        )
+
+    def _update_config(self, client, key: str, changes: dict):
+        return client.eval(UPDATE_CONFIG_SCRIPT, 2, key, self._get_version_key(), *to_hash_fields(changes))
+
+    async def _notify_changes(self, *integration_ids):
+        """
+        Invalidates the changed integrations in the local cache, and broadcasts their ids so other instances do it too.
+        Best effort: without notifications, cached entries still expire.
+        """
+        integration_ids = {str(integration_id) for integration_id in integration_ids}
+        for integration_id in integration_ids:
+            self.local_cache.invalidate(integration_id)
+        if not integration_ids:
+            return
+        try:
+            with observe_call("redis", "notify_changes"):
+                async with self.db_client.pipeline(transaction=False) as pipe:
+                    for integration_id in integration_ids:
+                        pipe.publish(settings.CONFIG_CHANGES_CHANNEL, integration_id)
+                    await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Error notifying configuration changes: {type(e).__name__}: {e}")
+
+    # Only the redis calls are timed as "redis", not the retries or the reloads from the portal
+    @observe_duration("redis", operation="get_config")
+    async def _read_config(self, key: str) -> Optional[dict]:
+        return await self.db_client.hgetall(key)
+
+    @observe_duration("redis", operation="get_webhook_configuration")
+    async def _read_webhook_config(self, key: str) -> Optional[bytes]:
+        return await self.db_client.get(key)
+
+    async def _get_config(self, key: str) -> Tuple[Optional[dict], int]:
+        for attempt in stamina.retry_context(on=(redis.ConnectionError, redis.TimeoutError), attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                values = await self._read_config(key)
+        return from_hash(values) if values else (None, 0)
+
+    @observe_duration("gundi", operation="get_integration_details")
+    async def _reload_integration_from_gundi(self, integration_id: str) -> Tuple[Integration, dict]:
+        """
+        Loads the integration details from the portal and saves them in redis.
+        Returns the details and the versions saved, as {"integration": 1, "<action_id>": 2, ...}
+        """
         async with GundiClient() as gundi:
             async for attempt in stamina.retry_context(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0,  wait_max=32.0):
                 with attempt:
-                    integration_details = await gundi.get_integration_details(integration_id)
-            integration = IntegrationSummary.from_integration(integration_details)
-            await self.db_client.set(key, integration.json())
-            # Save configurations for individual actions
+                    try:
+                        integration_details = await gundi.get_integration_details(integration_id)
+                    except httpx.HTTPStatusError as e:
+                        if e.response.status_code != 404:
+                            raise
+                        not_found = True  # Not retried
+                    else:
+                        not_found = False
+        if not_found:
+            # Remember it for a while, so requests for unknown integrations don't reach the portal every time
+            await self.db_client.set(
+                self._get_integration_not_found_key(integration_id), 1, ex=settings.INTEGRATION_NOT_FOUND_TTL
+            )
+            raise IntegrationNotFound(f"Integration '{integration_id}' not found in the portal.")
+        integration = IntegrationSummary.from_integration(integration_details)
+        webhook_config = integration_details.webhook_configuration
+        # Save the integration and the configurations for individual actions in one round trip
+        async with self.db_client.pipeline(transaction=False) as pipe:
+            self._set_config(pipe, self._get_integration_key(integration_id), integration)
             for config in integration_details.configurations:
-                config_key = self._get_integration_config_key(integration_id, config.action.value)
-                await self.db_client.set(config_key, config.json())
-            return integration_details
+                self._set_config(pipe, self._get_integration_config_key(integration_id, config.action.value), config)
+            pipe.set(
+                self._get_webhook_config_key(integration_id),
+                webhook_config.json() if webhook_config else "null",
+                ex=settings.WEBHOOK_CONFIG_TTL  # Changes may not be notified, see get_webhook_configuration()
+            )
+            results = await pipe.execute()
+        names = ["integration"] + [config.action.value for config in integration_details.configurations]
+        return integration_details, dict(zip(names, results))
 
-    async def get_action_configuration(self, integration_id: str, action_id: str) -> IntegrationActionConfiguration:
-        key = self._get_integration_config_key(integration_id, action_id)
-        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
-            with attempt:
-                data = await self.db_client.get(key)
+    async def get_action_configuration_with_version(
+            self, integration_id: str, action_id: str
+    ) -> Tuple[Optional[IntegrationActionConfiguration], int]:
+        """
+        Returns the action configuration and its version. The version changes on every write.
+        """
+        data, version = await self._get_config(self._get_integration_config_key(integration_id, action_id))
         if data:
-            return IntegrationActionConfiguration.parse_raw(data)
+            return IntegrationActionConfiguration.parse_obj(data), version
         # If not found in the redis db, try reloading data from Gundi API
-        integration_details = await self._reload_integration_from_gundi(integration_id)
-        return integration_details.get_action_config(action_id)
+        integration_details, versions = await self._reload_integration_from_gundi(integration_id)
+        return integration_details.get_action_config(action_id), versions.get(action_id, 0)
+
+    async def get_action_configuration(self, integration_id: str, action_id: str) -> IntegrationActionConfiguration:
+        action_config, _ = await self.get_action_configuration_with_version(integration_id, action_id)
+        return action_config
 
     async def set_action_configuration(self, integration_id: str, action_id: str, config: IntegrationActionConfiguration):
         key = self._get_integration_config_key(integration_id, action_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
-            with attempt:
-                await self.db_client.set(key, config.json())
+            with attempt, observe_call("redis", "set_action_configuration"):
+                version = await self._set_config(self.db_client, key, config)
+        await self._notify_changes(integration_id)
+        return version
 
-    async def delete_action_configuration(self, integration_id: str, action_id: str):
+    async def update_action_configuration(self, integration_id: str, action_id: str, changes: dict) -> Optional[int]:
+        """
+        Applies changes to the saved action configuration atomically, in one round trip.
+        Returns the new version, or None if it isn't saved (it's loaded with the changes from the portal when read).
+        """
+        changes = {k: v for k, v in changes.items() if k in IntegrationActionConfiguration.__fields__}
         key = self._get_integration_config_key(integration_id, action_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
-            with attempt:
-                return await self.db_client.delete(key)
+            with attempt, observe_call("redis", "update_action_configuration"):
+                version = await self._update_config(self.db_client, key, changes)
+        await self._notify_changes(integration_id)
+        return version
 
-    async def get_integration(self, integration_id: str) -> IntegrationSummary:
-        key = self._get_integration_key(integration_id)
+    async def delete_action_configuration(self, integration_id: str, action_id: str):
+        key = self._get_integration_config_key(integration_id, action_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
-            with attempt:
-                integration_data = await self.db_client.get(key)
-        if integration_data:
-            # Looks for configurations
-            return IntegrationSummary.parse_raw(integration_data)
+            with attempt, observe_call("redis", "delete_action_configuration"):
+                result = await self.db_client.delete(key)
+        await self._notify_changes(integration_id)
+        return result
+
+    async def get_integration_with_version(self, integration_id: str) -> Tuple[IntegrationSummary, int]:
+        """
+        Returns the integration and its version. The version changes on every write.
+        """
+        data, version = await self._get_config(self._get_integration_key(integration_id))
+        if data:
+            return IntegrationSummary.parse_obj(data), version
+        if await self.db_client.exists(self._get_integration_not_found_key(integration_id)):
+            raise IntegrationNotFound(f"Integration '{integration_id}' not found in the portal.")
         # If not found in cache, reload from Gundi
-        integration_details = await self._reload_integration_from_gundi(integration_id)
-        return IntegrationSummary.from_integration(integration_details)
+        integration_details, versions = await self._reload_integration_from_gundi(integration_id)
+        return IntegrationSummary.from_integration(integration_details), versions.get("integration", 0)
+
+    async def get_integration(self, integration_id: str) -> IntegrationSummary:
+        integration, _ = await self.get_integration_with_version(integration_id)
+        return integration
+
+    async def get_config_version(self, integration_id: str, action_id: str = None) -> int:
+        """
+        Returns the current version of the integration, or of an action configuration, to validate cached copies.
+        0 means it isn't saved.
+        """
+        if action_id:
+            key = self._get_integration_config_key(integration_id, action_id)
+        else:
+            key = self._get_integration_key(integration_id)
+        for attempt in stamina.retry_context(on=(redis.ConnectionError, redis.TimeoutError), attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "get_config_version"):
+                version = await self.db_client.hget(key, VERSION_FIELD)
+        return int(version or 0)
 
     async def set_integration(self, integration: IntegrationSummary):
         key = self._get_integration_key(integration.id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
-            with attempt:
-                await self.db_client.set(key, integration.json())
+            with attempt, observe_call("redis", "set_integration"):
+                version = await self._set_config(self.db_client, key, integration)
+                await self.db_client.delete(self._get_integration_not_found_key(integration.id))
+        await self._notify_changes(integration.id)
+        return version
+
+    async def update_integration(self, integration_id: str, changes: dict) -> Optional[int]:
+        """
+        Applies changes to the saved integration atomically, in one round trip.
+        Returns the new version, or None if it isn't saved (it's loaded with the changes from the portal when read).
+        """
+        changes = {k: v for k, v in changes.items() if k in IntegrationSummary.__fields__}
+        key = self._get_integration_key(integration_id)
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "update_integration"):
+                version = await self._update_config(self.db_client, key, changes)
+        await self._notify_changes(integration_id)
+        return version
 
     async def delete_integration(self, integration_id: str):
         key = self._get_integration_key(integration_id)
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "delete_integration"):
+                await self.db_client.delete(key, self._get_webhook_config_key(integration_id))
+        await self._notify_changes(integration_id)
+
+    async def write_configurations(
+            self, integrations=(), integration_changes=None, deleted_integration_ids=(),
+            action_configs=(), action_config_changes=None, deleted_action_configs=()
+    ):
+        """
+        Saves, updates and deletes integrations and action configurations in one round trip to redis (a pipeline).
+        Each write is atomic, see update_integration() and update_action_configuration().
+        :param integrations: IntegrationSummary objects to save
+        :param integration_changes: changes to apply to saved integrations, as {integration_id: changes}
+        :param deleted_integration_ids: ids of the integrations to delete
+        :param action_configs: (integration_id, action_id, IntegrationActionConfiguration) tuples to save
+        :param action_config_changes: changes to apply to saved action configurations, as {(integration_id, action_id): changes}
+        :param deleted_action_configs: (integration_id, action_id) tuples to delete
+        """
+        integration_changes = integration_changes or {}
+        action_config_changes = action_config_changes or {}
+        integration_ids = [integration.id for integration in integrations] + list(integration_changes)
+        integration_ids += list(deleted_integration_ids) + [config[0] for config in action_configs]
+        integration_ids += [key[0] for key in action_config_changes] + [config[0] for config in deleted_action_configs]
+        integration_ids = {str(integration_id) for integration_id in integration_ids}
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "write_configurations"):
+                async with self.db_client.pipeline(transaction=False) as pipe:
+                    for integration in integrations:
+                        self._set_config(pipe, self._get_integration_key(integration.id), integration)
+                        pipe.delete(self._get_integration_not_found_key(integration.id))
+                    for integration_id, changes in integration_changes.items():
+                        changes = {k: v for k, v in changes.items() if k in IntegrationSummary.__fields__}
+                        self._update_config(pipe, self._get_integration_key(integration_id), changes)
+                    for integration_id in deleted_integration_ids:
+                        pipe.delete(self._get_integration_key(integration_id), self._get_webhook_config_key(integration_id))
+                    for integration_id, action_id, config in action_configs:
+                        self._set_config(pipe, self._get_integration_config_key(integration_id, action_id), config)
+                    for (integration_id, action_id), changes in action_config_changes.items():
+                        changes = {k: v for k, v in changes.items() if k in IntegrationActionConfiguration.__fields__}
+                        self._update_config(pipe, self._get_integration_config_key(integration_id, action_id), changes)
+                    for integration_id, action_id in deleted_action_configs:
+                        pipe.delete(self._get_integration_config_key(integration_id, action_id))
+                    # Notified in the same round trip
+                    for integration_id in integration_ids:
+                        pipe.publish(settings.CONFIG_CHANGES_CHANNEL, integration_id)
+                    await pipe.execute()
+        for integration_id in integration_ids:
+            self.local_cache.invalidate(integration_id)
+
+    async def get_webhook_configuration(self, integration_id: str) -> Optional[WebhookConfiguration]:
+        """
+        The webhook configuration saved in redis, or None if the integration has none.
+        It expires after WEBHOOK_CONFIG_TTL seconds and is reloaded from the portal, as IntegrationUpdated events
+        may not include the changes to it.
+        """
+        key = self._get_webhook_config_key(integration_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
+                data = await self._read_webhook_config(key)
+        if data:  # "null" means the integration has no webhook configuration
+            config_data = json.loads(data)
+            return WebhookConfiguration.parse_obj(config_data) if config_data else None
+        # If not found in the redis db, try reloading data from Gundi API
+        integration_details, _ = await self._reload_integration_from_gundi(integration_id)
+        return integration_details.webhook_configuration
+
+    async def delete_webhook_configuration(self, integration_id: str):
+        # Reloaded from the portal in the next read
+        key = self._get_webhook_config_key(integration_id)
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "delete_webhook_configuration"):
                 await self.db_client.delete(key)
+        await self._notify_changes(integration_id)
+
+    def track_integration_activity(self, integration_id: str):
+        """
+        Records the activity of an integration in the background, at most once every
+        ACTIVE_INTEGRATIONS_RECORD_INTERVAL seconds per integration, so it doesn't slow down actions.
+        """
+        integration_id = str(integration_id)
+        now = time.monotonic()
+        recorded_at = self._activity_recorded_at.get(integration_id)
+        if recorded_at is not None and now - recorded_at < settings.ACTIVE_INTEGRATIONS_RECORD_INTERVAL:
+            return
+        if len(self._activity_recorded_at) >= settings.ACTIVE_INTEGRATIONS_TRACKED:
+            self._activity_recorded_at.clear()
+        self._activity_recorded_at[integration_id] = now
+        task = asyncio.create_task(self.record_integration_activity(integration_id))
+        self._background_tasks.add(task)  # Referenced until it's done
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def record_integration_activity(self, integration_id: str):
+        """
+        Keeps the most recently active integrations in a sorted set, scored by time, to preload them on startup.
+        Errors are logged, not raised.
+        """
+        key = self._get_active_integrations_key()
+        try:
+            async with self.db_client.pipeline(transaction=False) as pipe:
+                pipe.zadd(key, {str(integration_id): time.time()})
+                pipe.zremrangebyrank(key, 0, -settings.ACTIVE_INTEGRATIONS_TRACKED - 1)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Error recording activity of integration '{integration_id}': {type(e).__name__}: {e}")
+
+    @observe_duration("redis")
+    async def get_active_integrations(self, limit: int) -> list:
+        """
+        Ids of the most recently active integrations, most recent first.
+        """
+        integration_ids = await self.db_client.zrevrange(self._get_active_integrations_key(), 0, limit - 1)
+        return [integration_id.decode() for integration_id in integration_ids]
 
     async def get_integration_details(self, integration_id: str) -> Integration:
+        """
+        Integration details, looked up in the in-process cache, then in Redis, then in the portal.
+        Raises IntegrationNotFound if the portal doesn't know the integration (the result is cached too).
+        """
+        found, integration = self.local_cache.get(integration_id)
+        if found:
+            if integration is None:
+                raise IntegrationNotFound(f"Integration '{integration_id}' not found in the portal.")
+            return integration
+        generation = self.local_cache.generation
+        try:
+            integration = await self._get_integration_details(integration_id)
+        except IntegrationNotFound:
+            self.local_cache.set(integration_id, None, ttl=settings.INTEGRATION_NOT_FOUND_TTL, generation=generation)
+            raise
+        self.local_cache.set(integration_id, integration, generation=generation)
+        return integration
+
+    async def _get_integration_details(self, integration_id: str) -> Integration:
         integration_summary = await self.get_integration(integration_id)
         configurations = []
         for action in integration_summary.type.actions:
@@ -100,5 +479,39 @@ class IntegrationConfigurationManager:
             default_route=integration_summary.default_route,
             additional=integration_summary.additional,
             configurations=configurations,
-            # ToDo: webhook_configuration
-        )
\ No newline at end of file
+            webhook_configuration=await self.get_webhook_configuration(integration_id),
+        )
+
+
+async def run_config_changes_listener(
+        channel: str = None, local_cache: LocalIntegrationCache = None, client=None,
+        retry_wait: float = 1.0, max_retry_wait: float = 30.0
+):
+    """
+    Invalidates the local cache of integrations when any instance changes them, until cancelled.
+    While subscribed, entries are kept for INTEGRATION_CACHE_TTL_WITH_NOTIFICATIONS seconds.
+    If the connection is lost, the cache is cleared and the regular TTL is used until it's subscribed again.
+    """
+    channel = channel or settings.CONFIG_CHANGES_CHANNEL
+    local_cache = integration_cache if local_cache is None else local_cache
+    client = client or redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_CONFIGS_DB)
+    default_ttl = local_cache.ttl
+    wait = retry_wait
+    while True:
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(channel)
+                # Changes may have been missed while disconnected
+                local_cache.clear()
+                local_cache.ttl = settings.INTEGRATION_CACHE_TTL_WITH_NOTIFICATIONS
+                wait = retry_wait
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        local_cache.invalidate(message["data"].decode())
+        except redis.RedisError as e:
+            logger.warning(f"Configuration changes listener disconnected: {type(e).__name__}: {e}. Retrying in {wait}s.")
+        finally:
+            local_cache.ttl = default_ttl
+            local_cache.clear()
+        await asyncio.sleep(wait)
+        wait = min(wait * 2, max_retry_wait)
@@ -6,3 +6,10 @@ class ActionTypeEnum(str, Enum):
     PULL_DATA = "pull"
     PUSH_DATA = "push"
     GENERIC = "generic"
+
+
+class ActionPriorityEnum(str, Enum):
+    INTERACTIVE = "interactive"  # Requested by a user, e.g. through the API
+    HIGH = "high"
+    NORMAL = "normal"
+    LOW = "low"  # Backfills, fan-outs and other heavy work
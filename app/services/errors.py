@@ -4,6 +4,10 @@ class ActionNotFound(Exception):
     pass
 
 
+class IntegrationNotFound(Exception):
+    pass
+
+
 class ConfigurationNotFound(Exception):
     pass
 
@@ -15,3 +19,6 @@ class ConfigurationValidationError(Exception):
 class ActionExecutionError(Exception):
     pass
 
+
+class ActionConcurrencyLimitExceeded(Exception):
+    pass
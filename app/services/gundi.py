@@ -3,9 +3,17 @@ from typing import List
 import httpx
 import stamina
 from gundi_client_v2.client import GundiClient, GundiDataSenderClient
+from app import settings
+from .config_manager import LocalIntegrationCache
+from .metrics import observe_duration
+
+
+# API keys of the integrations, so they aren't requested to the portal on every send
+api_key_cache = LocalIntegrationCache(max_size=settings.INTEGRATION_CACHE_SIZE, ttl=settings.GUNDI_API_KEY_CACHE_TTL)
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
+@observe_duration("gundi")
 async def _get_gundi_api_key(integration_id):
     async with GundiClient() as gundi_client:
         return await gundi_client.get_integration_api_key(
@@ -13,8 +21,22 @@ async def _get_gundi_api_key(integration_id):
         )
 
 
-async def _get_sensors_api_client(integration_id):
+async def get_gundi_api_key(integration_id) -> str:
+    """
+    API key of the integration, cached in the process for GUNDI_API_KEY_CACHE_TTL seconds.
+    """
+    found, gundi_api_key = api_key_cache.get(integration_id)
+    if found:
+        return gundi_api_key
+    generation = api_key_cache.generation
     gundi_api_key = await _get_gundi_api_key(integration_id=integration_id)
+    if gundi_api_key:
+        api_key_cache.set(integration_id, gundi_api_key, generation=generation)
+    return gundi_api_key
+
+
+async def _get_sensors_api_client(integration_id):
+    gundi_api_key = await get_gundi_api_key(integration_id=integration_id)
     assert gundi_api_key, f"Cannot get a valid API Key for integration {integration_id}"
     sensors_api_client = GundiDataSenderClient(
         integration_api_key=gundi_api_key
@@ -23,6 +45,7 @@ async def _get_sensors_api_client(integration_id):
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
+@observe_duration("gundi")
 async def send_events_to_gundi(events: List[dict], **kwargs) -> dict:
     """
     Send Events to Gundi using the REST API v2
@@ -52,6 +75,7 @@ async def send_events_to_gundi(events: List[dict], **kwargs) -> dict:
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
+@observe_duration("gundi")
 async def send_event_attachments_to_gundi(event_id: str, attachments: List[tuple], **kwargs) -> dict:
     """
     Send Event Attachments to Gundi using the REST API v2
@@ -70,6 +94,7 @@ async def send_event_attachments_to_gundi(event_id: str, attachments: List[tuple
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
+@observe_duration("gundi")
 async def send_observations_to_gundi(observations: List[dict], **kwargs) -> dict:
     """
     Send Observations to Gundi using the REST API v2
@@ -100,6 +125,7 @@ async def send_observations_to_gundi(observations: List[dict], **kwargs) -> dict
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
+@observe_duration("gundi")
 async def send_messages_to_gundi(messages: List[dict], **kwargs) -> dict:
     """
     Send Messages to Gundi using the REST API v2
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import stamina
+import redis.asyncio as redis
+from app import settings
+from .metrics import observe_call, observe_duration
+
+
+LEASE_RUNNING = "running"
+LEASE_COMPLETED = "completed"
+
+
+def get_command_fingerprint(
+        integration_id: str, action_id: str, config_overrides: dict = None, command_id: str = None
+) -> str:
+    """
+    Returns a stable id for a command, so redeliveries of the same command can be recognized.
+    :param command_id: id of the message carrying the command (e.g. the PubSub messageId). Commands with the same
+        content (e.g. two scheduled pulls) are different commands, only redeliveries share the message id.
+    """
+    command = {
+        "integration_id": str(integration_id),
+        "action_id": action_id,
+        "config_overrides": config_overrides or {},
+        "command_id": command_id,
+    }
+    return hashlib.sha256(json.dumps(command, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class CommandLeaseManager:
+    """
+    Keeps track of commands being executed or recently completed, using Redis keys set with NX.
+    Only the first delivery of a command acquires the lease, duplicates can be acknowledged without doing any work.
+    """
+
+    def __init__(self, **kwargs):
+        host = kwargs.get("host", settings.REDIS_HOST)
+        port = kwargs.get("port", settings.REDIS_PORT)
+        db = kwargs.get("db", settings.REDIS_STATE_DB)
+        self.db_client = redis.Redis(host=host, port=port, db=db)
+
+    def _get_lease_key(self, fingerprint: str) -> str:
+        return f"command_lease.{fingerprint}"
+
+    async def acquire(self, fingerprint: str, ttl: int = None) -> bool:
+        """
+        Tries to acquire the lease for a command. Returns False if the command is running or completed recently.
+        :param ttl: seconds after which the lease expires, in case the holder dies before releasing it.
+            The holder renews it while running, see renew()
+        """
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "acquire"):
+                acquired = await self.db_client.set(
+                    self._get_lease_key(fingerprint),
+                    LEASE_RUNNING,
+                    nx=True,
+                    ex=ttl or settings.COMMAND_LEASE_TTL
+                )
+        return bool(acquired)
+
+    @observe_duration("redis")
+    async def renew(self, fingerprint: str, ttl: int = None) -> bool:
+        """
+        Extends the lease of a running command. Returns False if it isn't held anymore.
+        Not retried, it's renewed again before it expires.
+        """
+        renewed = await self.db_client.set(
+            self._get_lease_key(fingerprint),
+            LEASE_RUNNING,
+            xx=True,
+            ex=ttl or settings.COMMAND_LEASE_TTL
+        )
+        return bool(renewed)
+
+    async def complete(self, fingerprint: str, ttl: int = None):
+        """
+        Marks the command as completed. Duplicates arriving within the ttl (seconds) are still suppressed.
+        """
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "complete"):
+                await self.db_client.set(
+                    self._get_lease_key(fingerprint),
+                    LEASE_COMPLETED,
+                    ex=ttl or settings.COMMAND_DEDUPLICATION_WINDOW
+                )
+
+    async def release(self, fingerprint: str):
+        """
+        Releases the lease so the command can be executed again (e.g. when it failed and will be redelivered).
+        """
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "release"):
+                await self.db_client.delete(self._get_lease_key(fingerprint))
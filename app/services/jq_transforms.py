@@ -0,0 +1,78 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+import pyjq
+from pydantic import BaseModel
+
+from app import settings
+from .metrics import JQ_FILTER_DURATION
+
+
+def get_filter_id(jq_filter: str) -> str:
+    """
+    Short id of a jq filter, to report metrics by filter without using the whole text as label.
+    """
+    return hashlib.sha256(jq_filter.encode("utf-8")).hexdigest()[:12]
+
+
+class JQFilterCache:
+    """
+    LRU cache of compiled jq programs, keyed by the filter text.
+    Compiling a filter takes milliseconds, while running it takes microseconds, so programs are reused across requests.
+    """
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._programs = OrderedDict()
+
+    def __len__(self):
+        return len(self._programs)
+
+    def get_program(self, jq_filter: str):
+        """
+        Returns the compiled program. Raises ValueError if the filter is invalid (errors aren't cached).
+        """
+        if (program := self._programs.get(jq_filter)) is not None:
+            self.hits += 1
+            self._programs.move_to_end(jq_filter)
+            return program
+        self.misses += 1
+        program = pyjq.compile(jq_filter)
+        self._programs[jq_filter] = program
+        while len(self._programs) > self.max_size:
+            self._programs.popitem(last=False)
+        return program
+
+    def clear(self):
+        self._programs.clear()
+
+
+jq_filters = JQFilterCache(max_size=settings.JQ_FILTERS_CACHE_SIZE)
+
+
+def _to_json_data(data):
+    if isinstance(data, BaseModel):
+        return data.dict()
+    if isinstance(data, list):
+        return [_to_json_data(item) for item in data]
+    return data
+
+
+def jq_transform(data, jq_filter: str, per_item: bool = False):
+    """
+    Transforms JSON data (or pydantic models) with a jq filter, compiled once and cached.
+    :param data: a JSON object, or a list payload
+    :param jq_filter: jq filter text, e.g. from JQTransformConfig.jq_filter
+    :param per_item: apply the filter to each item of a list payload instead of to the whole list.
+        Items are transformed in one run of the program, not one run per item.
+    :return: the first output of the filter, or None if there's no output. A list of outputs with per_item=True.
+    """
+    program_text = f"[.[] | ({jq_filter})]" if per_item else jq_filter
+    program = jq_filters.get_program(program_text)
+    start_time = time.perf_counter()
+    result = program.first(_to_json_data(data))
+    JQ_FILTER_DURATION.labels(filter_id=get_filter_id(jq_filter)).observe(time.perf_counter() - start_time)
+    return result
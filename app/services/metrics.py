@@ -0,0 +1,102 @@
+import time
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# Buckets in seconds, from fast Redis calls to long running actions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+ACTION_DURATION = Histogram(
+    "action_execution_seconds",
+    "Time spent executing action handlers",
+    ["action_id", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+ACTION_EXECUTIONS = Counter(
+    "action_executions_total",
+    "Actions received, by outcome (success, error, timeout, invalid, rejected, duplicate)",
+    ["action_id", "outcome"],
+)
+ACTIONS_RUNNING = Gauge("actions_running", "Actions being executed in this process")
+ACTIONS_QUEUED = Gauge("actions_queued", "Actions waiting for a free slot in this process")
+WEBHOOKS_QUEUED = Gauge("webhooks_queued", "Webhook requests waiting to be processed in this process")
+WEBHOOKS_REJECTED = Counter("webhooks_rejected_total", "Webhook requests rejected because the queue was full")
+WEBHOOK_QUEUE_WAIT = Histogram(
+    "webhook_queue_wait_seconds",
+    "Time webhook requests spend in the queue before being processed",
+    buckets=LATENCY_BUCKETS,
+)
+WARMUP_DURATION = Gauge("warmup_duration_seconds", "Time spent warming up connections and caches on startup")
+WARMUP_PRELOADED_INTEGRATIONS = Gauge(
+    "warmup_preloaded_integrations", "Integrations preloaded in the local cache on startup"
+)
+JQ_FILTER_DURATION = Histogram(
+    "jq_filter_seconds",
+    "Time spent running jq filters over webhook data, by filter (a hash of the filter text)",
+    ["filter_id"],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+)
+UPSTREAM_DURATION = Histogram(
+    "upstream_call_seconds",
+    "Time spent in calls to other services (Vectronic, Gundi, PubSub, Redis)",
+    ["service", "operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def record_action(action_id: str, outcome: str, duration: float = None):
+    ACTION_EXECUTIONS.labels(action_id=action_id, outcome=outcome).inc()
+    if duration is not None:
+        ACTION_DURATION.labels(action_id=action_id, outcome=outcome).observe(duration)
+
+
+@lru_cache(maxsize=None)
+def _get_duration_observers(service: str, operation: str):
+    # Bound once per operation, so recording doesn't need to look up the labels on every call
+    return (
+        UPSTREAM_DURATION.labels(service=service, operation=operation, outcome="success"),
+        UPSTREAM_DURATION.labels(service=service, operation=operation, outcome="error"),
+    )
+
+
+def observe_duration(service: str, operation: str = None):
+    """
+    Decorator to record the duration and outcome of async calls to other services.
+    :param service: e.g. "vectronic", "gundi", "pubsub", "redis"
+    :param operation: defaults to the function name
+    """
+    def decorator(func):
+        on_success, on_error = _get_duration_observers(service, operation or func.__name__)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                on_error.observe(time.perf_counter() - start_time)
+                raise
+            on_success.observe(time.perf_counter() - start_time)
+            return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def observe_call(service: str, operation: str):
+    """
+    Like observe_duration(), for a call within a function. Use it to time each attempt, not the retries around them:
+        for attempt in stamina.retry_context(...):
+            with attempt, observe_call("redis", "get_state"):
+                ...
+    """
+    on_success, on_error = _get_duration_observers(service, operation)
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        on_error.observe(time.perf_counter() - start_time)
+        raise
+    on_success.observe(time.perf_counter() - start_time)
@@ -0,0 +1,143 @@
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+from app import settings
+
+
+logger = logging.getLogger(__name__)
+TOP_FUNCTIONS = 15
+# Only one profiler can be enabled at a time in the process
+_active_profiler = None
+_current_profiler: ContextVar[Optional["ActionProfiler"]] = ContextVar("current_profiler", default=None)
+
+
+def should_profile(integration_id: str, action_id: str, requested: bool = False) -> bool:
+    return (
+        requested
+        or action_id in settings.PROFILE_ACTIONS
+        or str(integration_id) in settings.PROFILE_INTEGRATIONS
+    )
+
+
+def get_current_profiler() -> Optional["ActionProfiler"]:
+    """
+    Returns the profiler of the action being executed in this context, if it's being profiled.
+    """
+    return _current_profiler.get()
+
+
+class ActionProfiler:
+    """
+    Captures a cProfile profile and the memory peak (tracemalloc) of an action execution,
+    saves the profile in the output directory and builds a summary with the slowest functions.
+    The profile covers everything running in the event loop meanwhile, including other actions.
+    Use it to find out where a slow action spends its time, e.g. with: python -m pstats <profile_path>
+    """
+
+    def __init__(self, integration_id: str, action_id: str, output_dir: str = None):
+        self.integration_id = str(integration_id)
+        self.action_id = action_id
+        self.output_dir = output_dir or settings.PROFILES_DIR
+        self.summary = None
+        import cProfile  # Only loaded when an action is profiled
+        self._profile = cProfile.Profile()
+        self._started_at = None
+        self._started_tracemalloc = False
+
+    def start(self) -> bool:
+        """
+        Starts profiling. Returns False if another action is being profiled already.
+        """
+        global _active_profiler
+        if _active_profiler is not None:
+            logger.warning(f"Another action is being profiled. Action '{self.action_id}' won't be profiled.")
+            return False
+        _active_profiler = self
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._started_at = time.perf_counter()
+        self._profile.enable()
+        return True
+
+    def stop(self) -> Optional[dict]:
+        """
+        Stops profiling, saves the profile and returns the summary. Calling it again returns the same summary.
+        """
+        global _active_profiler
+        if _active_profiler is not self:
+            return self.summary
+        self._profile.disable()
+        wall_time = time.perf_counter() - self._started_at
+        _, memory_peak = tracemalloc.get_traced_memory()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        _active_profiler = None
+        self.summary = {
+            "profile_path": self._save(),
+            "wall_time_seconds": round(wall_time, 3),
+            "memory_peak_bytes": memory_peak,
+            **self._get_stats_summary(),
+        }
+        return self.summary
+
+    def _save(self) -> Optional[str]:
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        path = os.path.join(self.output_dir, f"{self.action_id}-{self.integration_id}-{timestamp}.prof")
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._profile.dump_stats(path)
+        except OSError as e:
+            logger.warning(f"Error saving profile of action '{self.action_id}' in {path}: {e}")
+            return None
+        return path
+
+    def _get_stats_summary(self) -> dict:
+        import pstats
+        stats = pstats.Stats(self._profile)
+        # stats.stats maps (file, line, function) to (primitive calls, total calls, own time, cumulative time, callers)
+        slowest = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        return {
+            "total_calls": stats.total_calls,
+            "cpu_time_seconds": round(stats.total_tt, 3),
+            "top_functions": [
+                {
+                    "function": f"{filename}:{line}({function})",
+                    "calls": calls,
+                    "own_seconds": round(own_time, 4),
+                    "cumulative_seconds": round(cumulative_time, 4),
+                }
+                for (filename, line, function), (_, calls, own_time, cumulative_time, _) in slowest
+            ],
+        }
+
+
+@contextmanager
+def profile_action(integration_id: str, action_id: str, requested: bool = False):
+    """
+    Profiles the code within the context if profiling is enabled for the action or the integration,
+    in the settings (PROFILE_ACTIONS, PROFILE_INTEGRATIONS) or by the caller. Yields the profiler or None.
+    """
+    profiler = None
+    if should_profile(integration_id, action_id, requested):
+        profiler = ActionProfiler(integration_id=integration_id, action_id=action_id)
+        if not profiler.start():
+            profiler = None
+    # Always set, so actions triggered from this one don't take this profiler
+    token = _current_profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _current_profiler.reset(token)
+        if profiler and (summary := profiler.stop()):
+            logger.info(
+                f"Action '{action_id}' for integration '{integration_id}' profiled in {summary['wall_time_seconds']}s. "
+                f"Profile: {summary['profile_path']}"
+            )
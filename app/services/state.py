@@ -1,8 +1,30 @@
 import json
+from datetime import datetime, timedelta, timezone
+
 import stamina
 import httpx
 import redis.asyncio as redis
 from app import settings
+from .metrics import observe_call
+from .tracing import traced
+
+
+# Writes the state only if the caller still holds the lease (fencing token)
+SET_STATE_IF_LEASED_SCRIPT = """
+if redis.call('GET', KEYS[2]) == ARGV[2] then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Deletes the lease only if it's still held by the caller
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
 
 
 class IntegrationStateManager:
@@ -15,26 +37,132 @@ class IntegrationStateManager:
 
     async def get_state(self, integration_id: str, action_id: str, source_id: str = "no-source") -> dict:
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
-            with attempt:
+            with attempt, observe_call("redis", "get_state"):
                 json_value = await self.db_client.get(f"integration_state.{integration_id}.{action_id}.{source_id}")
         value = json.loads(json_value) if json_value else {}
         return value
 
-    async def set_state(self, integration_id: str, action_id: str, state: dict, source_id: str = "no-source"):
+    @traced("redis.set_state")
+    async def set_state(
+            self, integration_id: str, action_id: str, state: dict, source_id: str = "no-source", lease_token: int = None
+    ) -> bool:
+        """
+        Saves the state. If a lease_token is given, the state is saved only if that lease is still held.
+        Returns False if the state wasn't saved because the lease was lost.
+        """
+        key = f"integration_state.{integration_id}.{action_id}.{source_id}"
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
-            with attempt:
-                await self.db_client.set(
-                    f"integration_state.{integration_id}.{action_id}.{source_id}",
-                    json.dumps(state, default=str)
+            with attempt, observe_call("redis", "set_state"):
+                if lease_token is None:
+                    await self.db_client.set(key, json.dumps(state, default=str))
+                    return True
+                saved = await self.db_client.eval(
+                    SET_STATE_IF_LEASED_SCRIPT,
+                    2,
+                    key,
+                    self._get_lease_key(integration_id, action_id, source_id),
+                    json.dumps(state, default=str),
+                    str(lease_token)
                 )
+        return bool(saved)
 
     async def delete_state(self, integration_id: str, action_id: str, source_id: str = "no-source"):
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
-            with attempt:
+            with attempt, observe_call("redis", "delete_state"):
                 await self.db_client.delete(
                     f"integration_state.{integration_id}.{action_id}.{source_id}"
                 )
 
+    def _get_lease_key(self, integration_id: str, action_id: str, source_id: str) -> str:
+        return f"integration_lease.{integration_id}.{action_id}.{source_id}"
+
+    @traced("redis.acquire_lease")
+    async def acquire_lease(self, integration_id: str, action_id: str, source_id: str = "no-source", ttl: int = 60):
+        """
+        Acquires an exclusive lease to process a source, so concurrent executions don't overlap.
+        :param ttl: seconds after which the lease expires, in case the holder dies before releasing it
+        :return: A fencing token to be used in set_state() and release_lease(), or None if the lease is taken
+        """
+        lease_key = self._get_lease_key(integration_id, action_id, source_id)
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "acquire_lease"):
+                # Tokens always increase, so writes from an expired lease can be told apart
+                token = await self.db_client.incr(f"{lease_key}.token")
+                acquired = await self.db_client.set(lease_key, str(token), nx=True, ex=ttl)
+        return token if acquired else None
+
+    @traced("redis.release_lease")
+    async def release_lease(self, integration_id: str, action_id: str, lease_token: int, source_id: str = "no-source"):
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "release_lease"):
+                await self.db_client.eval(
+                    RELEASE_LEASE_SCRIPT,
+                    1,
+                    self._get_lease_key(integration_id, action_id, source_id),
+                    str(lease_token)
+                )
+
+    def _get_failures_key(self, integration_id: str, action_id: str) -> str:
+        return f"integration_failures.{integration_id}.{action_id}"
+
+    async def get_failures(self, integration_id: str, action_id: str) -> dict:
+        """
+        Returns the failure records of all the sources that are backing off (quarantined), keyed by source id.
+        """
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "get_failures"):
+                values = await self.db_client.hgetall(self._get_failures_key(integration_id, action_id))
+        return {
+            (source_id.decode() if isinstance(source_id, bytes) else source_id): json.loads(value)
+            for source_id, value in values.items()
+        }
+
+    async def get_failure(self, integration_id: str, action_id: str, source_id: str) -> dict:
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "get_failure"):
+                json_value = await self.db_client.hget(self._get_failures_key(integration_id, action_id), source_id)
+        return json.loads(json_value) if json_value else {}
+
+    async def record_failure(
+            self, integration_id: str, action_id: str, source_id: str, reason: str, fingerprint: str = None,
+            backoff_initial: float = 60.0, backoff_max: float = 86400.0
+    ) -> dict:
+        """
+        Records a failure for a source and sets when it can be retried, backing off exponentially on consecutive failures.
+        :param fingerprint: identifies the source configuration. The count starts over if the configuration changed.
+        :param backoff_initial: seconds to wait after the first failure
+        :param backoff_max: upper bound for the seconds to wait between retries
+        :return: The failure record
+        """
+        failure = await self.get_failure(integration_id=integration_id, action_id=action_id, source_id=source_id)
+        if failure.get("fingerprint") != fingerprint:
+            failure = {}
+        failure_count = failure.get("failure_count", 0) + 1
+        backoff = min(backoff_initial * 2 ** min(failure_count - 1, 32), backoff_max)
+        now = datetime.now(timezone.utc)
+        failure = {
+            "source_id": source_id,
+            "reason": reason,
+            "fingerprint": fingerprint,
+            "failure_count": failure_count,
+            "first_failure_at": failure.get("first_failure_at", now.isoformat()),
+            "last_failure_at": now.isoformat(),
+            "retry_at": (now + timedelta(seconds=backoff)).isoformat(),
+        }
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "record_failure"):
+                await self.db_client.hset(
+                    self._get_failures_key(integration_id, action_id),
+                    source_id,
+                    json.dumps(failure, default=str)
+                )
+        return failure
+
+    async def clear_failure(self, integration_id: str, action_id: str, source_id: str):
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt, observe_call("redis", "clear_failure"):
+                await self.db_client.hdel(self._get_failures_key(integration_id, action_id), source_id)
+
     def __str__(self):
         return f"IntegrationStateManager(host={self.db_client.host}, port={self.db_client.port}, db={self.db_client.db})"
 
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import json
 
@@ -11,7 +12,10 @@ from gundi_core.events.transformers import ObservationTransformedER
 from app import settings
 from app.conftest import MockSubActionConfiguration, MockPushActionConfiguration
 from app.main import app
+from app.services.action_runner import execute_action
+from app.services.concurrency import ActionConcurrencyLimiter
 from app.services.action_scheduler import trigger_action
+from app.services.tracing import tracer
 
 api_client = TestClient(app)
 
@@ -19,11 +23,12 @@ api_client = TestClient(app)
 @pytest.mark.asyncio
 async def test_execute_pull_action_from_pubsub(
         mocker, mock_gundi_client_v2, mock_publish_event, mock_action_handlers, mock_config_manager,
-        pubsub_message_request_headers, run_pull_action_pubsub_payload
+        mock_command_lease_manager, pubsub_message_request_headers, run_pull_action_pubsub_payload
 ):
     mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
     mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
     mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.command_lease_manager", mock_command_lease_manager)
     mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
     mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
 
@@ -149,11 +154,12 @@ async def test_execute_action_from_api_with_config_overrides(
 @pytest.mark.asyncio
 async def test_execute_action_from_pubsub_with_config_overrides(
         mocker, mock_gundi_client_v2, mock_publish_event, mock_action_handlers, mock_config_manager,
-        pubsub_message_request_headers, run_pull_action_pubsub_payload_with_config_overrides
+        mock_command_lease_manager, pubsub_message_request_headers, run_pull_action_pubsub_payload_with_config_overrides
 ):
     mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
     mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
     mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.command_lease_manager", mock_command_lease_manager)
     mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
     mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
 
@@ -327,3 +333,269 @@ async def test_execute_action_with_handler_error(
     assert event.payload.server_response_status == expected_error.response.status_code
     assert event.payload.server_response_body == str(expected_error.response.text)
 
+
+
+@pytest.mark.asyncio
+async def test_execute_action_from_pubsub_acquires_and_completes_lease(
+        mocker, mock_gundi_client_v2, mock_publish_event, mock_action_handlers, mock_config_manager,
+        mock_command_lease_manager, pubsub_message_request_headers, run_pull_action_pubsub_payload
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.command_lease_manager", mock_command_lease_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+
+    response = api_client.post(
+        "/",
+        headers=pubsub_message_request_headers,
+        json=run_pull_action_pubsub_payload,
+    )
+
+    assert response.status_code == 200
+    assert mock_command_lease_manager.acquire.call_count == 1
+    fingerprint = mock_command_lease_manager.acquire.call_args.args[0]
+    mock_command_lease_manager.complete.assert_called_once_with(fingerprint)
+    assert not mock_command_lease_manager.release.called
+
+
+@pytest.mark.asyncio
+async def test_execute_action_from_pubsub_ignores_duplicated_command(
+        mocker, mock_gundi_client_v2, mock_publish_event, mock_action_handlers, mock_config_manager,
+        mock_command_lease_manager_with_duplicate, pubsub_message_request_headers, run_pull_action_pubsub_payload
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.command_lease_manager", mock_command_lease_manager_with_duplicate)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+
+    response = api_client.post(
+        "/",
+        headers=pubsub_message_request_headers,
+        json=run_pull_action_pubsub_payload,
+    )
+
+    # The duplicate is acknowledged without running the action
+    assert response.status_code == 200
+    assert not mock_config_manager.get_integration_details.called
+    mock_action_handler, _, _ = mock_action_handlers["pull_observations"]
+    assert not mock_action_handler.called
+
+
+@pytest.mark.parametrize(
+    "mock_action_handlers_with_request_errors",
+    ["internal_error"],
+    indirect=["mock_action_handlers_with_request_errors"]
+)
+@pytest.mark.asyncio
+async def test_execute_action_releases_lease_on_error(
+        mocker, integration_v2, mock_config_manager, mock_publish_event,
+        mock_action_handlers_with_request_errors, mock_command_lease_manager
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers_with_request_errors)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.command_lease_manager", mock_command_lease_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+
+    response = await execute_action(
+        integration_id=str(integration_v2.id),
+        action_id="pull_observations",
+        deduplicate=True,
+        command_id="10298788169291041"
+    )
+
+    assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    fingerprint = mock_command_lease_manager.acquire.call_args.args[0]
+    mock_command_lease_manager.release.assert_called_once_with(fingerprint)
+    assert not mock_command_lease_manager.complete.called
+
+
+@pytest.mark.asyncio
+async def test_execute_action_from_pubsub_rejected_when_saturated(
+        mocker, mock_publish_event, mock_action_handlers, mock_config_manager,
+        pubsub_message_request_headers, run_pull_action_pubsub_payload
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch(
+        "app.services.action_runner.action_limiter",
+        ActionConcurrencyLimiter(max_concurrency=0, max_queue_size=0)
+    )
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+
+    response = api_client.post(
+        "/",
+        headers=pubsub_message_request_headers,
+        json=run_pull_action_pubsub_payload,
+    )
+
+    # An error status makes PubSub redeliver the command later
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    mock_action_handler, _, _ = mock_action_handlers["pull_observations"]
+    assert not mock_action_handler.called
+
+
+@pytest.mark.asyncio
+async def test_execute_action_in_background_from_api_rejected_when_saturated(
+        mocker, integration_v2, mock_publish_event, mock_action_handlers, mock_config_manager,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch(
+        "app.services.action_runner.action_limiter",
+        ActionConcurrencyLimiter(max_concurrency=0, max_queue_size=0)
+    )
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+
+    response = api_client.post(
+        "/v1/actions/execute/",
+        json={
+            "integration_id": str(integration_v2.id),
+            "action_id": "pull_observations",
+            "run_in_background": True
+        }
+    )
+
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    mock_action_handler, _, _ = mock_action_handlers["pull_observations"]
+    assert not mock_action_handler.called
+
+
+@pytest.mark.asyncio
+async def test_execute_action_records_metrics(
+        mocker, mock_gundi_client_v2, integration_v2, mock_config_manager,
+        mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+
+    api_client.post(
+        "/v1/actions/execute/",
+        json={
+            "integration_id": str(integration_v2.id),
+            "action_id": "pull_observations"
+        }
+    )
+    response = api_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'action_executions_total{action_id="pull_observations",outcome="success"}' in response.text
+    assert 'action_execution_seconds_count{action_id="pull_observations",outcome="success"}' in response.text
+    assert "actions_running 0.0" in response.text
+
+
+@pytest.mark.asyncio
+async def test_trigger_subaction_propagates_trace_context(
+        mocker, mock_publish_event, span_exporter
+):
+    settings.TRIGGER_ACTIONS_ALWAYS_SYNC = False
+    settings.INTEGRATION_COMMANDS_TOPIC = "integration-actions-topic"
+    mocker.patch("app.services.action_scheduler.publish_event", mock_publish_event)
+
+    with tracer.start_as_current_span("parent") as parent_span:
+        await trigger_action(
+            integration_id="779ff3ab-5589-4f4c-9e0a-ae8d6c9edff0",
+            action_id="pull_observations_by_date",
+        )
+
+    attributes = mock_publish_event.call_args.kwargs["attributes"]
+    trace_id = format(parent_span.get_span_context().trace_id, "032x")
+    span_id = format(parent_span.get_span_context().span_id, "016x")
+    assert attributes["traceparent"].startswith(f"00-{trace_id}-{span_id}-")
+
+
+@pytest.mark.asyncio
+async def test_execute_action_from_pubsub_continues_trace(
+        mocker, mock_gundi_client_v2, mock_config_manager, mock_publish_event, mock_action_handlers,
+        mock_command_lease_manager, pubsub_message_request_headers, run_pull_action_pubsub_payload, span_exporter
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.command_lease_manager", mock_command_lease_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    parent_span_id = "00f067aa0ba902b7"
+    run_pull_action_pubsub_payload["message"]["attributes"] = {
+        "traceparent": f"00-{trace_id}-{parent_span_id}-01"
+    }
+
+    response = api_client.post(
+        "/",
+        headers=pubsub_message_request_headers,
+        json=run_pull_action_pubsub_payload,
+    )
+
+    assert response.status_code == 200
+    spans = [s for s in span_exporter.get_finished_spans() if s.name == "execute_action pull_observations"]
+    assert len(spans) == 1
+    assert format(spans[0].context.trace_id, "032x") == trace_id
+    assert format(spans[0].parent.span_id, "016x") == parent_span_id
+    assert spans[0].parent.is_remote
+
+
+@pytest.mark.asyncio
+async def test_execute_action_records_unsupported_actions(
+        mocker, mock_gundi_client_v2, mock_publish_event, mock_action_handlers, mock_config_manager
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mock_record_action = mocker.patch("app.services.action_runner.record_action")
+
+    response = await execute_action(integration_id="779ff3ab-5589-4f4c-9e0a-ae8d6c9edff0", action_id="not_supported")
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    mock_record_action.assert_called_once_with(action_id="not_supported", outcome="invalid")
+
+
+@pytest.mark.asyncio
+async def test_execute_action_without_command_id_is_not_deduplicated(
+        mocker, integration_v2, mock_config_manager, mock_publish_event, mock_action_handlers, mock_command_lease_manager
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.command_lease_manager", mock_command_lease_manager)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+
+    await execute_action(integration_id=str(integration_v2.id), action_id="pull_observations", deduplicate=True)
+
+    assert not mock_command_lease_manager.acquire.called
+    mock_action_handler, _, _ = mock_action_handlers["pull_observations"]
+    assert mock_action_handler.called
+
+
+@pytest.mark.asyncio
+async def test_execute_action_renews_the_command_lease_while_running(
+        mocker, integration_v2, mock_config_manager, mock_publish_event, mock_action_handlers, mock_command_lease_manager
+):
+    async def slow_action(integration, action_config):
+        await asyncio.sleep(0.05)
+        return {"observations_extracted": 0}
+
+    _, config_model, data_model = mock_action_handlers["pull_observations"]
+    mocker.patch(
+        "app.services.action_runner.action_handlers", {"pull_observations": (slow_action, config_model, data_model)}
+    )
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.command_lease_manager", mock_command_lease_manager)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.settings.COMMAND_LEASE_TTL", 0.03)
+
+    await execute_action(
+        integration_id=str(integration_v2.id), action_id="pull_observations", deduplicate=True,
+        command_id="10298788169291041"
+    )
+
+    fingerprint = mock_command_lease_manager.acquire.call_args.args[0]
+    mock_command_lease_manager.renew.assert_called_with(fingerprint)
+    mock_command_lease_manager.complete.assert_called_once_with(fingerprint)
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from app.services.concurrency import ActionConcurrencyLimiter
+from app.services.core import ActionPriorityEnum
+from app.services.errors import ActionConcurrencyLimitExceeded
+
+
+@pytest.mark.asyncio
+async def test_limiter_runs_actions_up_to_max_concurrency():
+    limiter = ActionConcurrencyLimiter(max_concurrency=2, max_queue_size=10)
+    release = asyncio.Event()
+
+    async def run_action():
+        async with limiter.admit("fetch_collar_observations"):
+            await release.wait()
+
+    tasks = [asyncio.create_task(run_action()) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    assert limiter.stats()["running"] == 2
+    assert limiter.stats()["queued"] == 1
+    release.set()
+    await asyncio.gather(*tasks)
+    assert limiter.stats()["running"] == 0
+    assert limiter.stats()["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_applies_action_limits():
+    limiter = ActionConcurrencyLimiter(max_concurrency=10, max_queue_size=10, action_limits={"pull_observations": 1})
+    release = asyncio.Event()
+
+    async def run_action(action_id):
+        async with limiter.admit(action_id):
+            await release.wait()
+
+    tasks = [
+        asyncio.create_task(run_action("pull_observations")),
+        asyncio.create_task(run_action("pull_observations")),
+        asyncio.create_task(run_action("fetch_collar_observations")),
+    ]
+    await asyncio.sleep(0)
+
+    stats = limiter.stats()
+    assert stats["running_by_action"] == {"pull_observations": 1, "fetch_collar_observations": 1}
+    assert stats["queued_by_action"] == {"pull_observations": 1}
+    release.set()
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.asyncio
+async def test_limiter_rejects_actions_when_queue_is_full():
+    limiter = ActionConcurrencyLimiter(max_concurrency=1, max_queue_size=1)
+    running = limiter.admit("fetch_collar_observations")
+    await running.__aenter__()
+    limiter.admit("fetch_collar_observations")  # Waits in the queue
+
+    with pytest.raises(ActionConcurrencyLimitExceeded):
+        limiter.admit("fetch_collar_observations")
+
+
+@pytest.mark.asyncio
+async def test_limiter_frees_queue_place_on_cancellation():
+    limiter = ActionConcurrencyLimiter(max_concurrency=1, max_queue_size=5)
+    running = limiter.admit("fetch_collar_observations")
+    await running.__aenter__()
+
+    async def run_action():
+        async with limiter.admit("fetch_collar_observations"):
+            pass
+
+    task = asyncio.create_task(run_action())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert limiter.stats()["queued"] == 0
+    await running.__aexit__(None, None, None)
+    assert limiter.stats()["running"] == 0
+
+
+async def _run_in_order(limiter, admissions):
+    # Runs the admissions while the only slot is taken, and returns the order in which they started
+    started = []
+    blocker = limiter.admit("blocker")
+    await blocker.__aenter__()
+
+    async def run_action(name, admission):
+        async with admission:
+            started.append(name)
+
+    tasks = [asyncio.create_task(run_action(name, admission)) for name, admission in admissions]
+    await asyncio.sleep(0)
+    await blocker.__aexit__(None, None, None)
+    await asyncio.gather(*tasks)
+    return started
+
+
+@pytest.mark.asyncio
+async def test_limiter_starts_interactive_actions_first():
+    limiter = ActionConcurrencyLimiter(max_concurrency=1, max_queue_size=10)
+
+    started = await _run_in_order(limiter, [
+        ("low", limiter.admit("pull_observations", priority=ActionPriorityEnum.LOW)),
+        ("high", limiter.admit("fetch_collar_observations", priority=ActionPriorityEnum.HIGH)),
+        ("interactive", limiter.admit("pull_observations", priority=ActionPriorityEnum.INTERACTIVE)),
+    ])
+
+    assert started[0] == "interactive"
+
+
+@pytest.mark.asyncio
+async def test_limiter_shares_slots_by_priority_weight():
+    limiter = ActionConcurrencyLimiter(max_concurrency=1, max_queue_size=20)
+    admissions = [(f"low-{i}", limiter.admit("backfill", priority=ActionPriorityEnum.LOW)) for i in range(5)]
+    admissions += [(f"high-{i}", limiter.admit("incremental", priority=ActionPriorityEnum.HIGH)) for i in range(8)]
+
+    started = await _run_in_order(limiter, admissions)
+
+    # High priority actions get most turns, but low priority ones aren't starved
+    first_turns = started[:5]
+    assert any(name.startswith("low") for name in first_turns)
+    assert sum(name.startswith("high") for name in first_turns) >= 3
+    assert len(started) == 13
@@ -1,7 +1,13 @@
+import base64
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
 import pytest
 from fastapi.testclient import TestClient
 
 from app.main import app
+from app.services.config_events_consumer import process_config_events, pull_config_events
 
 
 api_client = TestClient(app)
@@ -40,8 +46,8 @@ async def test_process_event_integration_updated_from_pubsub(
     )
 
     assert response.status_code == 200
-    assert mock_config_manager.get_integration.called
-    assert mock_config_manager.set_integration.called
+    assert mock_config_manager.update_integration.called
+    assert not mock_config_manager.set_integration.called
 
 
 @pytest.mark.asyncio
@@ -95,8 +101,8 @@ async def test_process_event_action_config_updated_from_pubsub(
     )
 
     assert response.status_code == 200
-    assert mock_config_manager.get_action_configuration.called
-    assert mock_config_manager.set_action_configuration.called
+    assert mock_config_manager.update_action_configuration.called
+    assert not mock_config_manager.set_action_configuration.called
 
 
 @pytest.mark.asyncio
@@ -116,3 +122,99 @@ async def test_process_event_action_config_deleted_from_pubsub(
     assert response.status_code == 200
     assert mock_config_manager.delete_action_configuration.called
 
+
+def _get_event(pubsub_message: dict, **payload_changes):
+    # Returns the (event_data, attributes) in a PubSub message, with changes in the payload
+    event_data = json.loads(base64.b64decode(pubsub_message["message"]["data"]))
+    event_data["payload"].update(payload_changes)
+    return event_data, pubsub_message["message"]["attributes"]
+
+
+@pytest.mark.asyncio
+async def test_process_config_events_coalesces_updates(
+        mocker, mock_config_manager, integration_updated_event_as_pubsub_message,
+        action_config_updated_event_as_pubsub_message
+):
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+    messages = [
+        _get_event(integration_updated_event_as_pubsub_message, changes={"name": "Name 1"}),
+        _get_event(action_config_updated_event_as_pubsub_message, changes={"data": {"lookback_days": 2}}),
+        _get_event(integration_updated_event_as_pubsub_message, changes={"name": "Name 2", "enabled": False}),
+        _get_event(action_config_updated_event_as_pubsub_message, changes={"data": {"lookback_days": 5}}),
+        _get_event(integration_updated_event_as_pubsub_message, changes={"name": "Name 3"}),
+    ]
+
+    results = await process_config_events(messages)
+
+    assert [r["status"] for r in results] == ["success"] * 5
+    # The changes are merged and written in one pipeline, without reading the configurations
+    assert not mock_config_manager.get_integration.called
+    assert not mock_config_manager.get_action_configuration.called
+    mock_config_manager.write_configurations.assert_called_once()
+    writes = mock_config_manager.write_configurations.call_args.kwargs
+    assert writes["integrations"] == []
+    assert list(writes["integration_changes"].values()) == [{"name": "Name 3", "enabled": False}]
+    assert [(key[1], changes) for key, changes in writes["action_config_changes"].items()] == [
+        ("pull_observations", {"data": {"lookback_days": 5}})
+    ]
+    assert not mock_config_manager.set_integration.called
+
+
+@pytest.mark.asyncio
+async def test_process_config_events_applies_the_last_event(
+        mocker, mock_config_manager, integration_created_event_as_pubsub_message,
+        integration_updated_event_as_pubsub_message, integration_deleted_event_as_pubsub_message
+):
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+    messages = [
+        _get_event(integration_created_event_as_pubsub_message),
+        _get_event(integration_updated_event_as_pubsub_message),
+        _get_event(integration_deleted_event_as_pubsub_message),
+        ({"schema_version": "v2", "payload": {}}, {"event_type": "IntegrationUpdated"}),
+    ]
+
+    results = await process_config_events(messages)
+
+    assert [r["status"] for r in results] == ["success", "success", "success", "error"]
+    assert not mock_config_manager.get_integration.called
+    writes = mock_config_manager.write_configurations.call_args.kwargs
+    assert writes["integrations"] == []
+    assert writes["deleted_integration_ids"] == ["c4517ce8-3c14-46c0-9c68-8978bdc34a1f"]
+
+
+@pytest.mark.asyncio
+async def test_process_config_events_reports_failed_writes(
+        mocker, mock_config_manager, integration_updated_event_as_pubsub_message,
+        action_config_updated_event_as_pubsub_message
+):
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+    mock_config_manager.write_configurations.side_effect = Exception("Redis error")
+    messages = [
+        _get_event(integration_updated_event_as_pubsub_message),
+        _get_event(action_config_updated_event_as_pubsub_message),
+        ({"schema_version": "v2", "payload": {}}, {"event_type": "IntegrationUpdated"}),
+    ]
+
+    results = await process_config_events(messages)
+
+    assert [r["status"] for r in results] == ["error", "error", "error"]
+
+
+@pytest.mark.asyncio
+async def test_pull_config_events(mocker, mock_config_manager, integration_updated_event_as_pubsub_message):
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+    event_data, attributes = _get_event(integration_updated_event_as_pubsub_message)
+    mock_subscriber = mocker.MagicMock()
+    mock_subscriber.pull = AsyncMock(return_value=[
+        SimpleNamespace(ack_id=f"ack-{i}", data=json.dumps(event_data).encode("utf-8"), attributes=attributes)
+        for i in range(3)
+    ])
+    mock_subscriber.acknowledge = AsyncMock()
+
+    pulled = await pull_config_events("projects/test/subscriptions/config-events", subscriber=mock_subscriber)
+
+    assert pulled == 3
+    mock_config_manager.write_configurations.assert_called_once()
+    mock_subscriber.acknowledge.assert_called_once_with(
+        "projects/test/subscriptions/config-events", ack_ids=["ack-0", "ack-1", "ack-2"]
+    )
@@ -1,7 +1,19 @@
+import asyncio
+import json
+
+import httpx
 import pytest
+from prometheus_client import REGISTRY
+import redis.asyncio as redis
 
 from gundi_core.schemas.v2 import IntegrationSummary, IntegrationActionConfiguration, Integration
-from app.services.config_manager import IntegrationConfigurationManager
+from app import settings
+from app.conftest import async_return
+from app.services.config_manager import (
+    IntegrationConfigurationManager, LocalIntegrationCache, SET_CONFIG_SCRIPT, UPDATE_CONFIG_SCRIPT, to_hash_fields,
+    run_config_changes_listener
+)
+from app.services.errors import IntegrationNotFound
 
 
 @pytest.mark.asyncio
@@ -18,7 +30,7 @@ async def test_get_integration_from_redis(
     assert integration
     assert isinstance(integration, IntegrationSummary)
     assert integration.id == integration_v2.id
-    mock_redis_with_integration_config.Redis.return_value.get.assert_called_once_with(f"integration.{integration_id}")
+    mock_redis_with_integration_config.Redis.return_value.hgetall.assert_called_once_with(f"integration.v2.{integration_id}")
     assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
 
 
@@ -36,7 +48,7 @@ async def test_get_integration_from_gundi(
     assert integration
     assert isinstance(integration, IntegrationSummary)
     assert integration.id == integration_v2.id
-    mock_redis_empty.Redis.return_value.get.assert_called_once_with(f"integration.{integration_id}")
+    mock_redis_empty.Redis.return_value.hgetall.assert_called_once_with(f"integration.v2.{integration_id}")
     mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once_with(integration_id)
 
 
@@ -48,9 +60,9 @@ async def test_set_integration(mocker, mock_redis_empty, mock_gundi_client_v2_cl
 
     await config_manager.set_integration(integration_v2)
 
-    mock_redis_empty.Redis.return_value.set.assert_called_once_with(
-        f"integration.{integration_v2.id}",
-        integration_v2.json()
+    mock_redis_empty.Redis.return_value.eval.assert_called_once_with(
+        SET_CONFIG_SCRIPT, 2, f"integration.v2.{integration_v2.id}", "configversion",
+        *to_hash_fields(json.loads(integration_v2.json()))
     )
 
 
@@ -69,7 +81,7 @@ async def test_get_action_configuration_from_redis(
 
     assert action_config
     assert isinstance(action_config, IntegrationActionConfiguration)
-    mock_redis_with_action_config.Redis.return_value.get.assert_called_once_with(f"integrationconfig.{integration_id}.{action_id}")
+    mock_redis_with_action_config.Redis.return_value.hgetall.assert_called_once_with(f"integrationconfig.v2.{integration_id}.{action_id}")
 
 
 @pytest.mark.asyncio
@@ -87,7 +99,7 @@ async def test_get_action_configuration_from_gundi(
 
     assert action_config
     assert isinstance(action_config, IntegrationActionConfiguration)
-    mock_redis_empty.Redis.return_value.get.assert_called_once_with(f"integrationconfig.{integration_id}.{action_id}")
+    mock_redis_empty.Redis.return_value.hgetall.assert_called_once_with(f"integrationconfig.v2.{integration_id}.{action_id}")
     mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once_with(integration_id)
 
 
@@ -109,5 +121,329 @@ async def test_get_integration_details_with_empty_redis_db(
     mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_with(integration_id)
     for config in integration_v2.configurations:
         action_id = config.action.value
-        mock_redis_empty.Redis.return_value.get.assert_any_call(f"integrationconfig.{integration_id}.{action_id}")
+        mock_redis_empty.Redis.return_value.hgetall.assert_any_call(f"integrationconfig.v2.{integration_id}.{action_id}")
+
+
+@pytest.mark.asyncio
+async def test_webhook_configuration_reloaded_from_the_portal_expires(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+
+    await config_manager.get_webhook_configuration(integration_id)
+
+    # Changes to webhook configurations may not be notified, so they're reloaded after a while
+    webhook_config = integration_v2.webhook_configuration
+    mock_redis_empty.Redis.return_value.set.assert_any_call(
+        f"integrationwebhookconfig.{integration_id}",
+        webhook_config.json() if webhook_config else "null",
+        ex=settings.WEBHOOK_CONFIG_TTL
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_is_cached_in_memory(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+
+    integration = await config_manager.get_integration_details(integration_id)
+    redis_reads = mock_redis_empty.Redis.return_value.hgetall.call_count
+    portal_reads = mock_gundi_client_v2_class.return_value.get_integration_details.call_count
+    cached_integration = await config_manager.get_integration_details(integration_id)
+
+    assert cached_integration == integration
+    assert mock_redis_empty.Redis.return_value.hgetall.call_count == redis_reads
+    assert mock_gundi_client_v2_class.return_value.get_integration_details.call_count == portal_reads
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_after_set_integration_reads_redis_again(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager(local_cache=LocalIntegrationCache())
+    integration_id = str(integration_v2.id)
+    await config_manager.get_integration_details(integration_id)
+    mock_redis_get = mock_redis_empty.Redis.return_value.hgetall
+    mock_redis_get.reset_mock()
+
+    await config_manager.set_integration(IntegrationSummary.from_integration(integration_v2))
+    await config_manager.get_integration_details(integration_id)
+
+    mock_redis_get.assert_any_call(f"integration.v2.{integration_id}")
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_not_found_is_cached(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    integration_id = str(integration_v2.id)
+    request = httpx.Request("GET", f"https://gundi-api.test/v2/integrations/{integration_id}/")
+    mock_gundi_client_v2_class.return_value.get_integration_details.side_effect = httpx.HTTPStatusError(
+        "Not Found", request=request, response=httpx.Response(404, request=request)
+    )
+    config_manager = IntegrationConfigurationManager()
+
+    for _ in range(3):
+        with pytest.raises(IntegrationNotFound):
+            await config_manager.get_integration_details(integration_id)
+
+    # Not retried, and not requested again while cached
+    assert mock_gundi_client_v2_class.return_value.get_integration_details.call_count == 1
+    mock_redis_empty.Redis.return_value.set.assert_any_call(
+        f"integrationnotfound.{integration_id}", 1, ex=300
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_integration_not_found_in_redis_skips_the_portal(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    mock_redis_empty.Redis.return_value.exists.return_value = async_return(1)
+    config_manager = IntegrationConfigurationManager()
+
+    with pytest.raises(IntegrationNotFound):
+        await config_manager.get_integration(str(integration_v2.id))
+
+    assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
+
+
+def test_local_integration_cache_evicts_least_recently_used():
+    cache = LocalIntegrationCache(max_size=2, ttl=60)
+    cache.set("a", "integration-a")
+    cache.set("b", "integration-b")
+    cache.get("a")
+    cache.set("c", "integration-c")
+
+    assert cache.get("a") == (True, "integration-a")
+    assert cache.get("b") == (False, None)
+    assert cache.get("c") == (True, "integration-c")
+
+
+def test_local_integration_cache_entries_expire(mocker):
+    mock_time = mocker.patch("app.services.config_manager.time")
+    mock_time.monotonic.return_value = 100.0
+    cache = LocalIntegrationCache(max_size=10, ttl=30)
+    cache.set("a", "integration-a")
+    cache.set("unknown", None, ttl=300)
+
+    mock_time.monotonic.return_value = 200.0
+
+    assert cache.get("a") == (False, None)
+    assert cache.get("unknown") == (True, None)
+
+
+@pytest.mark.asyncio
+async def test_write_configurations_in_one_pipeline(
+        mocker, mock_redis_empty, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+    action_config = integration_v2.configurations[0]
+
+    await config_manager.write_configurations(
+        integrations=[IntegrationSummary.from_integration(integration_v2)],
+        action_configs=[(integration_id, action_config.action.value, action_config)],
+        deleted_action_configs=[(integration_id, "pull_events")],
+    )
+
+    mock_redis_client = mock_redis_empty.Redis.return_value
+    mock_redis_client.pipeline.assert_called_once_with(transaction=False)
+    assert [c.args[:4] for c in mock_redis_client.eval.call_args_list][0] == (
+        SET_CONFIG_SCRIPT, 2, f"integration.v2.{integration_id}", "configversion"
+    )
+    mock_redis_client.eval.assert_any_call(
+        SET_CONFIG_SCRIPT, 2, f"integrationconfig.v2.{integration_id}.{action_config.action.value}", "configversion",
+        *to_hash_fields(json.loads(action_config.json()))
+    )
+    mock_redis_client.delete.assert_any_call(f"integrationconfig.v2.{integration_id}.pull_events")
+    mock_redis_client.publish.assert_called_once_with("integration-config-changes", integration_id)
+    assert mock_redis_client.execute.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_update_integration_applies_known_fields_atomically(mocker, mock_redis_empty, integration_v2):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+
+    version = await config_manager.update_integration(
+        integration_id=integration_id,
+        changes={"name": "Renamed", "enabled": False, "unknown_field": 1}
+    )
+
+    assert version == 1
+    mock_redis_empty.Redis.return_value.eval.assert_called_once_with(
+        UPDATE_CONFIG_SCRIPT, 2, f"integration.v2.{integration_id}", "configversion",
+        "name", '"Renamed"', "enabled", "false"
+    )
+    assert not mock_redis_empty.Redis.return_value.hgetall.called
+
+
+@pytest.mark.asyncio
+async def test_get_integration_with_version(
+        mocker, mock_redis_with_integration_config, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_with_integration_config)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+
+    integration, version = await config_manager.get_integration_with_version(str(integration_v2.id))
+
+    assert integration.id == integration_v2.id
+    assert version == 1
+
+
+@pytest.mark.asyncio
+async def test_configurations_are_saved_apart_from_previous_versions(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    mock_redis_client = mock_redis_empty.Redis.return_value
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+
+    await config_manager.get_integration(integration_id)
+
+    # Previous versions save strings in integration.{id} and integrationconfig.{id}.{action}, and can't read hashes
+    mock_redis_client.hgetall.assert_called_once_with(f"integration.v2.{integration_id}")
+    saved_keys = [c.args[2] for c in mock_redis_client.eval.call_args_list]
+    assert f"integration.v2.{integration_id}" in saved_keys
+    assert all(key.startswith(("integration.v2.", "integrationconfig.v2.")) for key in saved_keys)
+    assert not mock_redis_client.delete.called
+
+
+@pytest.mark.asyncio
+async def test_get_config_version(mocker, mock_redis_empty, integration_v2):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mock_redis_empty.Redis.return_value.hget.return_value = async_return(b"7")
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+
+    version = await config_manager.get_config_version(integration_id, action_id="pull_observations")
+
+    assert version == 7
+    mock_redis_empty.Redis.return_value.hget.assert_called_once_with(
+        f"integrationconfig.v2.{integration_id}.pull_observations", "_version"
+    )
+
+
+def test_local_integration_cache_discards_entries_loaded_before_an_invalidation(integration_v2):
+    cache = LocalIntegrationCache(max_size=10, ttl=30.0)
+    generation = cache.generation
+
+    cache.invalidate("other-integration")  # A change notified while the integration was loading
+    cache.set(str(integration_v2.id), integration_v2, generation=generation)
+
+    assert cache.get(str(integration_v2.id)) == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_set_integration_notifies_other_instances(mocker, mock_redis_empty, integration_v2):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    config_manager = IntegrationConfigurationManager()
+    config_manager.local_cache.set(str(integration_v2.id), integration_v2)
+
+    await config_manager.set_integration(integration_v2)
+
+    mock_redis_empty.Redis.return_value.publish.assert_called_once_with(
+        "integration-config-changes", str(integration_v2.id)
+    )
+    assert config_manager.local_cache.get(str(integration_v2.id)) == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_config_changes_listener_invalidates_the_local_cache(mocker, integration_v2):
+    integration_id = str(integration_v2.id)
+    cache = LocalIntegrationCache(max_size=10, ttl=30.0)
+    notified = asyncio.Event()
+
+    async def listen():
+        yield {"type": "subscribe", "data": 1}
+        cache.set(integration_id, integration_v2)  # Loaded after subscribing
+        yield {"type": "message", "data": integration_id.encode()}
+        notified.set()
+        await asyncio.Event().wait()  # Until cancelled
+
+    mock_pubsub = mocker.MagicMock()
+    mock_pubsub.__aenter__.return_value = mock_pubsub
+    mock_pubsub.__aexit__.return_value = None
+    mock_pubsub.subscribe.return_value = async_return(None)
+    mock_pubsub.listen = listen
+    mock_client = mocker.MagicMock()
+    mock_client.pubsub.return_value = mock_pubsub
+
+    listener = asyncio.create_task(run_config_changes_listener(local_cache=cache, client=mock_client))
+    await asyncio.wait_for(notified.wait(), timeout=1)
+
+    mock_pubsub.subscribe.assert_called_once_with("integration-config-changes")
+    assert cache.ttl == 600.0  # Kept for longer while notifications are received
+    assert cache.get(integration_id) == (False, None)
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
+    assert cache.ttl == 30.0
+
+
+@pytest.mark.asyncio
+async def test_record_integration_activity_keeps_the_most_recent(mocker, mock_redis_empty, integration_v2):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mock_redis_client = mock_redis_empty.Redis.return_value
+    mock_redis_client.zrevrange.return_value = async_return([str(integration_v2.id).encode()])
+    config_manager = IntegrationConfigurationManager()
+
+    await config_manager.record_integration_activity(str(integration_v2.id))
+    active_integrations = await config_manager.get_active_integrations(limit=10)
+
+    assert mock_redis_client.zadd.call_args.args[0] == "activeintegrations"
+    assert list(mock_redis_client.zadd.call_args.args[1]) == [str(integration_v2.id)]
+    mock_redis_client.zremrangebyrank.assert_called_once_with("activeintegrations", 0, -1001)
+    assert active_integrations == [str(integration_v2.id)]
+
+
+@pytest.mark.asyncio
+async def test_reloads_from_the_portal_are_not_timed_as_redis_calls(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+
+    def get_count(service, operation):
+        labels = {"service": service, "operation": operation, "outcome": "success"}
+        return REGISTRY.get_sample_value("upstream_call_seconds_count", labels) or 0
+
+    redis_reads, gundi_reloads = get_count("redis", "get_config"), get_count("gundi", "get_integration_details")
+
+    await config_manager.get_integration_with_version(str(integration_v2.id))
+
+    assert get_count("redis", "get_config") == redis_reads + 1
+    assert get_count("gundi", "get_integration_details") == gundi_reloads + 1
+    assert get_count("redis", "get_integration_with_version") == 0
+
+
+@pytest.mark.asyncio
+async def test_track_integration_activity_is_throttled_and_runs_in_background(mocker, mock_redis_empty, integration_v2):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mock_redis_client = mock_redis_empty.Redis.return_value
+    mock_redis_client.execute.side_effect = Exception("Redis error")  # Logged, not raised
+    config_manager = IntegrationConfigurationManager()
+
+    for _ in range(3):
+        config_manager.track_integration_activity(str(integration_v2.id))
+    await asyncio.gather(*config_manager._background_tasks)
 
+    assert mock_redis_client.zadd.call_count == 1
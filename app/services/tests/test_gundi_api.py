@@ -1,5 +1,7 @@
 import pytest
-from app.services.gundi import send_events_to_gundi, send_observations_to_gundi, send_event_attachments_to_gundi
+from app.services.gundi import (
+    send_events_to_gundi, send_observations_to_gundi, send_event_attachments_to_gundi, get_gundi_api_key
+)
 
 
 @pytest.mark.asyncio
@@ -121,3 +123,13 @@ async def test_send_observations_to_gundi(
     assert len(response) == 2
     assert mock_gundi_sensors_client_class.called
     mock_gundi_sensors_client_class.return_value.post_observations.assert_called_once_with(data=observations)
+
+
+@pytest.mark.asyncio
+async def test_get_gundi_api_key_is_cached(mocker, mock_get_gundi_api_key, mock_api_key, integration_v2):
+    mocker.patch("app.services.gundi._get_gundi_api_key", mock_get_gundi_api_key)
+
+    for _ in range(3):
+        assert await get_gundi_api_key(str(integration_v2.id)) == mock_api_key
+
+    mock_get_gundi_api_key.assert_called_once_with(integration_id=str(integration_v2.id))
@@ -0,0 +1,66 @@
+import pytest
+
+from app import settings
+from app.conftest import async_return
+from app.services.idempotency import CommandLeaseManager, get_command_fingerprint
+
+
+def test_command_fingerprint_is_stable():
+    fingerprint = get_command_fingerprint("integration-1", "fetch_collar_observations", {"collar_id": 1, "collar_key": "K"})
+    assert fingerprint == get_command_fingerprint("integration-1", "fetch_collar_observations", {"collar_key": "K", "collar_id": 1})
+    assert fingerprint != get_command_fingerprint("integration-1", "fetch_collar_observations", {"collar_id": 2, "collar_key": "K"})
+
+
+def test_command_fingerprint_tells_apart_messages_with_the_same_command():
+    # e.g. two scheduled pulls, redeliveries keep the message id
+    first_pull = get_command_fingerprint("integration-1", "pull_observations", command_id="10298788169291041")
+    assert first_pull == get_command_fingerprint("integration-1", "pull_observations", command_id="10298788169291041")
+    assert first_pull != get_command_fingerprint("integration-1", "pull_observations", command_id="11937923011474846")
+
+
+@pytest.mark.asyncio
+async def test_acquire_command_lease(mocker, mock_redis):
+    mocker.patch("app.services.idempotency.redis", mock_redis)
+    mock_redis.Redis.return_value.set.return_value = async_return(True)
+    lease_manager = CommandLeaseManager()
+
+    acquired = await lease_manager.acquire("abc123")
+
+    assert acquired
+    mock_redis.Redis.return_value.set.assert_called_once_with(
+        "command_lease.abc123", "running", nx=True, ex=settings.COMMAND_LEASE_TTL
+    )
+
+
+@pytest.mark.asyncio
+async def test_renew_command_lease(mocker, mock_redis):
+    mocker.patch("app.services.idempotency.redis", mock_redis)
+    mock_redis.Redis.return_value.set.return_value = async_return(True)
+    lease_manager = CommandLeaseManager()
+
+    assert await lease_manager.renew("abc123")
+
+    mock_redis.Redis.return_value.set.assert_called_once_with(
+        "command_lease.abc123", "running", xx=True, ex=settings.COMMAND_LEASE_TTL
+    )
+
+
+@pytest.mark.asyncio
+async def test_acquire_command_lease_already_taken(mocker, mock_redis):
+    mocker.patch("app.services.idempotency.redis", mock_redis)
+    mock_redis.Redis.return_value.set.return_value = async_return(None)
+    lease_manager = CommandLeaseManager()
+
+    assert not await lease_manager.acquire("abc123")
+
+
+@pytest.mark.asyncio
+async def test_complete_command_lease(mocker, mock_redis):
+    mocker.patch("app.services.idempotency.redis", mock_redis)
+    lease_manager = CommandLeaseManager()
+
+    await lease_manager.complete("abc123")
+
+    mock_redis.Redis.return_value.set.assert_called_once_with(
+        "command_lease.abc123", "completed", ex=settings.COMMAND_DEDUPLICATION_WINDOW
+    )
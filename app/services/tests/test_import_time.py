@@ -0,0 +1,52 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+
+# Generous, to be stable in CI. See benchmarks/bench_startup.py to find out what's slow to import
+IMPORT_TIME_BUDGET_SECONDS = 3.0
+
+# Loaded on first use (or in the warmup), not on every cold start
+LAZY_MODULES = [
+    "app.actions.handlers",
+    "app.services.self_registration",
+    "opentelemetry.sdk.trace",
+    "cProfile",
+]
+
+
+def _import_app(code: str) -> str:
+    # In a new interpreter, where nothing is imported yet
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=Path(__file__).parents[3]
+    )
+    return result.stdout
+
+
+def test_import_time_is_within_budget():
+    code = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+
+    import_time = min(float(_import_app(code)) for _ in range(3))
+
+    assert import_time < IMPORT_TIME_BUDGET_SECONDS
+
+
+def test_rarely_used_modules_are_imported_lazily():
+    code = f"import json, sys; import app.main; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+
+    assert json.loads(_import_app(code)) == []
+
+
+def test_action_handlers_are_discovered_on_first_use():
+    code = (
+        "import json, sys; from app.actions import action_handlers; "
+        "before = 'app.actions.handlers' in sys.modules; actions = list(action_handlers); "
+        "print(json.dumps([before, 'app.actions.handlers' in sys.modules, actions]))"
+    )
+
+    imported_before, imported_after, actions = json.loads(_import_app(code))
+
+    assert not imported_before
+    assert imported_after
+    assert "pull_observations" in actions
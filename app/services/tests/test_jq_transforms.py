@@ -0,0 +1,94 @@
+import pytest
+from pydantic import BaseModel
+
+from app.services.jq_transforms import JQFilterCache, get_filter_id, jq_filters, jq_transform
+from app.services.metrics import JQ_FILTER_DURATION
+from app.webhooks import GenericJsonTransformConfig
+
+
+JQ_FILTER = '{source: .device_id, location: {lat: .lat, lon: .lon}}'
+
+
+class MockDeviceMessage(BaseModel):
+    device_id: str
+    lat: float
+    lon: float
+
+
+def test_jq_filter_cache_compiles_each_filter_once():
+    cache = JQFilterCache(max_size=10)
+
+    program = cache.get_program(JQ_FILTER)
+
+    assert cache.get_program(JQ_FILTER) is program
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_jq_filter_cache_evicts_least_recently_used_filters():
+    cache = JQFilterCache(max_size=2)
+    first_program = cache.get_program(".a")
+    cache.get_program(".b")
+    cache.get_program(".a")
+    cache.get_program(".c")
+
+    assert len(cache) == 2
+    assert cache.get_program(".a") is first_program
+    assert cache.misses == 3  # .b was evicted, .a was not
+
+
+def test_jq_filter_cache_raises_on_invalid_filters():
+    cache = JQFilterCache()
+
+    with pytest.raises(ValueError):
+        cache.get_program(".a |||")
+    assert len(cache) == 0
+
+
+def test_jq_transform_a_single_payload():
+    result = jq_transform(MockDeviceMessage(device_id="lt10-1234", lat=-2.38, lon=37.33), JQ_FILTER)
+
+    assert result == {"source": "lt10-1234", "location": {"lat": -2.38, "lon": 37.33}}
+
+
+def test_jq_transform_a_list_payload_per_item():
+    payload = [{"device_id": f"lt10-{i}", "lat": -2.0, "lon": 37.0} for i in range(3)]
+
+    result = jq_transform(payload, JQ_FILTER, per_item=True)
+
+    assert [r["source"] for r in result] == ["lt10-0", "lt10-1", "lt10-2"]
+
+
+def test_jq_transform_a_whole_list_payload():
+    payload = [{"device_id": "lt10-1", "moving": True}, {"device_id": "lt10-2", "moving": False}]
+
+    result = jq_transform(payload, "map(select(.moving)) | map(.device_id)")
+
+    assert result == ["lt10-1"]
+
+
+def test_jq_transform_records_the_execution_time_by_filter():
+    filter_id = get_filter_id(JQ_FILTER)
+    samples_before = _get_count(filter_id)
+
+    jq_transform({"device_id": "lt10-1234", "lat": 0, "lon": 0}, JQ_FILTER)
+
+    assert _get_count(filter_id) == samples_before + 1
+
+
+def test_generic_json_transform_config_uses_cached_filters(integration_v2_with_webhook_generic):
+    config = GenericJsonTransformConfig.parse_obj(integration_v2_with_webhook_generic.webhook_configuration.data)
+    jq_filters.clear()
+
+    config.transform({"end_device_ids": {"device_id": "lt10-1234"}})
+    result = config.transform({"end_device_ids": {"device_id": "lt10-5678"}})
+
+    assert result["source"] == "lt10-5678"
+    assert len(jq_filters) == 1
+
+
+def _get_count(filter_id):
+    for metric in JQ_FILTER_DURATION.collect():
+        for sample in metric.samples:
+            if sample.name == "jq_filter_seconds_count" and sample.labels["filter_id"] == filter_id:
+                return sample.value
+    return 0
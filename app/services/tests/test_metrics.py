@@ -0,0 +1,54 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from app.services.metrics import observe_call, observe_duration
+
+
+def _get_count(service, operation, outcome):
+    return REGISTRY.get_sample_value(
+        "upstream_call_seconds_count",
+        {"service": service, "operation": operation, "outcome": outcome}
+    ) or 0
+
+
+@pytest.mark.asyncio
+async def test_observe_duration_records_successful_calls():
+    @observe_duration("test_service")
+    async def get_something():
+        return "something"
+
+    count_before = _get_count("test_service", "get_something", "success")
+
+    result = await get_something()
+
+    assert result == "something"
+    assert _get_count("test_service", "get_something", "success") == count_before + 1
+
+
+@pytest.mark.asyncio
+async def test_observe_duration_records_failed_calls():
+    @observe_duration("test_service", operation="custom_operation")
+    async def get_something():
+        raise ValueError("Something went wrong")
+
+    count_before = _get_count("test_service", "custom_operation", "error")
+
+    with pytest.raises(ValueError):
+        await get_something()
+
+    assert _get_count("test_service", "custom_operation", "error") == count_before + 1
+    assert _get_count("test_service", "custom_operation", "success") == 0
+
+
+def test_observe_call_records_each_call():
+    count_before = _get_count("test_service", "call_operation", "success")
+    errors_before = _get_count("test_service", "call_operation", "error")
+
+    with observe_call("test_service", "call_operation"):
+        pass
+    with pytest.raises(ValueError):
+        with observe_call("test_service", "call_operation"):
+            raise ValueError("Something went wrong")
+
+    assert _get_count("test_service", "call_operation", "success") == count_before + 1
+    assert _get_count("test_service", "call_operation", "error") == errors_before + 1
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+from unittest.mock import MagicMock
+from gundi_core.events import IntegrationActionComplete
+
+from app import settings
+from app.services.activity_logger import activity_logger
+from app.services.profiling import profile_action, get_current_profiler
+
+
+def _busy_work():
+    return sum(i * i for i in range(10000))
+
+
+def test_profile_action_saves_profile_and_summary(mocker, tmp_path):
+    mocker.patch.object(settings, "PROFILES_DIR", str(tmp_path))
+
+    with profile_action("integration-1", "pull_observations", requested=True) as profiler:
+        _busy_work()
+
+    summary = profiler.summary
+    assert os.path.exists(summary["profile_path"])
+    assert summary["profile_path"].startswith(str(tmp_path))
+    assert summary["wall_time_seconds"] >= 0
+    assert summary["memory_peak_bytes"] > 0
+    assert summary["total_calls"] > 0
+    assert any("_busy_work" in f["function"] for f in summary["top_functions"])
+    assert get_current_profiler() is None
+
+
+def test_profile_action_is_disabled_by_default(mocker, tmp_path):
+    mocker.patch.object(settings, "PROFILES_DIR", str(tmp_path))
+
+    with profile_action("integration-1", "pull_observations") as profiler:
+        _busy_work()
+
+    assert profiler is None
+    assert not os.listdir(tmp_path)
+
+
+def test_profile_action_enabled_by_settings(mocker, tmp_path):
+    mocker.patch.object(settings, "PROFILES_DIR", str(tmp_path))
+    mocker.patch.object(settings, "PROFILE_INTEGRATIONS", ["integration-1"])
+
+    with profile_action("integration-1", "pull_observations") as profiler:
+        _busy_work()
+    with profile_action("integration-2", "pull_observations") as other_profiler:
+        _busy_work()
+
+    assert profiler.summary
+    assert other_profiler is None
+
+
+def test_nested_actions_are_not_profiled_twice(mocker, tmp_path):
+    mocker.patch.object(settings, "PROFILES_DIR", str(tmp_path))
+
+    with profile_action("integration-1", "pull_observations", requested=True) as profiler:
+        with profile_action("integration-1", "fetch_collar_observations", requested=True) as nested_profiler:
+            assert get_current_profiler() is None
+        assert get_current_profiler() is profiler
+
+    assert nested_profiler is None
+    assert profiler.summary
+
+
+@pytest.mark.asyncio
+async def test_profile_summary_is_attached_to_completion_event(mocker, mock_publish_event, tmp_path):
+    mocker.patch.object(settings, "PROFILES_DIR", str(tmp_path))
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+
+    @activity_logger()
+    async def action_pull_observations(integration, action_config):
+        _busy_work()
+        return {"observations_extracted": 10}
+
+    with profile_action("integration-1", "pull_observations", requested=True):
+        result = await action_pull_observations(integration=MagicMock(id="integration-1"), action_config=None)
+
+    assert result == {"observations_extracted": 10}
+    completion_event = mock_publish_event.call_args_list[-1].kwargs["event"]
+    assert isinstance(completion_event, IntegrationActionComplete)
+    assert completion_event.payload.result["observations_extracted"] == 10
+    assert os.path.exists(completion_event.payload.result["profile"]["profile_path"])
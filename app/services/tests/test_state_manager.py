@@ -2,9 +2,18 @@ import datetime
 import json
 
 import pytest
+import redis.asyncio as redis
+from prometheus_client import REGISTRY
+from app.conftest import async_return
 from app.services.state import IntegrationStateManager
 
 
+def _get_redis_call_count(operation, outcome):
+    return REGISTRY.get_sample_value(
+        "upstream_call_seconds_count", {"service": "redis", "operation": operation, "outcome": outcome}
+    ) or 0
+
+
 @pytest.mark.asyncio
 async def test_set_integration_state(mocker, mock_redis, integration_v2):
     mocker.patch("app.services.state.redis", mock_redis)
@@ -150,3 +159,148 @@ async def test_delete_state_source_state(mocker, mock_redis, integration_v2, moc
     mock_redis.Redis.return_value.delete.assert_called_once_with(
         f"integration_state.{integration_id}.pull_observations.{source_id}"
     )
+
+
+@pytest.mark.asyncio
+async def test_record_source_failure_backs_off_exponentially(mocker, mock_redis, integration_v2):
+    mocker.patch("app.services.state.redis", mock_redis)
+    redis_client = mock_redis.Redis.return_value
+    previous_failure = {"failure_count": 2, "fingerprint": "abc", "first_failure_at": "2024-01-01T00:00:00+00:00"}
+    redis_client.hget.return_value = async_return(json.dumps(previous_failure))
+    redis_client.hset.return_value = async_return(1)
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    failure = await state_manager.record_failure(
+        integration_id=integration_id,
+        action_id="pull_observations",
+        source_id="device-123",
+        reason="forbidden",
+        fingerprint="abc",
+        backoff_initial=60,
+        backoff_max=3600
+    )
+
+    assert failure["failure_count"] == 3
+    assert failure["first_failure_at"] == previous_failure["first_failure_at"]
+    last_failure_at = datetime.datetime.fromisoformat(failure["last_failure_at"])
+    retry_at = datetime.datetime.fromisoformat(failure["retry_at"])
+    assert retry_at - last_failure_at == datetime.timedelta(seconds=240)
+    redis_client.hset.assert_called_once_with(
+        f"integration_failures.{integration_id}.pull_observations",
+        "device-123",
+        json.dumps(failure, default=str)
+    )
+
+
+@pytest.mark.asyncio
+async def test_record_source_failure_starts_over_when_config_changes(mocker, mock_redis, integration_v2):
+    mocker.patch("app.services.state.redis", mock_redis)
+    redis_client = mock_redis.Redis.return_value
+    redis_client.hget.return_value = async_return(json.dumps({"failure_count": 5, "fingerprint": "old"}))
+    redis_client.hset.return_value = async_return(1)
+    state_manager = IntegrationStateManager()
+
+    failure = await state_manager.record_failure(
+        integration_id=str(integration_v2.id),
+        action_id="pull_observations",
+        source_id="device-123",
+        reason="not_found",
+        fingerprint="new"
+    )
+
+    assert failure["failure_count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_get_source_failures(mocker, mock_redis, integration_v2):
+    mocker.patch("app.services.state.redis", mock_redis)
+    redis_client = mock_redis.Redis.return_value
+    failure = {"source_id": "device-123", "failure_count": 1}
+    redis_client.hgetall.return_value = async_return({b"device-123": json.dumps(failure).encode()})
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    failures = await state_manager.get_failures(integration_id=integration_id, action_id="pull_observations")
+
+    assert failures == {"device-123": failure}
+    redis_client.hgetall.assert_called_once_with(f"integration_failures.{integration_id}.pull_observations")
+
+
+@pytest.mark.asyncio
+async def test_acquire_source_lease(mocker, mock_redis, integration_v2):
+    mocker.patch("app.services.state.redis", mock_redis)
+    redis_client = mock_redis.Redis.return_value
+    redis_client.incr.return_value = async_return(5)
+    redis_client.set.return_value = async_return(True)
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    token = await state_manager.acquire_lease(
+        integration_id=integration_id, action_id="pull_observations", source_id="device-123", ttl=60
+    )
+
+    assert token == 5
+    redis_client.set.assert_called_once_with(
+        f"integration_lease.{integration_id}.pull_observations.device-123", "5", nx=True, ex=60
+    )
+
+
+@pytest.mark.asyncio
+async def test_acquire_source_lease_already_taken(mocker, mock_redis, integration_v2):
+    mocker.patch("app.services.state.redis", mock_redis)
+    redis_client = mock_redis.Redis.return_value
+    redis_client.incr.return_value = async_return(6)
+    redis_client.set.return_value = async_return(None)
+    state_manager = IntegrationStateManager()
+
+    token = await state_manager.acquire_lease(
+        integration_id=str(integration_v2.id), action_id="pull_observations", source_id="device-123"
+    )
+
+    assert token is None
+
+
+@pytest.mark.asyncio
+async def test_set_source_state_with_lease(mocker, mock_redis, integration_v2, mock_integration_state):
+    mocker.patch("app.services.state.redis", mock_redis)
+    redis_client = mock_redis.Redis.return_value
+    redis_client.eval.return_value = async_return(0)  # Lease lost
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    saved = await state_manager.set_state(
+        integration_id=integration_id,
+        action_id="pull_observations",
+        source_id="device-123",
+        state=mock_integration_state,
+        lease_token=5
+    )
+
+    assert not saved
+    assert not redis_client.set.called
+    eval_args = redis_client.eval.call_args.args
+    assert eval_args[1:] == (
+        2,
+        f"integration_state.{integration_id}.pull_observations.device-123",
+        f"integration_lease.{integration_id}.pull_observations.device-123",
+        json.dumps(mock_integration_state, default=str),
+        "5"
+    )
+
+
+@pytest.mark.asyncio
+async def test_each_attempt_is_timed_as_a_redis_call(mocker, mock_redis, integration_v2):
+    mocker.patch("app.services.state.redis", mock_redis)
+    mocker.patch("time.sleep")  # Waits between retries
+    mock_redis.RedisError = redis.RedisError
+    mock_redis.Redis.return_value.get.side_effect = [redis.ConnectionError("Connection refused"), async_return(None)]
+    state_manager = IntegrationStateManager()
+    errors_before = _get_redis_call_count("get_state", "error")
+    successes_before = _get_redis_call_count("get_state", "success")
+
+    await state_manager.get_state(integration_id=str(integration_v2.id), action_id="pull_observations")
+
+    # The retry and its backoff aren't part of the recorded durations
+    assert _get_redis_call_count("get_state", "error") == errors_before + 1
+    assert _get_redis_call_count("get_state", "success") == successes_before + 1
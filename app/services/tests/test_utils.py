@@ -0,0 +1,159 @@
+import json
+
+import pytest
+from pydantic import BaseModel, ValidationError
+
+from app.services import utils
+from app.services.utils import DynamicModelCache, StructHexString, get_struct_decoder
+
+
+class MockPayloadBaseModel(BaseModel):
+    pass
+
+
+def _get_schema(*required_fields):
+    return {
+        "title": "DeviceMessage",
+        "type": "object",
+        "required": list(required_fields),
+        "properties": {
+            "device_id": {"title": "Device Id", "type": "string"},
+            "lat": {"title": "Lat", "type": "number"},
+            "lon": {"title": "Lon", "type": "number"},
+        },
+    }
+
+
+def test_dynamic_model_cache_reuses_models_for_the_same_schema():
+    cache = DynamicModelCache()
+
+    model = cache.get_model(_get_schema("device_id"), base_model=MockPayloadBaseModel)
+    # Same schema, keys in a different order
+    same_model = cache.get_model(dict(reversed(_get_schema("device_id").items())), base_model=MockPayloadBaseModel)
+
+    assert model is same_model
+    assert issubclass(model, MockPayloadBaseModel)
+    assert model.parse_obj({"device_id": "device1", "lat": 1.0, "lon": 2.0}).device_id == "device1"
+    assert cache.misses == 1
+    assert cache.hits == 1
+
+
+def test_dynamic_model_cache_builds_a_model_per_schema():
+    cache = DynamicModelCache()
+
+    model = cache.get_model(_get_schema("device_id"), base_model=MockPayloadBaseModel)
+    strict_model = cache.get_model(_get_schema("device_id", "lat", "lon"), base_model=MockPayloadBaseModel)
+
+    assert model is not strict_model
+    model.parse_obj({"device_id": "device1"})
+    with pytest.raises(ValidationError):
+        strict_model.parse_obj({"device_id": "device1"})
+
+
+def test_dynamic_model_cache_evicts_least_recently_used_models():
+    cache = DynamicModelCache(max_size=2)
+    first_schema, second_schema, third_schema = _get_schema("device_id"), _get_schema("lat"), _get_schema("lon")
+
+    first_model = cache.get_model(first_schema)
+    cache.get_model(second_schema)
+    cache.get_model(first_schema)  # Now the second one is the least recently used
+    cache.get_model(third_schema)
+
+    assert len(cache) == 2
+    assert cache.get_model(first_schema) is first_model
+    assert cache.misses == 3
+
+
+def test_dynamic_model_cache_drops_models_when_the_owner_schema_changes():
+    cache = DynamicModelCache()
+
+    old_model = cache.get_model(_get_schema("device_id"), owner="integration-1")
+    cache.get_model(_get_schema("device_id", "lat"), owner="integration-1")
+
+    assert len(cache) == 1
+    assert cache.get_model(_get_schema("device_id"), owner="integration-1") is not old_model
+
+
+def test_dynamic_model_cache_invalidate_keeps_models_used_by_other_owners():
+    cache = DynamicModelCache()
+    cache.get_model(_get_schema("device_id"), owner="integration-1")
+    cache.get_model(_get_schema("device_id"), owner="integration-2")
+    cache.get_model(_get_schema("lat"), owner="integration-3")
+
+    cache.invalidate(owner="integration-1")
+    cache.invalidate(owner="integration-3")
+
+    assert len(cache) == 1
+    cache.get_model(_get_schema("device_id"), owner="integration-2")
+    assert cache.misses == 2
+
+
+HEX_FORMAT = {
+    "byte_order": ">",
+    "fields": [
+        {"name": "lat", "format": "i", "output_type": "int"},
+        {
+            "name": "status",
+            "format": "B",
+            "output_type": "hex",
+            "bit_fields": [
+                {"name": "gps_fix", "start_bit": 0, "end_bit": 0, "output_type": "bool"},
+                {"name": "battery_level", "start_bit": 2, "end_bit": 5, "output_type": "int"},
+            ],
+        },
+    ],
+}
+
+
+def test_struct_hex_string_unpacks_fields_and_bit_fields():
+    value = StructHexString.validate("fffffffe2d", {"hex_format": HEX_FORMAT}, None)
+
+    assert value.format_spec == ">iB"
+    assert value.unpacked_data == {"lat": -2, "status": "0x2d", "gps_fix": True, "battery_level": 11}
+
+
+def test_struct_hex_string_rejects_values_with_a_different_length():
+    with pytest.raises(ValueError, match="Invalid hex string for format '>iB'"):
+        StructHexString.validate("fffffffe", {"hex_format": HEX_FORMAT}, None)
+
+
+def test_struct_decoder_is_compiled_once_per_format():
+    decoder = get_struct_decoder(HEX_FORMAT)
+
+    assert get_struct_decoder(json.loads(json.dumps(HEX_FORMAT))) is decoder
+    assert get_struct_decoder({**HEX_FORMAT, "byte_order": "<"}) is not decoder
+
+
+def test_struct_decoder_follows_changes_to_the_format():
+    hex_format = json.loads(json.dumps(HEX_FORMAT))
+    decoder = get_struct_decoder(hex_format)
+
+    hex_format["byte_order"] = "<"  # e.g. a webhook config updated in place
+
+    assert get_struct_decoder(hex_format) is not decoder
+
+
+def test_struct_hex_string_parse_many_decodes_like_validate():
+    values = ["fffffffe2d", "0000000100", "7fffffffff"]
+
+    parsed_values = StructHexString.parse_many(values, HEX_FORMAT)
+
+    assert [v.unpacked_data for v in parsed_values] == [
+        StructHexString.validate(v, {"hex_format": HEX_FORMAT}, None).unpacked_data for v in values
+    ]
+    # Decoded values aren't decoded again when validated
+    assert StructHexString.validate(parsed_values[0], {"hex_format": HEX_FORMAT}, None) is parsed_values[0]
+
+
+def test_struct_hex_string_parse_many_looks_up_the_decoder_once(mocker):
+    get_decoder_spy = mocker.spy(utils, "get_struct_decoder")
+
+    parsed_values = StructHexString.parse_many(["fffffffe2d", "0000000100", "7fffffffff"], HEX_FORMAT)
+
+    assert get_decoder_spy.call_count == 1
+    assert parsed_values[0].format_spec == ">iB"
+
+
+def test_struct_hex_string_parse_many_reports_the_invalid_value():
+    with pytest.raises(ValueError, match="Invalid hex string"):
+        StructHexString.parse_many(["fffffffe2d", "zzzzzzzzzz"], HEX_FORMAT)
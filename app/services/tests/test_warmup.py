@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.conftest import async_return
+from app.main import app
+from app.services.warmup import Readiness, preload_integrations, warm_up
+
+api_client = TestClient(app)
+
+
+@pytest.mark.asyncio
+async def test_preload_integrations_loads_the_most_active_ones(
+        mocker, mock_config_manager, mock_get_gundi_api_key, integration_v2
+):
+    mocker.patch("app.services.warmup.get_gundi_api_key", mock_get_gundi_api_key)
+    mock_config_manager.get_active_integrations.return_value = async_return(["integration-1", "integration-2"])
+    mock_config_manager.get_integration_details.side_effect = [async_return(integration_v2), Exception("Gundi API error")]
+
+    preloaded = await preload_integrations(mock_config_manager, limit=50)
+
+    assert preloaded == 1
+    mock_config_manager.get_active_integrations.assert_called_once_with(50)
+    assert mock_config_manager.get_integration_details.call_count == 2
+    mock_get_gundi_api_key.assert_called_once_with("integration-1")
+
+
+@pytest.mark.asyncio
+async def test_warm_up_sets_the_instance_ready(mocker, mock_config_manager, mock_redis_empty):
+    readiness = mocker.patch("app.services.warmup.readiness", Readiness())
+    mock_config_manager.get_active_integrations.return_value = async_return([])
+    redis_client = mock_redis_empty.Redis.return_value
+    redis_client.ping.return_value = async_return(True)
+
+    await warm_up(config_manager=mock_config_manager, redis_clients=[redis_client])
+
+    assert readiness.ready
+    redis_client.ping.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_warm_up_sets_the_instance_ready_after_a_timeout(mocker, mock_config_manager):
+    readiness = mocker.patch("app.services.warmup.readiness", Readiness())
+
+    async def get_active_integrations(limit):
+        await asyncio.sleep(10)
+
+    mock_config_manager.get_active_integrations = get_active_integrations
+
+    await warm_up(config_manager=mock_config_manager, timeout=0.01)
+
+    assert readiness.ready
+    assert readiness.preloaded_integrations == 0
+
+
+def test_ready_endpoint_reports_warmup(mocker):
+    readiness = mocker.patch("app.main.readiness", Readiness())
+
+    assert api_client.get("/ready").status_code == 503
+    readiness.set_ready()
+    response = api_client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
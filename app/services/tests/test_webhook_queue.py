@@ -0,0 +1,96 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.datastructures import Headers, QueryParams
+
+from app.main import app
+from app.services.webhook_queue import QueuedWebhookRequest, WebhookQueue
+
+api_client = TestClient(app)
+
+
+def _get_webhook_request(payload: dict) -> QueuedWebhookRequest:
+    return QueuedWebhookRequest(
+        body=json.dumps(payload).encode("utf-8"),
+        headers=Headers({"x-gundi-integration-id": "ed8ed116-efb4-4fb1-9d68-0ecc4b0996a1"}),
+        query_params=QueryParams(""),
+    )
+
+
+@pytest.mark.asyncio
+async def test_webhook_queue_workers_process_queued_requests(mocker):
+    mock_process_webhook = mocker.patch("app.services.webhook_queue.process_webhook", AsyncMock())
+    queue = WebhookQueue(max_size=10, workers=2)
+    webhook_requests = [_get_webhook_request({"device_id": i}) for i in range(5)]
+
+    assert all(queue.put(r) for r in webhook_requests)
+    await queue.stop()
+
+    assert mock_process_webhook.call_count == 5
+    processed = [c.kwargs["request"] for c in mock_process_webhook.call_args_list]
+    assert sorted([(await r.json())["device_id"] for r in processed]) == [0, 1, 2, 3, 4]
+    assert processed[0].headers.get("X-Gundi-Integration-Id") == "ed8ed116-efb4-4fb1-9d68-0ecc4b0996a1"
+
+
+@pytest.mark.asyncio
+async def test_webhook_queue_rejects_requests_when_full(mocker):
+    processing = asyncio.Event()
+
+    async def process_webhook(request):
+        await processing.wait()
+
+    mocker.patch("app.services.webhook_queue.process_webhook", process_webhook)
+    queue = WebhookQueue(max_size=2, workers=1)
+
+    accepted = [queue.put(_get_webhook_request({"device_id": i})) for i in range(3)]
+    await asyncio.sleep(0)  # The worker takes the first request
+    accepted.append(queue.put(_get_webhook_request({"device_id": 3})))
+    accepted.append(queue.put(_get_webhook_request({"device_id": 4})))
+
+    assert accepted == [True, True, False, True, False]
+    assert queue.depth == 2
+    processing.set()
+    await queue.stop()
+    assert queue.depth == 0
+
+
+@pytest.mark.asyncio
+async def test_webhook_queue_keeps_processing_after_errors(mocker):
+    mock_process_webhook = mocker.patch(
+        "app.services.webhook_queue.process_webhook", AsyncMock(side_effect=[Exception("Parsing error"), None])
+    )
+    queue = WebhookQueue(max_size=10, workers=1)
+
+    queue.put(_get_webhook_request({"device_id": 1}))
+    queue.put(_get_webhook_request({"device_id": 2}))
+    await queue.stop()
+
+    assert mock_process_webhook.call_count == 2
+
+
+def test_webhooks_endpoint_enqueues_requests(mocker):
+    mocker.patch("app.routers.webhooks.settings.WEBHOOK_QUEUE_ENABLED", True)
+    mock_webhook_queue = mocker.patch("app.routers.webhooks.webhook_queue")
+    mock_webhook_queue.put.return_value = True
+    mock_process_webhook = mocker.patch("app.routers.webhooks.process_webhook", AsyncMock())
+
+    response = api_client.post("/webhooks?integration_id=1234", json={"device_id": "lt10-1234"})
+
+    assert response.status_code == 200
+    queued_request = mock_webhook_queue.put.call_args.args[0]
+    assert json.loads(queued_request.body) == {"device_id": "lt10-1234"}
+    assert queued_request.query_params.get("integration_id") == "1234"
+    assert not mock_process_webhook.called
+
+
+def test_webhooks_endpoint_rejects_requests_when_the_queue_is_full(mocker):
+    mocker.patch("app.routers.webhooks.settings.WEBHOOK_QUEUE_ENABLED", True)
+    mock_webhook_queue = mocker.patch("app.routers.webhooks.webhook_queue")
+    mock_webhook_queue.put.return_value = False
+
+    response = api_client.post("/webhooks", json={"device_id": "lt10-1234"})
+
+    assert response.status_code == 429
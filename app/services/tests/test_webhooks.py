@@ -1,12 +1,14 @@
 import base64
 import json
-from unittest.mock import ANY
+from unittest.mock import ANY, AsyncMock
 
 import pytest
 from fastapi.testclient import TestClient
+from gundi_core.events import IntegrationWebhookFailed
 
 from app.conftest import MockWebhookPayloadModel, MockWebhookConfigModel
 from app.main import app
+from app.services.utils import DynamicModelCache, DyntamicFactory
 from app.webhooks import GenericJsonTransformConfig
 
 api_client = TestClient(app)
@@ -14,12 +16,12 @@ api_client = TestClient(app)
 
 @pytest.mark.asyncio
 async def test_process_webhook_request_with_fixed_schema(
-        mocker, integration_v2_with_webhook, mock_gundi_client_v2_for_webhooks, mock_publish_event,
+        mocker, integration_v2_with_webhook, mock_config_manager_for_webhooks, mock_publish_event,
         mock_get_webhook_handler_for_fixed_json_payload, mock_webhook_handler,
         mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_fixed_schema
 ):
     mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_fixed_json_payload)
-    mocker.patch("app.services.webhooks._portal", mock_gundi_client_v2_for_webhooks)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks)
 
     response = api_client.post(
         "/webhooks",
@@ -28,7 +30,7 @@ async def test_process_webhook_request_with_fixed_schema(
     )
 
     assert response.status_code == 200
-    assert mock_gundi_client_v2_for_webhooks.get_integration_details.called
+    assert mock_config_manager_for_webhooks.get_integration_details.called
     assert mock_get_webhook_handler_for_fixed_json_payload.called
     expected_payload = MockWebhookPayloadModel.parse_obj(mock_webhook_request_payload_for_fixed_schema)
     expected_config = MockWebhookConfigModel.parse_obj(integration_v2_with_webhook.webhook_configuration.data)
@@ -41,12 +43,12 @@ async def test_process_webhook_request_with_fixed_schema(
 
 @pytest.mark.asyncio
 async def test_process_webhook_request_with_dynamic_schema(
-        mocker, integration_v2_with_webhook_generic, mock_gundi_client_v2_for_webhooks_generic, mock_publish_event,
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic, mock_publish_event,
         mock_get_webhook_handler_for_generic_json_payload, mock_webhook_handler,
         mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_dynamic_schema
 ):
     mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_generic_json_payload)
-    mocker.patch("app.services.webhooks._portal", mock_gundi_client_v2_for_webhooks_generic)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
 
     response = api_client.post(
         "/webhooks",
@@ -55,7 +57,7 @@ async def test_process_webhook_request_with_dynamic_schema(
     )
 
     assert response.status_code == 200
-    assert mock_gundi_client_v2_for_webhooks_generic.get_integration_details.called
+    assert mock_config_manager_for_webhooks_generic.get_integration_details.called
     assert mock_get_webhook_handler_for_generic_json_payload.called
     expected_config = GenericJsonTransformConfig.parse_obj(integration_v2_with_webhook_generic.webhook_configuration.data)
     mock_webhook_handler.assert_called_once_with(
@@ -65,3 +67,120 @@ async def test_process_webhook_request_with_dynamic_schema(
     )
 
 
+
+
+@pytest.mark.asyncio
+async def test_process_webhook_request_with_dynamic_schema_reuses_model(
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic, mock_publish_event,
+        mock_get_webhook_handler_for_generic_json_payload, mock_webhook_handler,
+        mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_dynamic_schema
+):
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_generic_json_payload)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
+    mocker.patch("app.services.webhooks.dynamic_models", DynamicModelCache())
+    make_spy = mocker.spy(DyntamicFactory, "make")
+
+    for _ in range(3):
+        response = api_client.post(
+            "/webhooks",
+            headers=mock_webhook_request_headers_onyesha,
+            json=mock_webhook_request_payload_for_dynamic_schema,
+        )
+        assert response.status_code == 200
+
+    assert make_spy.call_count == 1
+    assert mock_webhook_handler.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_process_webhook_request_with_a_list_skips_invalid_items(
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic,
+        mock_get_webhook_handler_for_generic_json_payload, mock_webhook_handler,
+        mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_dynamic_schema
+):
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_generic_json_payload)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
+    mock_log_webhook_activity = mocker.patch("app.services.webhooks.log_webhook_activity", AsyncMock())
+
+    response = api_client.post(
+        "/webhooks",
+        headers=mock_webhook_request_headers_onyesha,
+        json=[mock_webhook_request_payload_for_dynamic_schema, {"end_device_ids": "invalid"}],
+    )
+
+    assert response.status_code == 200
+    mock_webhook_handler.assert_called_once()
+    assert len(mock_webhook_handler.call_args.kwargs["payload"]) == 1
+    mock_log_webhook_activity.assert_called_once()
+    report = mock_log_webhook_activity.call_args.kwargs
+    assert report["title"] == "1 of 2 webhook items are invalid and were not processed"
+    assert [item["index"] for item in report["data"]["invalid_items"]] == [1]
+
+
+@pytest.mark.asyncio
+async def test_process_webhook_request_with_a_list_in_batches(
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic,
+        mock_get_webhook_handler_for_generic_json_payload, mock_webhook_handler,
+        mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_dynamic_schema
+):
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_generic_json_payload)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
+    mocker.patch("app.services.webhooks.settings.WEBHOOK_BATCH_SIZE", 2)
+    mock_log_webhook_activity = mocker.patch("app.services.webhooks.log_webhook_activity", AsyncMock())
+    mock_publish_event = mocker.patch("app.services.webhooks.publish_event", AsyncMock())
+    # The second batch fails, the others are delivered
+    mock_webhook_handler.side_effect = [None, Exception("Gundi API error"), None]
+
+    response = api_client.post(
+        "/webhooks",
+        headers=mock_webhook_request_headers_onyesha,
+        json=[mock_webhook_request_payload_for_dynamic_schema] * 5,
+    )
+
+    assert response.status_code == 200
+    assert [len(c.kwargs["payload"]) for c in mock_webhook_handler.call_args_list] == [2, 2, 1]
+    assert not mock_log_webhook_activity.called
+    mock_publish_event.assert_called_once()
+    event = mock_publish_event.call_args.kwargs["event"]
+    assert isinstance(event, IntegrationWebhookFailed)
+    assert event.payload.error == (
+        "Error processing webhook: Exception: Gundi API error (2 of 5 items in 1 batches failed)"
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_webhook_request_with_a_failed_list_publishes_webhook_failed(
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic,
+        mock_get_webhook_handler_for_generic_json_payload, mock_webhook_handler,
+        mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_dynamic_schema
+):
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_generic_json_payload)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
+    mock_publish_event = mocker.patch("app.services.webhooks.publish_event", AsyncMock())
+    mock_webhook_handler.side_effect = Exception("Gundi API error")
+
+    response = api_client.post(
+        "/webhooks",
+        headers=mock_webhook_request_headers_onyesha,
+        json=[mock_webhook_request_payload_for_dynamic_schema] * 2,
+    )
+
+    assert response.status_code == 200
+    event = mock_publish_event.call_args.kwargs["event"]
+    assert isinstance(event, IntegrationWebhookFailed)
+    assert event.payload.error == "Error processing webhook: Exception: Gundi API error"
+
+
+@pytest.mark.asyncio
+async def test_process_webhook_request_with_an_empty_list(
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic,
+        mock_get_webhook_handler_for_generic_json_payload, mock_webhook_handler, mock_webhook_request_headers_onyesha
+):
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_generic_json_payload)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
+
+    response = api_client.post("/webhooks", headers=mock_webhook_request_headers_onyesha, json=[])
+
+    assert response.status_code == 200
+    mock_webhook_handler.assert_called_once()
+    assert mock_webhook_handler.call_args.kwargs["payload"] == []
@@ -0,0 +1,84 @@
+import logging
+from functools import wraps
+from typing import Optional, TYPE_CHECKING
+
+from opentelemetry import propagate, trace
+from app import settings
+
+if TYPE_CHECKING:  # The SDK is imported only if tracing is enabled
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SpanExporter
+
+
+logger = logging.getLogger(__name__)
+# Spans are dropped until a tracer provider is configured
+tracer = trace.get_tracer(__name__)
+
+
+def get_span_exporter(name: str) -> Optional["SpanExporter"]:
+    if name == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        return ConsoleSpanExporter()
+    if name == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning("TRACING_EXPORTER is 'otlp' but opentelemetry-exporter-otlp isn't installed. Tracing disabled.")
+            return None
+        return OTLPSpanExporter()  # Configured with the OTEL_EXPORTER_OTLP_* environment variables
+    return None
+
+
+def configure_tracing(exporter: "SpanExporter" = None, batch: bool = True) -> Optional["TracerProvider"]:
+    """
+    Sets the global tracer provider, exporting spans with the given exporter or the one set in TRACING_EXPORTER.
+    Use batch=False to export spans as soon as they end (e.g. with an InMemorySpanExporter in tests).
+    """
+    exporter = exporter or get_span_exporter(settings.TRACING_EXPORTER)
+    if not exporter:
+        return None
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
+    provider = TracerProvider(
+        resource=Resource.create({
+            "service.name": settings.INTEGRATION_TYPE_SLUG or "gundi-integration",
+            "deployment.environment": settings.TRACE_ENVIRONMENT,
+        })
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter) if batch else SimpleSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return provider
+
+
+def get_trace_context() -> dict:
+    """
+    Returns the current trace context (traceparent, tracestate) to be sent along with messages, e.g. as PubSub attributes.
+    """
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def start_span(name: str, trace_context: dict = None, attributes: dict = None):
+    """
+    Starts a span as a child of the current span, or of the remote span in trace_context if it's provided.
+    """
+    parent_context = propagate.extract(trace_context) if trace_context else None
+    return tracer.start_as_current_span(name, context=parent_context, attributes=attributes)
+
+
+def traced(name: str = None):
+    """
+    Decorator to run an async function within a span. Exceptions are recorded in the span.
+    :param name: defaults to the function name
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
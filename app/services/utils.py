@@ -1,8 +1,14 @@
+import copy
+import functools
+import hashlib
+import json
 import struct
 import typing
+from collections import OrderedDict
 from pydantic import create_model, BaseModel
 from pydantic.fields import Field, FieldInfo, Undefined, NoArgAnyCallable
 from typing import Any, Dict, Optional, Union, List, Annotated
+from app import settings
 
 
 def find_config_for_action(configurations, action_id):
@@ -15,12 +21,101 @@ def find_config_for_action(configurations, action_id):
     )
 
 
+class StructDecoder:
+    """
+    Decoder of binary data with the layout described in a hex_format configuration:
+    {"byte_order": ">", "fields": [{"name": "lat", "format": "i", "output_type": "int", "bit_fields": [...]}, ...]}
+    The format is compiled once into a struct.Struct, with the cast functions of each field. Use get_struct_decoder().
+    """
+
+    CASTS = {"bool": bool, "int": int}  # hex string by default
+
+    def __init__(self, hex_format: dict):
+        fields = hex_format["fields"]
+        self.format_spec = hex_format.get("byte_order", "<") + ''.join(f["format"] for f in fields)
+        self.struct = struct.Struct(self.format_spec)
+        self.size = self.struct.size
+        self.fields = [(f["name"], self.CASTS.get(f.get("output_type", "int"), hex)) for f in fields]
+        field_names = [f["name"] for f in fields]
+        self.bit_fields = [
+            (
+                bit_field["name"],
+                field_names.index(field["name"]),
+                bit_field["start_bit"],
+                2 ** (bit_field["end_bit"] - bit_field["start_bit"] + 1) - 1,
+                self.CASTS.get(bit_field.get("output_type", "bool"), hex)
+            )
+            for field in fields if "bit_fields" in field
+            for bit_field in field["bit_fields"]
+        ]
+
+    def _to_dict(self, unpacked_fields: tuple) -> dict:
+        data = {name: cast(value) for (name, cast), value in zip(self.fields, unpacked_fields)}
+        for name, index, start_bit, mask, cast in self.bit_fields:
+            data[name] = cast((unpacked_fields[index] >> start_bit) & mask)
+        return data
+
+    def decode_hex(self, value: str) -> dict:
+        try:
+            bytes_data = bytes.fromhex(value)
+            if len(bytes_data) != self.size:
+                raise ValueError("Hex string does not match the expected length for format")
+        except (ValueError, struct.error) as e:
+            raise ValueError(f"Invalid hex string for format '{self.format_spec}': {str(e)}")
+        return self._to_dict(self.struct.unpack(bytes_data))
+
+    def decode_hex_many(self, values: List[str]) -> List[dict]:
+        """
+        Decodes a list of hex strings at once, unpacking one buffer with all of them.
+        """
+        hex_length = self.size * 2
+        if all(isinstance(v, str) and len(v) == hex_length for v in values):
+            try:
+                buffer = bytes.fromhex("".join(values))
+            except ValueError:
+                pass  # Decoded one by one below, to report the invalid value
+            else:
+                return [self._to_dict(unpacked) for unpacked in self.struct.iter_unpack(buffer)]
+        return [self.decode_hex(v) for v in values]
+
+
+@functools.lru_cache(maxsize=128)
+def _get_struct_decoder(hex_format_key: str) -> StructDecoder:
+    return StructDecoder(json.loads(hex_format_key))
+
+
+_struct_decoders_by_id = {}  # id(hex_format) -> (copy of hex_format, decoder)
+
+
+def get_struct_decoder(hex_format: dict) -> StructDecoder:
+    """
+    Compiled decoder for the hex_format, reused across values and requests with the same format.
+    The same format object (e.g. the one in the webhook config) is looked up by identity, and compared with a copy
+    to detect changes, as serializing it is slower. Resolve it once to decode many values, see parse_many().
+    """
+    entry = _struct_decoders_by_id.get(id(hex_format))
+    if entry is not None and entry[0] == hex_format:
+        return entry[1]
+    decoder = _get_struct_decoder(json.dumps(hex_format, sort_keys=True))
+    if len(_struct_decoders_by_id) >= 128:
+        _struct_decoders_by_id.clear()
+    _struct_decoders_by_id[id(hex_format)] = (copy.deepcopy(hex_format), decoder)
+    return decoder
+
+
 class StructHexString:
-    def __init__(self, value: str, hex_format):
+    def __init__(self, value: str, hex_format, unpacked_data: dict = None, decoder: StructDecoder = None):
         self.value = value
         self.hex_format = hex_format
-        self.format_spec = hex_format.get("byte_order", "<") + ''.join(f["format"] for f in hex_format["fields"])
-        self.unpacked_data = self._unpack_data()
+        if unpacked_data is None:
+            decoder = decoder or get_struct_decoder(hex_format)
+            unpacked_data = decoder.decode_hex(value)
+        self._decoder = decoder
+        self.unpacked_data = unpacked_data
+
+    @property
+    def format_spec(self) -> str:
+        return (self._decoder or get_struct_decoder(self.hex_format)).format_spec
 
     @classmethod
     def __get_validators__(cls):
@@ -29,46 +124,23 @@ class StructHexString:
     @classmethod
     def validate(cls, v: str, values, field):
         hex_format = values['hex_format']  # Assumes format is already set in the parent model
-        format_spec = hex_format.get("byte_order", "<") + ''.join(d["format"] for d in hex_format["fields"])
-        try:
-            bytes_data = bytes.fromhex(v)
-            if len(bytes_data) != struct.calcsize(format_spec):
-                raise ValueError("Hex string does not match the expected length for format")
-        except (ValueError, struct.error) as e:
-            raise ValueError(f"Invalid hex string for format '{format_spec}': {str(e)}")
+        if isinstance(v, cls) and (v.hex_format is hex_format or v.hex_format == hex_format):  # Already decoded, e.g. with parse_many()
+            return v
+        return cls(v, hex_format, decoder=get_struct_decoder(hex_format))
 
-        return cls(v, hex_format)
+    @classmethod
+    def parse_many(cls, values: List[str], hex_format: dict) -> List["StructHexString"]:
+        """
+        Decodes many hex strings with the same format at once, e.g. the items of a list payload.
+        """
+        decoder = get_struct_decoder(hex_format)
+        decoded_values = decoder.decode_hex_many(values)
+        return [cls(v, hex_format, unpacked_data=data, decoder=decoder) for v, data in zip(values, decoded_values)]
 
     @classmethod
     def __modify_schema__(cls, field_schema):
         field_schema.update(type="hex_string", example="123456789ABCDEF", description="Hex string data")
 
-    def _unpack_data(self):
-        field_values = []
-        unpacked_fields = struct.unpack(self.format_spec, bytes.fromhex(self.value))
-        for s, v in zip(self.hex_format["fields"], unpacked_fields):
-            field_values.append(self._cast_output(value=v, output_type=s.get("output_type", "int")))
-        field_names = [f["name"] for f in self.hex_format["fields"]]
-        fields_with_bitfields = [f for f in self.hex_format["fields"] if "bit_fields" in f]
-        for field in fields_with_bitfields:
-            bit_fields = field["bit_fields"]
-            for bit_field in bit_fields:
-                start_bit = bit_field["start_bit"]
-                end_bit = bit_field["end_bit"]
-                field_value = unpacked_fields[field_names.index(field["name"])]
-                bits_value = (field_value >> start_bit) & (2 ** (end_bit - start_bit + 1) - 1)
-                field_values.append(self._cast_output(value=bits_value, output_type=bit_field.get("output_type", "bool")))
-                field_names.append(bit_field["name"])
-        return dict(zip(field_names, field_values))
-
-    def _cast_output(self, value, output_type="hex"):
-        if output_type == "bool":
-            return bool(value)
-        elif output_type == "int":
-            return int(value)
-        else:  # hex string by default
-            return hex(value)
-
     def __repr__(self) -> str:
         return f"StructHexString(value={self.value}, hex_format={self.hex_format})"
 
@@ -167,6 +239,68 @@ class DyntamicFactory:
             )
 
 
+class DynamicModelCache:
+    """
+    LRU cache of the pydantic models built from JSON schemas with DyntamicFactory.
+    Building a model is much slower than validating data with it, so models are reused across requests.
+    Models are keyed by a hash of the schema, the base model and the ref template.
+    An owner (e.g. the integration id) can be given, to drop its model when its configuration changes.
+    """
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._models = OrderedDict()
+        self._keys_by_owner = {}
+
+    def __len__(self):
+        return len(self._models)
+
+    @staticmethod
+    def get_key(json_schema: dict, base_model=None, ref_template: str = "#/$defs/") -> str:
+        schema_hash = hashlib.sha256(json.dumps(json_schema, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        base_models = base_model if isinstance(base_model, tuple) else (base_model,)
+        base_model_names = ",".join(f"{m.__module__}.{m.__qualname__}" for m in base_models if m is not None)
+        return f"{schema_hash}:{base_model_names}:{ref_template}"
+
+    def get_model(self, json_schema: dict, base_model=None, ref_template: str = "#/$defs/", owner: str = None):
+        key = self.get_key(json_schema, base_model, ref_template)
+        if (model := self._models.get(key)) is not None:
+            self._models.move_to_end(key)
+            self.hits += 1
+        else:
+            model = DyntamicFactory(json_schema=json_schema, base_model=base_model, ref_template=ref_template).make()
+            self._models[key] = model
+            self.misses += 1
+            if len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+        if owner is not None:
+            previous_key = self._keys_by_owner.get(owner)
+            self._keys_by_owner[owner] = key
+            if previous_key and previous_key != key:  # The owner's schema changed
+                self._discard(previous_key)
+        return model
+
+    def invalidate(self, owner: str):
+        """
+        Drops the model used by the owner, unless other owners use it too.
+        """
+        if key := self._keys_by_owner.pop(owner, None):
+            self._discard(key)
+
+    def clear(self):
+        self._models.clear()
+        self._keys_by_owner.clear()
+
+    def _discard(self, key: str):
+        if key not in self._keys_by_owner.values():
+            self._models.pop(key, None)
+
+
+# Shared by the webhooks (to parse payloads) and the config events consumer (to drop models of updated integrations)
+dynamic_models = DynamicModelCache(max_size=settings.DYNAMIC_MODELS_CACHE_SIZE)
+
 class GlobalUISchemaOptions(BaseModel):
     order: Optional[List[str]]
     addable: Optional[bool]
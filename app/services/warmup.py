@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+
+from app import settings
+from app.actions import action_handlers
+from app.webhooks.core import get_webhook_handler
+from .gundi import get_gundi_api_key
+from .metrics import WARMUP_DURATION, WARMUP_PRELOADED_INTEGRATIONS
+
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """
+    Whether this instance finished warming up. A failed or timed out warmup still makes it ready,
+    as it only makes the first requests faster.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.preloaded_integrations = 0
+
+    def set_ready(self):
+        self.ready = True
+
+
+readiness = Readiness()
+
+
+async def open_connections(redis_clients):
+    # Connections are opened on the first command, and kept in each client's pool
+    await asyncio.gather(*[client.ping() for client in redis_clients])
+
+
+def preload_modules():
+    # Action handlers and the webhook handler are imported on first use
+    len(action_handlers)
+    try:
+        get_webhook_handler()
+    except (ImportError, AttributeError, NotImplementedError):  # This integration doesn't have webhooks
+        pass
+
+
+async def preload_integrations(config_manager, limit: int, concurrency: int = 10) -> int:
+    """
+    Loads the details of the most recently active integrations in the local cache (and in redis if missing),
+    including their action configurations, and their API keys. Returns how many were loaded.
+    """
+    integration_ids = await config_manager.get_active_integrations(limit)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def preload(integration_id):
+        async with semaphore:
+            await config_manager.get_integration_details(integration_id)
+            await get_gundi_api_key(integration_id)
+
+    results = await asyncio.gather(*[preload(i) for i in integration_ids], return_exceptions=True)
+    for integration_id, result in zip(integration_ids, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Error preloading integration '{integration_id}': {type(result).__name__}: {result}")
+    return sum(1 for result in results if not isinstance(result, Exception))
+
+
+async def warm_up(config_manager, redis_clients=(), timeout: float = None):
+    """
+    Opens connections, imports what's imported lazily and preloads the most active integrations,
+    up to timeout seconds. Sets the instance as ready when it's done.
+    """
+    start_time = time.monotonic()
+
+    async def run():
+        await open_connections(redis_clients)
+        preload_modules()
+        if settings.WARMUP_INTEGRATIONS:
+            readiness.preloaded_integrations = await preload_integrations(
+                config_manager, limit=settings.WARMUP_INTEGRATIONS, concurrency=settings.WARMUP_CONCURRENCY
+            )
+            WARMUP_PRELOADED_INTEGRATIONS.set(readiness.preloaded_integrations)
+
+    try:
+        await asyncio.wait_for(run(), timeout=timeout or settings.WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Warmup didn't finish in {timeout or settings.WARMUP_TIMEOUT}s.")
+    except Exception as e:
+        logger.exception(f"Error warming up: {type(e).__name__}: {e}")
+    duration = time.monotonic() - start_time
+    WARMUP_DURATION.set(duration)
+    logger.info(f"Warmup finished in {duration:.2f}s, {readiness.preloaded_integrations} integrations preloaded.")
+    readiness.set_ready()
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+import time
+
+from starlette.datastructures import Headers, QueryParams
+
+from app import settings
+from .metrics import WEBHOOK_QUEUE_WAIT, WEBHOOKS_QUEUED, WEBHOOKS_REJECTED
+from .webhooks import process_webhook
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedWebhookRequest:
+    """
+    The parts of a webhook request needed to process it later: the raw body, headers and query params.
+    It can be passed to process_webhook() in place of the Request, which is gone once the response is sent.
+    """
+
+    def __init__(self, body: bytes, headers: Headers, query_params: QueryParams):
+        self.body = body
+        self.headers = headers
+        self.query_params = query_params
+        self.received_at = time.monotonic()
+
+    @classmethod
+    def from_body(cls, body: bytes, request) -> "QueuedWebhookRequest":
+        return cls(body=body, headers=request.headers, query_params=request.query_params)
+
+    async def json(self):
+        return json.loads(self.body)
+
+
+class WebhookQueue:
+    """
+    Bounded in-process queue of webhook requests, processed by worker coroutines.
+    The ingress only reads the body and enqueues it, so its latency doesn't depend on the processing.
+    Workers are started with the app, or on the first request.
+    """
+
+    def __init__(self, max_size: int = 1000, workers: int = 4):
+        self.max_size = max_size
+        self.workers = workers
+        self._queue = None
+        self._worker_tasks = []
+        self._loop = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        # The queue and the workers belong to the running event loop
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 30.0):
+        """
+        Waits for the queued requests to be processed, up to timeout seconds, and stops the workers.
+        """
+        if not self._queue:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.depth} webhook requests were not processed before stopping.")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._queue = None
+        self._worker_tasks = []
+
+    def put(self, webhook_request: QueuedWebhookRequest) -> bool:
+        """
+        Enqueues the request without waiting. Returns False if the queue is full.
+        """
+        if self._loop is not asyncio.get_running_loop():
+            self.start()
+        try:
+            self._queue.put_nowait(webhook_request)
+        except asyncio.QueueFull:
+            WEBHOOKS_REJECTED.inc()
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            webhook_request = await self._queue.get()
+            WEBHOOK_QUEUE_WAIT.observe(time.monotonic() - webhook_request.received_at)
+            try:
+                await process_webhook(request=webhook_request)
+            except Exception as e:
+                logger.exception(f"Error processing queued webhook: {type(e).__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+
+webhook_queue = WebhookQueue(max_size=settings.WEBHOOK_QUEUE_MAX_SIZE, workers=settings.WEBHOOK_QUEUE_WORKERS)
+WEBHOOKS_QUEUED.set_function(lambda: webhook_queue.depth)
@@ -1,16 +1,20 @@
+import asyncio
 import importlib
 import logging
 from fastapi import Request
 from app import settings
-from app.services.activity_logger import log_activity, publish_event
-from gundi_client_v2 import GundiClient
+from app.services.activity_logger import log_activity, log_webhook_activity, publish_event
 from gundi_core.events import IntegrationWebhookFailed, WebhookExecutionFailed
-from app.services.utils import DyntamicFactory
+from app.services.config_manager import IntegrationConfigurationManager
+from app.services.errors import IntegrationNotFound
+from app.services.utils import StructHexString, dynamic_models, generate_batches
 from app.webhooks.core import get_webhook_handler, DynamicSchemaConfig, HexStringConfig, GenericJsonPayload
 
-_portal = GundiClient()
+config_manager = IntegrationConfigurationManager()
 logger = logging.getLogger(__name__)
 
+MAX_REPORTED_ERRORS = 50  # Per activity log, to keep events small
+
 
 async def get_integration(request):
     integration = None
@@ -18,13 +22,75 @@ async def get_integration(request):
     consumer_integration = consumer_username.split(":")[-1] if consumer_username and consumer_username != "anonymous" else None
     integration_id = consumer_integration or request.headers.get("x-gundi-integration-id") or request.query_params.get("integration_id")
     if integration_id:
-        try:
-            integration = await _portal.get_integration_details(integration_id=integration_id)
+        try:  # Cached in memory and in redis, so webhook bursts don't reach the portal
+            integration = await config_manager.get_integration_details(integration_id)
+        except IntegrationNotFound:
+            logger.warning(f"Integration '{integration_id}' not found in the portal.")
         except Exception as e:
-            logger.warning(f"Error retrieving integration '{integration_id}' from the portal: {e}")
+            logger.warning(f"Error retrieving integration '{integration_id}': {e}")
     return integration
 
 
+def decode_hex_fields(items: list, payload_model, hex_data_field: str, hex_format: dict):
+    """
+    Decodes the hex strings of a list payload at once, instead of one by one while each item is parsed.
+    Items with their own format, and invalid values, are left to the payload validation.
+    """
+    field = payload_model.__fields__.get(hex_data_field)
+    if not field or field.type_ is not StructHexString:
+        return
+    batch = [
+        item for item in items
+        if item["hex_format"] is hex_format and item["hex_data_field"] == hex_data_field
+        and isinstance(item.get(hex_data_field), str)
+    ]
+    try:
+        decoded_values = StructHexString.parse_many([item[hex_data_field] for item in batch], hex_format)
+    except ValueError:
+        return
+    for item, decoded_value in zip(batch, decoded_values):
+        item[hex_data_field] = decoded_value
+
+
+def parse_payload_items(items: list, payload_model=None):
+    """
+    Validates each item of a list payload on its own, so one invalid item doesn't discard the rest.
+    Returns the parsed items and the errors of the invalid ones, as [{"index": 3, "error": "..."}].
+    """
+    if not payload_model:
+        return items, []
+    parsed_items, invalid_items = [], []
+    for index, item in enumerate(items):
+        try:
+            parsed_items.append(payload_model.parse_obj(item))
+        except Exception as e:
+            invalid_items.append({"index": index, "error": f"{type(e).__name__}: {str(e)}"})
+    return parsed_items, invalid_items
+
+
+async def deliver_batches(webhook_handler, items: list, integration, webhook_config):
+    """
+    Passes the items to the webhook handler in batches of WEBHOOK_BATCH_SIZE items (all at once if it's 0),
+    running up to WEBHOOK_MAX_CONCURRENT_BATCHES handlers at a time. An empty list is passed as is.
+    Returns the errors of the batches that failed, as [{"batch": 0, "items": 200, "error": "..."}].
+    """
+    batch_size = settings.WEBHOOK_BATCH_SIZE or len(items) or 1
+    semaphore = asyncio.Semaphore(settings.WEBHOOK_MAX_CONCURRENT_BATCHES)
+
+    async def deliver(batch):
+        async with semaphore:
+            await webhook_handler(payload=batch, integration=integration, webhook_config=webhook_config)
+
+    batches = list(generate_batches(items, batch_size)) or [items]
+    results = await asyncio.gather(*[deliver(batch) for batch in batches], return_exceptions=True)
+    failed_batches = []
+    for index, (batch, result) in enumerate(zip(batches, results)):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing webhook batch {index} ({len(batch)} items): {type(result).__name__}: {result}")
+            failed_batches.append({"batch": index, "items": len(batch), "error": f"{type(result).__name__}: {str(result)}"})
+    return failed_batches
+
+
 async def process_webhook(request: Request):
     try:
         # Try to relate the request to an integration
@@ -35,44 +101,87 @@ async def process_webhook(request: Request):
         # Parse config if a model was defined in webhooks/configurations.py
         webhook_config_data = integration.webhook_configuration.data if integration and integration.webhook_configuration else {}
         parsed_config = config_model.parse_obj(webhook_config_data) if config_model else {}
-        if parsed_config and issubclass(config_model, HexStringConfig):
-            json_content["hex_data_field"] = json_content.get("hex_data_field", parsed_config.hex_data_field)
-            json_content["hex_format"] = json_content.get("hex_format", parsed_config.hex_format)
+        is_hex_string_config = bool(parsed_config) and issubclass(config_model, HexStringConfig)
+        if is_hex_string_config:
+            for item in json_content if isinstance(json_content, list) else [json_content]:
+                item["hex_data_field"] = item.get("hex_data_field", parsed_config.hex_data_field)
+                item["hex_format"] = item.get("hex_format", parsed_config.hex_format)
         # Parse payload if a model was defined in webhooks/configurations.py
-        if payload_model:
-            try:
-                if issubclass(payload_model, GenericJsonPayload) and issubclass(config_model, DynamicSchemaConfig):
-                    # Build the model from a json schema
-                    model_factory = DyntamicFactory(
-                        json_schema=parsed_config.json_schema,
-                        base_model=payload_model,
-                        ref_template="definitions"
+        try:
+            if payload_model and issubclass(payload_model, GenericJsonPayload) and issubclass(config_model, DynamicSchemaConfig):
+                # Build the model from a json schema, or reuse the one built in previous requests
+                payload_model = dynamic_models.get_model(
+                    json_schema=parsed_config.json_schema,
+                    base_model=payload_model,
+                    ref_template="definitions",
+                    owner=str(integration.id) if integration else None
+                )
+            if isinstance(json_content, list):
+                if payload_model and is_hex_string_config:
+                    decode_hex_fields(
+                        items=json_content,
+                        payload_model=payload_model,
+                        hex_data_field=parsed_config.hex_data_field,
+                        hex_format=parsed_config.hex_format
                     )
-                    dynamic_payload_model = model_factory.make()
-                    if isinstance(json_content, list):
-                        parsed_payload = [dynamic_payload_model.parse_obj(d) for d in json_content]
-                    else:
-                        parsed_payload = dynamic_payload_model.parse_obj(json_content)
-                else:
-                    parsed_payload = payload_model.parse_obj(json_content)
-            except Exception as e:
-                message = f"Error parsing payload: {type(e).__name__}: {str(e)}. Please review configurations."
-                logger.exception(message)
+                # Invalid items are reported, without discarding the valid ones
+                parsed_payload, invalid_items = parse_payload_items(items=json_content, payload_model=payload_model)
+                if invalid_items and not parsed_payload:
+                    raise ValueError(f"All the {len(invalid_items)} items are invalid. First error: {invalid_items[0]['error']}")
+            elif payload_model:
+                parsed_payload = payload_model.parse_obj(json_content)
+            else:  # Pass the raw payload
+                parsed_payload = json_content
+        except Exception as e:
+            message = f"Error parsing payload: {type(e).__name__}: {str(e)}. Please review configurations."
+            logger.exception(message)
+            await publish_event(
+                event=IntegrationWebhookFailed(
+                    payload=WebhookExecutionFailed(
+                        integration_id=str(integration.id),
+                        webhook_id=str(integration.type.webhook.value),
+                        config_data=webhook_config_data,
+                        error=message
+                    )
+                ),
+                topic_name=settings.INTEGRATION_EVENTS_TOPIC,
+            )
+            return {}
+        if isinstance(json_content, list):
+            failed_batches = await deliver_batches(
+                webhook_handler=webhook_handler,
+                items=parsed_payload,
+                integration=integration,
+                webhook_config=parsed_config
+            )
+            if invalid_items:
+                await log_webhook_activity(
+                    integration_id=str(integration.id) if integration else None,
+                    webhook_id=str(integration.type.webhook.value) if integration and integration.type.webhook else "webhook",
+                    title=f"{len(invalid_items)} of {len(json_content)} webhook items are invalid and were not processed",
+                    level="WARNING",
+                    config_data=webhook_config_data,
+                    data={"items": len(json_content), "invalid_items": invalid_items[:MAX_REPORTED_ERRORS]}
+                )
+            if failed_batches:  # Handler errors are reported as failed webhooks, as with a single payload
+                failed_items = sum(b["items"] for b in failed_batches)
+                message = f"Error processing webhook: {failed_batches[0]['error']}"
+                if failed_items < len(parsed_payload):
+                    message += f" ({failed_items} of {len(parsed_payload)} items in {len(failed_batches)} batches failed)"
+                logger.error(message)
                 await publish_event(
                     event=IntegrationWebhookFailed(
                         payload=WebhookExecutionFailed(
-                            integration_id=str(integration.id),
-                            webhook_id=str(integration.type.webhook.value),
+                            integration_id=str(integration.id) if integration else None,
+                            webhook_id=str(integration.type.webhook.value) if integration and integration.type.webhook else None,
                             config_data=webhook_config_data,
                             error=message
                         )
                     ),
                     topic_name=settings.INTEGRATION_EVENTS_TOPIC,
                 )
-                return {}
-        else:  # Pass the raw payload
-            parsed_payload = json_content
-        await webhook_handler(payload=parsed_payload, integration=integration, webhook_config=parsed_config)
+        else:
+            await webhook_handler(payload=parsed_payload, integration=integration, webhook_config=parsed_config)
     except (ImportError, AttributeError, NotImplementedError) as e:
         message = "Webhooks handler not found. Please implement a 'webhook_handler' function in app/webhooks/handlers.py"
         logger.exception(message)
@@ -43,6 +43,8 @@ SENSORS_API_BASE_URL = env.str("SENSORS_API_BASE_URL", None)
 
 # Used in OTel traces/spans to set the 'environment' attribute, used on metrics calculation
 TRACE_ENVIRONMENT = env.str("TRACE_ENVIRONMENT", "dev")
+# Where spans are exported: "none", "console" or "otlp" (needs opentelemetry-exporter-otlp, set OTEL_EXPORTER_OTLP_* vars)
+TRACING_EXPORTER = env.str("TRACING_EXPORTER", "none")
 
 # GCP related settings
 GCP_PROJECT_ID = env.str("GCP_PROJECT_ID", "cdip-78ca")
@@ -62,12 +64,58 @@ REDIS_STATE_DB = env.int("REDIS_STATE_DB", 0)
 REDIS_CONFIGS_DB = env.int("REDIS_CONFIGS_DB", 1)  # ToDo: define a convention for DB numbers across services
 
 
+# In-process cache of integration details, in front of the Redis cache. Unknown integrations are cached for longer
+INTEGRATION_CACHE_SIZE = env.int("INTEGRATION_CACHE_SIZE", 1000)
+INTEGRATION_CACHE_TTL = env.float("INTEGRATION_CACHE_TTL", 30.0)  # seconds
+INTEGRATION_NOT_FOUND_TTL = env.int("INTEGRATION_NOT_FOUND_TTL", 300)  # seconds
+GUNDI_API_KEY_CACHE_TTL = env.float("GUNDI_API_KEY_CACHE_TTL", 300.0)  # seconds
+# The portal may not notify changes to webhook configurations, so they're reloaded from it periodically
+WEBHOOK_CONFIG_TTL = env.int("WEBHOOK_CONFIG_TTL", 300)  # seconds
+# Writes are broadcast over Redis pub/sub, so every instance invalidates its cache and entries can live longer
+CONFIG_CHANGES_CHANNEL = env.str("CONFIG_CHANGES_CHANNEL", "integration-config-changes")
+CONFIG_CHANGES_LISTENER_ENABLED = env.bool("CONFIG_CHANGES_LISTENER_ENABLED", True)
+INTEGRATION_CACHE_TTL_WITH_NOTIFICATIONS = env.float("INTEGRATION_CACHE_TTL_WITH_NOTIFICATIONS", 600.0)  # seconds
+
+# Warm up connections and caches on startup. /ready reports the instance as ready when it's done
+WARMUP_ENABLED = env.bool("WARMUP_ENABLED", True)
+WARMUP_INTEGRATIONS = env.int("WARMUP_INTEGRATIONS", 50)  # Most recently active integrations to preload (0 = none)
+WARMUP_CONCURRENCY = env.int("WARMUP_CONCURRENCY", 10)
+WARMUP_TIMEOUT = env.float("WARMUP_TIMEOUT", 30.0)  # seconds
+ACTIVE_INTEGRATIONS_TRACKED = env.int("ACTIVE_INTEGRATIONS_TRACKED", 1000)
+ACTIVE_INTEGRATIONS_RECORD_INTERVAL = env.int("ACTIVE_INTEGRATIONS_RECORD_INTERVAL", 300)  # seconds, per integration
+
+# Pull configuration events in batches from this subscription, in addition to the push endpoint
+CONFIG_EVENTS_SUBSCRIPTION = env.str("CONFIG_EVENTS_SUBSCRIPTION", None)  # e.g. projects/{project}/subscriptions/{name}
+CONFIG_EVENTS_BATCH_SIZE = env.int("CONFIG_EVENTS_BATCH_SIZE", 100)
+
 REGISTER_ON_START = env.bool("REGISTER_ON_START", False)
 INTEGRATION_TYPE_SLUG = env.str("INTEGRATION_TYPE_SLUG", None)  # Define a string id here e.g. "my_tracker"
 INTEGRATION_SERVICE_URL = env.str("INTEGRATION_SERVICE_URL", None)  # Define a string id here e.g. "my_tracker"
 PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND = env.bool("PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND", False)
 PROCESS_WEBHOOKS_IN_BACKGROUND = env.bool("PROCESS_WEBHOOKS_IN_BACKGROUND", True)
+# Enqueue webhook requests for worker coroutines instead. Requests are rejected (429) while the queue is full
+WEBHOOK_QUEUE_ENABLED = env.bool("WEBHOOK_QUEUE_ENABLED", False)
+WEBHOOK_QUEUE_MAX_SIZE = env.int("WEBHOOK_QUEUE_MAX_SIZE", 1000)
+WEBHOOK_QUEUE_WORKERS = env.int("WEBHOOK_QUEUE_WORKERS", 4)
+# List payloads are passed to the webhook handler in batches (0 = all the items at once), processed concurrently
+WEBHOOK_BATCH_SIZE = env.int("WEBHOOK_BATCH_SIZE", 0)
+WEBHOOK_MAX_CONCURRENT_BATCHES = env.int("WEBHOOK_MAX_CONCURRENT_BATCHES", 4)
+DYNAMIC_MODELS_CACHE_SIZE = env.int("DYNAMIC_MODELS_CACHE_SIZE", 128)  # Payload models built from webhook JSON schemas
+JQ_FILTERS_CACHE_SIZE = env.int("JQ_FILTERS_CACHE_SIZE", 128)  # Compiled jq filters of webhook configurations
 MAX_ACTION_EXECUTION_TIME = env.int("MAX_ACTION_EXECUTION_TIME", 60 * 9)  # 10 minutes is the maximum ack timeout
+# PubSub delivers at least once. Duplicated commands are ignored while running and for this many seconds after
+DEDUPLICATE_PUBSUB_COMMANDS = env.bool("DEDUPLICATE_PUBSUB_COMMANDS", True)
+COMMAND_DEDUPLICATION_WINDOW = env.int("COMMAND_DEDUPLICATION_WINDOW", 60)
+# Running commands hold a lease renewed every third of this, so redeliveries run soon if an instance crashes
+COMMAND_LEASE_TTL = env.int("COMMAND_LEASE_TTL", 60)
+# Concurrency limits for actions executed in this process. Extra actions wait in a queue, and are rejected when it's full
+MAX_CONCURRENT_ACTIONS = env.int("MAX_CONCURRENT_ACTIONS", 50)
+MAX_QUEUED_ACTIONS = env.int("MAX_QUEUED_ACTIONS", 100)
+ACTION_CONCURRENCY_LIMITS = env.dict("ACTION_CONCURRENCY_LIMITS", {}, subcast_values=int)  # e.g. "pull_observations=2"
+# Opt-in profiling (cProfile + tracemalloc) of the given actions and/or integrations, profiles are saved in PROFILES_DIR
+PROFILE_ACTIONS = env.list("PROFILE_ACTIONS", [])  # e.g. "pull_observations,fetch_collar_observations"
+PROFILE_INTEGRATIONS = env.list("PROFILE_INTEGRATIONS", [])  # Integration ids
+PROFILES_DIR = env.str("PROFILES_DIR", "/tmp/action-profiles")  # A local directory or a mounted bucket
 
 # Settings for system events & commands (EDA)
 INTEGRATION_EVENTS_TOPIC = env.str("INTEGRATION_EVENTS_TOPIC", "integration-events")
@@ -1 +1,7 @@
 # Add your integration-specific settings here
+from .base import env
+
+
+# Collars failing with 403/404 are retried with exponential backoff, starting at the initial value up to the max
+COLLAR_FAILURE_BACKOFF_INITIAL_MINUTES = env.int("COLLAR_FAILURE_BACKOFF_INITIAL_MINUTES", 30)
+COLLAR_FAILURE_BACKOFF_MAX_HOURS = env.int("COLLAR_FAILURE_BACKOFF_MAX_HOURS", 24)
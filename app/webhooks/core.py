@@ -1,9 +1,11 @@
+import functools
 import importlib
 import inspect
 import json
 from typing import Optional, Union
 from pydantic import BaseModel
 from fastapi.encoders import jsonable_encoder
+from app.services.jq_transforms import jq_transform
 from app.services.utils import StructHexString, UISchemaModelMixin, FieldWithUIOptions, UIOptions
 
 
@@ -37,6 +39,12 @@ class JQTransformConfig(UISchemaModelMixin, BaseModel):
         )
     )
 
+    def transform(self, data, per_item: bool = False):
+        """
+        Transforms the webhook payload with the jq filter, compiled once and reused. See jq_transform().
+        """
+        return jq_transform(data, jq_filter=self.jq_filter, per_item=per_item)
+
 
 class GenericJsonTransformConfig(JQTransformConfig, DynamicSchemaConfig):
     output_type: str = FieldWithUIOptions(
@@ -93,19 +101,21 @@ class GenericJsonWithHexStrPayload(HexStringPayload, GenericJsonPayload):
     pass
 
 
+@functools.cache  # Handlers are discovered once. Errors aren't cached, so it's retried on the next call
 def get_webhook_handler():
 
     # Import the module using importlib
     module = importlib.import_module("app.webhooks.handlers")
     handler = module.webhook_handler
+    signature = inspect.signature(handler)
 
-    if (annotation := inspect.signature(handler).parameters.get("payload").annotation) != inspect._empty:
+    if (annotation := signature.parameters.get("payload").annotation) != inspect._empty:
         payload_model = annotation
     else:
         payload_model = None
 
     # Introspect schemas
-    if (annotation := inspect.signature(handler).parameters.get("webhook_config").annotation) != inspect._empty:
+    if (annotation := signature.parameters.get("webhook_config").annotation) != inspect._empty:
         config_model = annotation
     else:
         config_model = None
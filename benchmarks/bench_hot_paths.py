@@ -0,0 +1,326 @@
+"""
+Micro-benchmarks of the hot paths: parsing, transforming, batching and serializing data.
+Each benchmark runs with synthetic inputs of the given sizes (rows) and reports the time and the memory allocated.
+
+Usage:
+    python -m benchmarks.bench_hot_paths --sizes 10,1000,100000 --output before.json
+    python -m benchmarks.bench_hot_paths --sizes 10,1000,100000 --compare before.json
+    python -m benchmarks.bench_hot_paths --benchmark transform --benchmark generate_batches --sizes 1000000
+"""
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import click
+
+
+SEED = 42
+DEFAULT_SIZES = "10,1000,100000"
+MIN_MEASUREMENT_TIME = 0.2  # seconds per repetition, short runs are looped to reach it
+
+HEX_FORMAT = {
+    "byte_order": ">",
+    "fields": [
+        {"name": "start_bit", "format": "B", "output_type": "int"},
+        {"name": "v", "format": "I", "output_type": "int"},
+        {"name": "lat", "format": "i", "output_type": "int"},
+        {"name": "lon", "format": "i", "output_type": "int"},
+        {"name": "temperature", "format": "h", "output_type": "int"},
+        {
+            "name": "status",
+            "format": "B",
+            "output_type": "hex",
+            "bit_fields": [
+                {"name": "gps_fix", "start_bit": 0, "end_bit": 0, "output_type": "bool"},
+                {"name": "moving", "start_bit": 1, "end_bit": 1, "output_type": "bool"},
+                {"name": "battery_level", "start_bit": 2, "end_bit": 5, "output_type": "int"},
+            ],
+        },
+    ],
+}
+
+WEBHOOK_JSON_SCHEMA = {
+    "title": "DeviceMessage",
+    "type": "object",
+    "required": ["device_id", "received_at", "lat", "lon"],
+    "properties": {
+        "device_id": {"title": "Device Id", "type": "string"},
+        "received_at": {"title": "Received At", "type": "string"},
+        "lat": {"title": "Lat", "type": "number"},
+        "lon": {"title": "Lon", "type": "number"},
+        "altitude": {"title": "Altitude", "type": "number"},
+        "speed_kmph": {"title": "Speed Kmph", "type": "integer"},
+        "moving": {"title": "Moving", "type": "boolean"},
+        "tags": {"title": "Tags", "type": "array", "items": {}},
+    },
+}
+
+
+def make_vectronic_rows(rows):
+    rnd = random.Random(SEED)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "idCollar": 10000 + i % 500,
+            "acquisitionTime": (start + timedelta(minutes=15 * i)).strftime("%Y-%m-%dT%H:%M:%S"),
+            "originCode": "I",
+            "ecefX": rnd.randint(-6000000, 6000000),
+            "ecefY": rnd.randint(-6000000, 6000000),
+            "ecefZ": rnd.randint(-6000000, 6000000),
+            "latitude": rnd.uniform(-3.0, -2.0),
+            "longitude": rnd.uniform(35.0, 36.0),
+            "height": rnd.randint(1000, 2000),
+            "dop": rnd.uniform(1.0, 5.0),
+            "mainVoltage": 3.6,
+            "backupVoltage": 3.1,
+            "temperature": rnd.uniform(10.0, 35.0),
+        }
+        for i in range(rows)
+    ]
+
+
+def make_observations(rows):
+    from app.actions.client import VectronicObservation
+    return [VectronicObservation.parse_obj(row) for row in make_vectronic_rows(rows)]
+
+
+def make_hex_strings(rows):
+    import struct
+    rnd = random.Random(SEED)
+    packer = struct.Struct(">BIiihB")
+    return [
+        packer.pack(
+            1, i, rnd.randint(-90000000, 90000000), rnd.randint(-180000000, 180000000),
+            rnd.randint(-400, 600), rnd.randint(0, 255)
+        ).hex()
+        for i in range(rows)
+    ]
+
+
+def make_events(rows):
+    from gundi_core.events import IntegrationActionComplete, ActionExecutionComplete
+    return [
+        IntegrationActionComplete(
+            payload=ActionExecutionComplete(
+                integration_id="779ff3ab-5589-4f4c-9e0a-ae8d6c9edff0",
+                action_id="fetch_collar_observations",
+                config_data={"start": "2024-01-01T00:00:00+00:00", "collar_id": 10000 + i, "collar_key": "K" * 64},
+                result={"observations_extracted": i % 200},
+            )
+        )
+        for i in range(rows)
+    ]
+
+
+# Setup functions build the input (not measured), run functions do the work being measured
+def setup_parse_obj(rows):
+    from app.actions.client import VectronicObservation
+    return VectronicObservation, make_vectronic_rows(rows)
+
+
+def run_parse_obj(inputs):
+    model, data = inputs
+    return [model.parse_obj(item) for item in data]
+
+
+def setup_transform(rows):
+    from app.actions.handlers import transform
+    return transform, make_observations(rows)
+
+
+def run_transform(inputs):
+    transform, observations = inputs
+    return [transform(observation) for observation in observations]
+
+
+def setup_generate_batches(rows):
+    from app.actions.handlers import transform
+    from app.services.utils import generate_batches
+    return generate_batches, [transform(observation) for observation in make_observations(rows)]
+
+
+def run_generate_batches(inputs):
+    generate_batches, data = inputs
+    return list(generate_batches(data, 200))
+
+
+def setup_struct_hex_string(rows):
+    from app.services.utils import StructHexString
+    return StructHexString, make_hex_strings(rows)
+
+
+def run_struct_hex_string(inputs):
+    struct_hex_string, hex_strings = inputs
+    values = {"hex_format": HEX_FORMAT}
+    return [struct_hex_string.validate(value, values, None).unpacked_data for value in hex_strings]
+
+
+def run_struct_hex_string_batch(inputs):
+    # List payloads are decoded at once, see decode_hex_fields() in app/services/webhooks.py
+    struct_hex_string, hex_strings = inputs
+    return [value.unpacked_data for value in struct_hex_string.parse_many(hex_strings, HEX_FORMAT)]
+
+
+JQ_FILTER = '{source: .device_id, recorded_at: .received_at, location: {lat: .lat, lon: .lon}, additional: {moving}}'
+
+
+def setup_jq_transform(rows):
+    from app.services.jq_transforms import jq_transform
+    return jq_transform, [
+        {"device_id": f"device-{i}", "received_at": "2024-06-07T15:08:20Z", "lat": -2.38, "lon": 37.33, "moving": True}
+        for i in range(rows)
+    ]
+
+
+def run_jq_transform(inputs):
+    # List payloads, as the generic json webhooks receive them
+    jq_transform, payload = inputs
+    return jq_transform(payload, JQ_FILTER, per_item=True)
+
+
+def setup_dyntamic_factory_make(rows):
+    from app.services.utils import DyntamicFactory
+    return DyntamicFactory, rows
+
+
+def run_dyntamic_factory_make(inputs):
+    # One model per webhook request, as the webhooks with a dynamic schema do
+    factory, rows = inputs
+    return [factory(WEBHOOK_JSON_SCHEMA).make() for _ in range(rows)]
+
+
+def setup_publish_event_serialization(rows):
+    return make_events(rows)
+
+
+def run_publish_event_serialization(events):
+    # As done in publish_event()
+    return [json.dumps(event.dict(), default=str).encode("utf-8") for event in events]
+
+
+# name -> (setup, run, max rows). Rows over the max are skipped, as they'd take minutes
+BENCHMARKS = {
+    "vectronic_parse_obj": (setup_parse_obj, run_parse_obj, 1_000_000),
+    "transform": (setup_transform, run_transform, 1_000_000),
+    "generate_batches": (setup_generate_batches, run_generate_batches, 1_000_000),
+    "struct_hex_string": (setup_struct_hex_string, run_struct_hex_string, 1_000_000),
+    "struct_hex_string_batch": (setup_struct_hex_string, run_struct_hex_string_batch, 1_000_000),
+    "jq_transform": (setup_jq_transform, run_jq_transform, 1_000_000),
+    "dyntamic_factory_make": (setup_dyntamic_factory_make, run_dyntamic_factory_make, 10_000),
+    "publish_event_serialization": (setup_publish_event_serialization, run_publish_event_serialization, 1_000_000),
+}
+
+
+def measure(run, inputs, repeat):
+    # Loop short runs so timer resolution doesn't dominate
+    start = time.perf_counter()
+    run(inputs)
+    first_run = time.perf_counter() - start
+    loops = max(1, int(MIN_MEASUREMENT_TIME / first_run)) if first_run > 0 else 1000
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            run(inputs)
+        timings.append((time.perf_counter() - start) / loops)
+    # Allocations are measured in a separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    run(inputs)
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings, allocated, peak
+
+
+def run_benchmark(name, rows, repeat):
+    setup, run, _ = BENCHMARKS[name]
+    inputs = setup(rows)
+    timings, allocated, peak = measure(run, inputs, repeat)
+    best = min(timings)
+    return {
+        "benchmark": name,
+        "rows": rows,
+        "best_seconds": best,
+        "median_seconds": statistics.median(timings),
+        "rows_per_second": round(rows / best, 1),
+        "ns_per_row": round(best / rows * 1e9, 1),
+        "peak_allocated_bytes": peak,
+        "retained_bytes": allocated,
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    baseline_results = {(r["benchmark"], r["rows"]): r for r in baseline["results"]}
+    click.echo(f"\nCompared with {baseline.get('commit')}:")
+    for result in results:
+        if not (previous := baseline_results.get((result["benchmark"], result["rows"]))):
+            continue
+        time_change = result["best_seconds"] / previous["best_seconds"] - 1
+        memory_change = (
+            result["peak_allocated_bytes"] / previous["peak_allocated_bytes"] - 1
+            if previous["peak_allocated_bytes"] else 0
+        )
+        click.echo(
+            f"  {result['benchmark']:<30} {result['rows']:>9} rows  "
+            f"time {time_change:+.1%}  peak memory {memory_change:+.1%}"
+        )
+
+
+@click.command()
+@click.option(
+    "--benchmark", "names", multiple=True, type=click.Choice(list(BENCHMARKS)),
+    help="Benchmarks to run (all by default)"
+)
+@click.option("--sizes", default=DEFAULT_SIZES, help="Comma separated input sizes (rows), e.g. 10,1000,1000000")
+@click.option("--repeat", default=5, help="Repetitions of each measurement, the best one is reported")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Save the results in a JSON file")
+@click.option(
+    "--compare", "baseline_path", type=click.Path(exists=True, dir_okay=False), default=None,
+    help="Results of a previous run (--output) to compare with"
+)
+def main(names, sizes, repeat, output, baseline_path):
+    results = []
+    for name in names or BENCHMARKS:
+        max_rows = BENCHMARKS[name][2]
+        for rows in (int(size) for size in sizes.split(",")):
+            if rows > max_rows:
+                click.echo(f"Skipping {name} with {rows} rows (max {max_rows})", err=True)
+                continue
+            result = run_benchmark(name, rows, repeat)
+            click.echo(
+                f"{name:<30} {rows:>9} rows  {result['best_seconds'] * 1000:>10.3f} ms  "
+                f"{result['ns_per_row']:>10.1f} ns/row  {result['peak_allocated_bytes'] / 1024:>10.1f} KiB peak",
+                err=True
+            )
+            results.append(result)
+
+    report = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
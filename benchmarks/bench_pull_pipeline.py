@@ -0,0 +1,167 @@
+"""
+Throughput benchmark of the pull pipeline: pull_observations -> fetch_collar_observations, through the real
+PubSub push endpoint, against local fake services (see fakes.py) and fakeredis (or a local Redis).
+
+Usage:
+    python -m benchmarks.bench_pull_pipeline --collars 500 --fixes-per-hour 4 --vectronic-latency-ms 100
+    python -m benchmarks.bench_pull_pipeline --output results.json --min-throughput 2000 --max-p99 5
+"""
+import asyncio
+import base64
+import functools
+import json
+import os
+import resource
+import sys
+import time
+from collections import Counter, defaultdict
+
+import click
+
+from benchmarks.fakes import FakeUpstreams, INTEGRATION_ID
+
+
+COMMANDS_TOPIC = "benchmark-actions-topic"
+EVENTS_TOPIC = "benchmark-events-topic"
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def use_fake_redis():
+    # Must run before the app is imported, as the state managers connect on import
+    import fakeredis
+    import redis.asyncio
+    redis.asyncio.Redis = functools.partial(fakeredis.FakeAsyncRedis, server=fakeredis.FakeServer())
+
+
+def get_redis_calls() -> int:
+    from prometheus_client import REGISTRY
+    return int(sum(
+        sample.value
+        for metric in REGISTRY.collect() if metric.name == "upstream_call_seconds"
+        for sample in metric.samples
+        if sample.name == "upstream_call_seconds_count" and sample.labels.get("service") == "redis"
+    ))
+
+
+async def run_benchmark(collars, fixes_per_hour, vectronic_latency, gundi_latency, local_redis):
+    upstreams = await FakeUpstreams(
+        collars=collars,
+        fixes_per_hour=fixes_per_hour,
+        vectronic_latency=vectronic_latency,
+        gundi_latency=gundi_latency,
+    ).start()
+    os.environ.update(upstreams.get_environment())
+    os.environ.update({
+        "GCP_PROJECT_ID": "benchmark",
+        "INTEGRATION_COMMANDS_TOPIC": COMMANDS_TOPIC,
+        "INTEGRATION_EVENTS_TOPIC": EVENTS_TOPIC,
+        "TRIGGER_ACTIONS_ALWAYS_SYNC": "false",
+        "PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND": "false",
+    })
+    os.environ.setdefault("LOGGING_LEVEL", "WARNING")
+    if not local_redis:
+        use_fake_redis()
+
+    # Imported here so the settings are read from the environment set above
+    import httpx
+    from gundi_core.commands import RunIntegrationAction
+    from app.main import app
+    from app.services.activity_logger import publish_event
+
+    latencies = defaultdict(list)
+    responses = Counter()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None)
+
+    async def push_command(envelope):
+        action_id = json.loads(base64.b64decode(envelope["message"]["data"]))["action_id"]
+        start = time.perf_counter()
+        response = await client.post("/", json=envelope)
+        latencies[action_id].append(time.perf_counter() - start)
+        responses[response.status_code] += 1
+
+    upstreams.subscribe(COMMANDS_TOPIC, push_command)
+    try:
+        start = time.perf_counter()
+        await publish_event(
+            RunIntegrationAction(integration_id=INTEGRATION_ID, action_id="pull_observations"),
+            COMMANDS_TOPIC
+        )
+        await upstreams.drain()
+        wall_time = time.perf_counter() - start
+    finally:
+        await client.aclose()
+        await upstreams.stop()
+
+    fetch_latencies = latencies["fetch_collar_observations"]
+    return {
+        "scenario": {
+            "collars": collars,
+            "fixes_per_hour": fixes_per_hour,
+            "vectronic_latency_seconds": vectronic_latency,
+            "gundi_latency_seconds": gundi_latency,
+            "redis": "local" if local_redis else "fakeredis",
+        },
+        "wall_time_seconds": round(wall_time, 3),
+        "observations": upstreams.observations_received,
+        "observations_per_second": round(upstreams.observations_received / wall_time, 1),
+        "fetch_latency_seconds": {
+            "count": len(fetch_latencies),
+            "p50": percentile(fetch_latencies, 50),
+            "p95": percentile(fetch_latencies, 95),
+            "p99": percentile(fetch_latencies, 99),
+            "max": max(fetch_latencies, default=None),
+        },
+        # ru_maxrss is in kilobytes on Linux
+        "memory_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "upstream_calls": {**upstreams.calls, "redis": get_redis_calls()},
+        "responses": {str(status): count for status, count in responses.items()},
+    }
+
+
+@click.command()
+@click.option("--collars", default=100, help="Collars set in the integration")
+@click.option("--fixes-per-hour", default=4, help="GPS fixes per collar and hour (12 hours are fetched)")
+@click.option("--vectronic-latency-ms", default=50, help="Latency added to Vectronic responses")
+@click.option("--gundi-latency-ms", default=20, help="Latency added to Gundi API responses")
+@click.option("--local-redis", is_flag=True, help="Use the Redis set in REDIS_HOST/REDIS_PORT instead of fakeredis")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Save the results in a JSON file")
+@click.option("--min-throughput", type=float, default=None, help="Fail if observations/sec is lower")
+@click.option("--max-p99", type=float, default=None, help="Fail if the p99 fetch latency (seconds) is higher")
+def main(collars, fixes_per_hour, vectronic_latency_ms, gundi_latency_ms, local_redis, output, min_throughput, max_p99):
+    results = asyncio.run(
+        run_benchmark(
+            collars=collars,
+            fixes_per_hour=fixes_per_hour,
+            vectronic_latency=vectronic_latency_ms / 1000,
+            gundi_latency=gundi_latency_ms / 1000,
+            local_redis=local_redis,
+        )
+    )
+    click.echo(json.dumps(results, indent=2))
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if min_throughput is not None and results["observations_per_second"] < min_throughput:
+        failures.append(f"Throughput {results['observations_per_second']} obs/s is lower than {min_throughput}")
+    p99 = results["fetch_latency_seconds"]["p99"]
+    if max_p99 is not None and (p99 is None or p99 > max_p99):
+        failures.append(f"p99 fetch latency {p99}s is higher than {max_p99}s")
+    expected_observations = collars * fixes_per_hour * 12
+    if results["observations"] < expected_observations:
+        failures.append(f"Only {results['observations']} of {expected_observations} observations were delivered")
+    for failure in failures:
+        click.echo(failure, err=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
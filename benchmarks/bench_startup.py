@@ -0,0 +1,91 @@
+"""
+Import time of the app, as paid on every cold start, measured in fresh interpreters with python -X importtime.
+Reports the total and the modules that take the longest to import, and fails if the total is over a budget.
+
+Usage:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --budget 1.5 --top 30 --output startup.json
+"""
+import json
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import click
+
+
+DEFAULT_MODULE = "app.main"
+DEFAULT_BUDGET = 2.0  # seconds, importing app.main on a developer machine takes ~1s
+
+
+def parse_importtime(output: str) -> list:
+    """
+    Parses the output of python -X importtime into [{"module", "self_seconds", "cumulative_seconds", "depth"}]
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({
+            "module": name.strip(),
+            "self_seconds": int(self_us) / 1e6,
+            "cumulative_seconds": int(cumulative_us) / 1e6,
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+        })
+    return modules
+
+
+def measure_import(module: str) -> list:
+    # A new interpreter each time, so nothing is imported already
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True
+    )
+    return parse_importtime(result.stderr)
+
+
+def get_total(modules: list, module: str) -> float:
+    return next(m["cumulative_seconds"] for m in modules if m["module"] == module and m["depth"] == 0)
+
+
+@click.command()
+@click.option("--module", default=DEFAULT_MODULE, help="Module to import")
+@click.option("--repeat", default=5, help="Imports to measure, the best one is reported")
+@click.option("--top", default=20, help="Slowest modules to show")
+@click.option("--budget", type=float, default=DEFAULT_BUDGET, help="Fail (exit code 1) if the import takes longer (seconds)")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Save the results in a JSON file")
+def main(module, repeat, top, budget, output):
+    runs = [measure_import(module) for _ in range(repeat)]
+    totals = [get_total(modules, module) for modules in runs]
+    best_run = runs[totals.index(min(totals))]
+    slowest = sorted(best_run, key=lambda m: m["self_seconds"], reverse=True)[:top]
+    first_party = [m for m in best_run if m["module"].startswith("app.") and m["depth"] > 0]
+    click.echo(f"import {module}: best {min(totals):.3f}s, median {statistics.median(totals):.3f}s (budget {budget}s)")
+    click.echo("\nSlowest modules (own time):")
+    for m in slowest:
+        click.echo(f"  {m['self_seconds'] * 1000:>8.1f} ms  {m['module']}")
+    click.echo("\nApp modules (cumulative time):")
+    for m in sorted(first_party, key=lambda m: m["cumulative_seconds"], reverse=True)[:top]:
+        click.echo(f"  {m['cumulative_seconds'] * 1000:>8.1f} ms  {m['module']}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({
+                "module": module,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "best_seconds": min(totals),
+                "median_seconds": statistics.median(totals),
+                "budget_seconds": budget,
+                "modules": best_run,
+            }, f, indent=2)
+    if min(totals) > budget:
+        click.echo(f"\nImporting {module} takes {min(totals):.3f}s, over the budget of {budget}s.", err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Local stand-ins for the services used by the pull pipeline: Vectronic, Keycloak, the Gundi API,
+the Gundi sensors API and the PubSub emulator API. They all run in one aiohttp server,
+so the integration code is exercised end to end with real HTTP calls.
+"""
+import asyncio
+import base64
+import json
+import random
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+
+INTEGRATION_ID = "4c9b4f3a-0c43-4a8b-a3a0-6a3c0f7f1e11"
+KEYCLOAK_REALM = "benchmark"
+
+
+class FakeUpstreams:
+    """
+    Fake upstream services with configurable latency. Calls are counted by service in `calls`.
+    :param collars: number of collars set in the integration
+    :param fixes_per_hour: GPS fixes generated per collar and hour
+    :param vectronic_latency: seconds added to each Vectronic response
+    :param gundi_latency: seconds added to each Gundi (API and sensors API) response
+    """
+
+    def __init__(self, collars=100, fixes_per_hour=4, vectronic_latency=0.05, gundi_latency=0.02, seed=42):
+        self.collars = collars
+        self.fixes_per_hour = fixes_per_hour
+        self.vectronic_latency = vectronic_latency
+        self.gundi_latency = gundi_latency
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.observations_received = 0
+        self.base_url = None
+        self._subscriptions = {}  # topic -> push handler
+        self._pushes = set()
+        self._runner = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=32 * 1024 ** 2)
+        app.add_routes([
+            web.get("/vectronic/v2/collar/{collar_id}/gps", self.get_collar_fixes),
+            web.post(f"/keycloak/realms/{KEYCLOAK_REALM}/protocol/openid-connect/token", self.get_token),
+            web.get("/gundi/v2/integrations/{integration_id}/", self.get_integration),
+            web.get("/gundi/v2/integrations/{integration_id}/api-key/", self.get_api_key),
+            web.post("/sensors/v2/observations/", self.post_observations),
+            web.post("/v1/projects/{project}/topics/{topic}", self.publish),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}"
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def get_environment(self) -> dict:
+        """
+        Environment variables pointing the integration to the fake services.
+        """
+        return {
+            "GUNDI_API_BASE_URL": f"{self.base_url}/gundi",
+            "SENSORS_API_BASE_URL": f"{self.base_url}/sensors",
+            "KEYCLOAK_ISSUER": f"{self.base_url}/keycloak/realms/{KEYCLOAK_REALM}",
+            "KEYCLOAK_CLIENT_ID": "benchmark",
+            "KEYCLOAK_CLIENT_SECRET": "benchmark",
+            "PUBSUB_EMULATOR_HOST": self.base_url.replace("http://", ""),
+        }
+
+    def subscribe(self, topic: str, push_handler):
+        """
+        Push messages published in the topic to the handler, as a PubSub push subscription would.
+        The handler receives the push request body.
+        """
+        self._subscriptions[topic] = push_handler
+
+    async def drain(self):
+        """
+        Waits until every pushed message is processed, including the ones published meanwhile.
+        """
+        while self._pushes:
+            await asyncio.gather(*self._pushes)
+
+    # Vectronic
+    async def get_collar_fixes(self, request):
+        self.calls["vectronic"] += 1
+        await asyncio.sleep(self.vectronic_latency)
+        collar_id = int(request.match_info["collar_id"])
+        after = datetime.fromisoformat(request.query["afterScts"]).replace(tzinfo=timezone.utc)
+        interval = timedelta(hours=1) / self.fixes_per_hour
+        now = datetime.now(timezone.utc)
+        fixes = []
+        fix_time = after + interval
+        while fix_time <= now:
+            fixes.append({
+                "idCollar": collar_id,
+                "acquisitionTime": fix_time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "originCode": "I",
+                "ecefX": 5432101,
+                "ecefY": 2345678,
+                "ecefZ": -1234567,
+                "latitude": round(self.random.uniform(-3.0, -2.0), 6),
+                "longitude": round(self.random.uniform(35.0, 36.0), 6),
+                "height": self.random.randint(1000, 2000),
+                "dop": round(self.random.uniform(1.0, 5.0), 1),
+                "mainVoltage": 3.6,
+                "backupVoltage": 3.1,
+                "temperature": round(self.random.uniform(10.0, 35.0), 1),
+            })
+            fix_time += interval
+        return web.json_response(fixes)
+
+    # Keycloak
+    async def get_token(self, request):
+        self.calls["keycloak"] += 1
+        return web.json_response({
+            "access_token": uuid.uuid4().hex,
+            "refresh_token": uuid.uuid4().hex,
+            "token_type": "Bearer",
+            "expires_in": 300,
+            "refresh_expires_in": 1800,
+        })
+
+    # Gundi API
+    async def get_integration(self, request):
+        self.calls["gundi_api"] += 1
+        await asyncio.sleep(self.gundi_latency)
+        return web.json_response(self.get_integration_details())
+
+    async def get_api_key(self, request):
+        self.calls["gundi_api"] += 1
+        await asyncio.sleep(self.gundi_latency)
+        return web.json_response({"api_key": "benchmark-api-key"})
+
+    # Gundi sensors API
+    async def post_observations(self, request):
+        self.calls["sensors_api"] += 1
+        await asyncio.sleep(self.gundi_latency)
+        observations = await request.json()
+        self.observations_received += len(observations)
+        return web.json_response([{"object_id": str(uuid.uuid4())} for _ in observations], status=201)
+
+    # PubSub emulator API
+    async def publish(self, request):
+        self.calls["pubsub"] += 1
+        topic, _, method = request.match_info["topic"].partition(":")
+        if method != "publish":
+            raise web.HTTPNotFound()
+        body = await request.json()
+        message_ids = []
+        for message in body["messages"]:
+            message_id = str(self.random.getrandbits(48))
+            message_ids.append(message_id)
+            if push_handler := self._subscriptions.get(topic):
+                envelope = {
+                    "message": {
+                        "data": message["data"],
+                        "attributes": message.get("attributes", {}),
+                        "messageId": message_id,
+                        "publishTime": datetime.now(timezone.utc).isoformat(),
+                    },
+                    "subscription": f"projects/{request.match_info['project']}/subscriptions/{topic}-sub",
+                }
+                push = asyncio.create_task(push_handler(envelope))
+                self._pushes.add(push)
+                push.add_done_callback(self._pushes.discard)
+        return web.json_response({"messageIds": message_ids})
+
+    def get_integration_details(self) -> dict:
+        collars = [
+            {
+                "parsedData": {
+                    "collarID": str(10000 + i),
+                    "collarType": "GPS Plus",
+                    "comID": f"com-{i}",
+                    "comType": "Iridium",
+                    "key": base64.b64encode(f"collar-key-{i}".encode()).decode(),
+                }
+            }
+            for i in range(self.collars)
+        ]
+        action = {
+            "id": "75b3040f-ab1f-42e7-b39f-8965c088b154",
+            "type": "pull",
+            "name": "Pull Observations",
+            "value": "pull_observations",
+        }
+        return {
+            "id": INTEGRATION_ID,
+            "name": "Vectronic Benchmark",
+            "base_url": f"{self.base_url}/vectronic",
+            "enabled": True,
+            "type": {
+                "id": "b4e7c9a0-0d63-4a53-9b54-70a0a9d5c2b1",
+                "name": "Vectronic",
+                "value": "vectronic",
+                "description": "",
+                "actions": [{**action, "description": "", "schema": {}}],
+            },
+            "owner": {"id": "a91b400b-482a-4546-8fcb-ee42b01deeb6", "name": "Benchmark Org", "description": ""},
+            "configurations": [
+                {
+                    "id": "5577c323-b961-4277-9047-b1f27fd6a1b7",
+                    "integration": INTEGRATION_ID,
+                    "action": action,
+                    "data": {"files": json.dumps(collars), "default_lookback_hours": 12},
+                }
+            ],
+            "additional": {},
+            "default_route": None,
+            "status": "healthy",
+            "status_details": "",
+        }